@@ -0,0 +1,491 @@
+#!/usr/bin/env python3
+"""End-to-end benchmarks for the sandwich bot against local fake API servers.
+
+One local HTTP server stands in for the OpenAI Images, Stability AI,
+Replicate (create, poll and download) and Facebook Graph endpoints, with
+configurable latency, error rate and image size; ``--graph-usage`` scripts
+the rate-limit usage headers the fake Graph API returns. Each scenario runs the
+bot's provider methods or ``create_and_post`` under concurrent load and
+reports latency percentiles, throughput, peak RSS and how many HTTP
+connections the bot opened. ``--engine asyncio`` runs the same operations
+as coroutines of one AsyncTurkeyProvoloneBot on a single event loop
+(requires aiohttp).
+
+    python benchmarks/bench.py --iterations 50 --concurrency 4 --latency 0.05
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import base64
+import json
+import math
+import os
+import random
+import resource
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from email.parser import BytesParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any, Callable
+from urllib.parse import parse_qs, urlparse
+
+SCENARIOS = ("openai", "stability", "replicate", "create_and_post")
+ENGINES = ("threads", "asyncio")
+
+
+class FakeApiServer(ThreadingHTTPServer):
+    """Threaded stand-in for every API the bot calls, counting accepted connections."""
+
+    daemon_threads = True
+
+    def __init__(
+        self,
+        latency: float = 0.0,
+        jitter: float = 0.0,
+        error_rate: float = 0.0,
+        image_bytes: int = 256 * 1024,
+        replicate_polls: int = 1,
+        graph_usage: list[float] | None = None,
+    ) -> None:
+        super().__init__(("127.0.0.1", 0), FakeApiHandler)
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.replicate_polls = replicate_polls
+        self.graph_usage = graph_usage or []
+        self.graph_responses = 0
+        self.image = b"\x89PNG\r\n\x1a\n" + os.urandom(max(image_bytes - 8, 0))
+        self.encoded_image = base64.b64encode(self.image).decode("ascii")
+        self.predictions: dict[str, dict[str, int]] = {}
+        # Scripted comments per post id, oldest first, and the query of every comment page request.
+        self.comments: dict[str, list[dict[str, Any]]] = {}
+        self.comment_queries: list[dict[str, str]] = []
+        # Path and form fields of every direct Graph post, leaving out an uploaded file.
+        self.graph_posts: list[tuple[str, dict[str, str]]] = []
+        # Scripted error responses as (path prefix, status, headers); each answers the first request it matches.
+        self.scripted_errors: list[tuple[str, int, dict[str, str]]] = []
+        self.lock = threading.Lock()
+        self.connections = 0
+        self.requests = 0
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def process_request(self, request: Any, client_address: Any) -> None:
+        with self.lock:
+            self.connections += 1
+        super().process_request(request, client_address)
+
+    def reset_counters(self) -> tuple[int, int]:
+        with self.lock:
+            counts = (self.connections, self.requests)
+            self.connections = self.requests = 0
+        return counts
+
+
+class FakeApiHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server: FakeApiServer
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
+
+    def do_GET(self) -> None:
+        self._handle("GET")
+
+    def do_POST(self) -> None:
+        self._handle("POST")
+
+    def do_HEAD(self) -> None:
+        self._handle("HEAD")
+
+    def _handle(self, method: str) -> None:
+        server = self.server
+        with server.lock:
+            server.requests += 1
+        body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        path = urlparse(self.path).path
+        if server.latency or server.jitter:
+            time.sleep(max(0.0, server.latency + random.uniform(-server.jitter, server.jitter)))
+        if self._scripted_error(path):
+            return
+
+        if path.startswith("/files/"):
+            if self._failed():
+                return
+            self._send(200, server.image, "image/png")
+            return
+        if path.startswith("/graph/"):
+            self._graph(method, path[len("/graph/") :], body)
+            return
+        if self._failed():
+            return
+        if path == "/openai/v1/models":
+            self._send_json({"data": []})
+        elif path == "/openai/v1/images/generations":
+            count = int(json.loads(body or b"{}").get("n") or 1)
+            self._send_json({"data": [{"b64_json": server.encoded_image}] * count})
+        elif path.startswith("/stability/v1/generation/"):
+            count = int(json.loads(body or b"{}").get("samples") or 1)
+            self._send_json({"artifacts": [{"base64": server.encoded_image}] * count})
+        elif path == "/replicate/v1/predictions" and method == "POST":
+            count = int(json.loads(body or b"{}").get("input", {}).get("num_outputs") or 1)
+            prediction_id = uuid.uuid4().hex
+            # Replicate holds a "Prefer: wait" request open until the prediction finishes.
+            waited = int("wait" in self.headers.get("Prefer", ""))
+            with server.lock:
+                server.predictions[prediction_id] = {"outputs": count, "polls": 0, "waited": waited}
+            self._send_json(self._prediction(prediction_id), 201)
+        elif path.startswith("/replicate/v1/predictions/"):
+            prediction_id = path.rsplit("/", 1)[1]
+            with server.lock:
+                server.predictions.setdefault(prediction_id, {"outputs": 1, "polls": 0, "waited": 0})["polls"] += 1
+            self._send_json(self._prediction(prediction_id))
+        else:
+            self._send_json({"error": {"message": f"unknown path {path}"}}, 404)
+
+    def _prediction(self, prediction_id: str) -> dict[str, Any]:
+        state = self.server.predictions[prediction_id]
+        if not state["waited"] and state["polls"] < self.server.replicate_polls:
+            return {"id": prediction_id, "status": "processing"}
+        return {
+            "id": prediction_id,
+            "status": "succeeded",
+            "output": [
+                f"{self.server.base_url}/files/{prediction_id}_{index}.png" for index in range(state["outputs"])
+            ],
+        }
+
+    def _usage_headers(self, page_id: str | None) -> dict[str, str]:
+        """The next scripted usage percentage as Graph API usage headers; the script repeats its last value."""
+        server = self.server
+        if not server.graph_usage:
+            return {}
+        with server.lock:
+            usage = server.graph_usage[min(server.graph_responses, len(server.graph_usage) - 1)]
+            server.graph_responses += 1
+        reading = json.dumps({"call_count": usage, "total_cputime": usage / 2, "total_time": usage / 2})
+        headers = {"X-App-Usage": reading}
+        if page_id:
+            headers["X-Page-Usage"] = reading
+        return headers
+
+    def _graph(self, method: str, path: str, body: bytes) -> None:
+        parts = path.strip("/").split("/")
+        if len(parts) == 1:
+            operations = json.loads(parse_qs(body.decode("utf-8")).get("batch", ["[]"])[0])
+            results = []
+            for operation in operations:
+                if random.random() < self.server.error_rate:
+                    results.append({"code": 500, "body": json.dumps({"error": {"message": "injected error"}})})
+                    continue
+                relative_url = urlparse(operation["relative_url"])
+                target = relative_url.path.split("/")
+                if operation["method"] == "GET" and target[1:] == ["comments"]:
+                    payload: dict[str, Any] = self._comments(target[0], parse_qs(relative_url.query))
+                elif operation["method"] == "GET" and len(target) == 1:
+                    payload = {"id": target[0], "name": f"Page {target[0]}", "access_token": "page"}
+                else:
+                    payload = {"id": f"{target[0]}_{uuid.uuid4().int % 10**12}"}
+                results.append({"code": 200, "body": json.dumps(payload)})
+            self._send_json(results, headers=self._usage_headers(None))
+            return
+        if self._failed():
+            return
+        with self.server.lock:
+            self.server.graph_posts.append((path, self._form_fields(body)))
+        post_id = f"{parts[1]}_{uuid.uuid4().int % 10**12}"
+        payload = {"id": post_id, "post_id": post_id} if parts[-1] == "photos" else {"id": post_id}
+        self._send_json(payload, headers=self._usage_headers(parts[1]))
+
+    def _form_fields(self, body: bytes) -> dict[str, str]:
+        content_type = self.headers.get("Content-Type", "")
+        if not content_type.startswith("multipart/"):
+            return {name: values[0] for name, values in parse_qs(body.decode("utf-8")).items()}
+        message = BytesParser().parsebytes(f"Content-Type: {content_type}\r\n\r\n".encode("ascii") + body)
+        return {
+            part.get_param("name", header="Content-Disposition"): part.get_payload(decode=True).decode("utf-8")
+            for part in message.get_payload()
+            if not part.get_filename()
+        }
+
+    def _comments(self, post_id: str, query: dict[str, list[str]]) -> dict[str, Any]:
+        """One page of the scripted comments on ``post_id``, honouring ``since``, ``after`` and ``limit``.
+
+        The ``after`` cursor is the position after the last comment returned,
+        so comments scripted later show up on the next request that passes it.
+        """
+        server = self.server
+        params = {name: values[0] for name, values in query.items() if name != "access_token"}
+        with server.lock:
+            server.comment_queries.append({"post_id": post_id, **params})
+            comments = list(enumerate(server.comments.get(post_id, [])))
+        since = int(params.get("since", 0))
+        start = int(params.get("after", 0))
+        matching = [
+            (position, comment)
+            for position, comment in comments[start:]
+            if datetime.strptime(comment["created_time"], "%Y-%m-%dT%H:%M:%S%z").timestamp() >= since
+        ]
+        page = matching[: int(params.get("limit", 25))]
+        after = page[-1][0] + 1 if page else start
+        paging: dict[str, Any] = {"cursors": {"after": str(after)}}
+        if len(matching) > len(page):
+            paging["next"] = f"{server.base_url}/graph/{post_id}/comments?after={after}"
+        return {"data": [comment for _, comment in page], "paging": paging}
+
+    def _scripted_error(self, path: str) -> bool:
+        with self.server.lock:
+            for index, (prefix, status, headers) in enumerate(self.server.scripted_errors):
+                if path.startswith(prefix):
+                    del self.server.scripted_errors[index]
+                    break
+            else:
+                return False
+        self._send_json({"error": {"message": f"scripted {status}"}}, status, headers)
+        return True
+
+    def _failed(self) -> bool:
+        if random.random() >= self.server.error_rate:
+            return False
+        self._send_json({"error": {"message": "injected error"}}, 500)
+        return True
+
+    def _send_json(self, payload: Any, status: int = 200, headers: dict[str, str] | None = None) -> None:
+        self._send(status, json.dumps(payload).encode("utf-8"), "application/json", headers)
+
+    def _send(self, status: int, data: bytes, content_type: str, headers: dict[str, str] | None = None) -> None:
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(data)
+
+
+def configure_environment(server: FakeApiServer, data_dir: Path, save_images: bool) -> None:
+    """Point the bot at the fake server and keep its runtime files out of the repository."""
+    os.environ.update(
+        SANDWICH_DATA_DIR=str(data_dir),
+        FACEBOOK_ACCESS_TOKEN="benchmark",
+        FACEBOOK_PAGE_ID="1000",
+        FACEBOOK_GRAPH_URL=f"{server.base_url}/graph",
+        OPENAI_API_BASE=f"{server.base_url}/openai/v1",
+        STABILITY_API_BASE=f"{server.base_url}/stability/v1",
+        REPLICATE_API_BASE=f"{server.base_url}/replicate/v1",
+        REPLICATE_SYNC_WAIT="0",
+        CREDENTIAL_CACHE_TTL="0",
+        IMAGE_CACHE="0",
+        IMAGE_OUTPUT_FORMAT="original",
+        SAVE_GENERATED_IMAGES="1" if save_images else "0",
+    )
+    for name in ("FACEBOOK_PAGE_IDS", "OPENAI_API_KEY", "STABILITY_API_KEY", "REPLICATE_API_TOKEN", "CUSTOM_MESSAGE"):
+        os.environ.pop(name, None)
+
+
+def percentile(values: list[float], fraction: float) -> float:
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, max(0, math.ceil(fraction * len(ordered)) - 1))]
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS.
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def run_scenario(
+    name: str, make_bot: Callable[[], Any], iterations: int, concurrency: int, server: FakeApiServer
+) -> dict[str, Any]:
+    """Run one scenario with a bot, and its own session, per worker thread."""
+    local = threading.local()
+
+    def operation(_: int) -> tuple[float, bool]:
+        bot = getattr(local, "bot", None)
+        if bot is None:
+            bot = local.bot = make_bot()
+        started = time.perf_counter()
+        if name == "create_and_post":
+            post_content, image_path, image_data = bot.prepare_post()
+            has_image = bool(image_path or image_data or post_content.get("image_url"))
+            ok = bot.publish_post(post_content, image_path, image_data) and has_image
+        else:
+            ok = bool(getattr(bot, f"generate_images_with_{name}")("A turkey and provolone sandwich", 1))
+        return time.perf_counter() - started, ok
+
+    server.reset_counters()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(operation, range(iterations)))
+    elapsed = time.perf_counter() - started
+    return summarize(name, results, elapsed, iterations, concurrency, server)
+
+
+def run_scenario_async(
+    name: str, make_bot: Callable[[], Any], iterations: int, concurrency: int, server: FakeApiServer
+) -> dict[str, Any]:
+    """Run one scenario as coroutines that share one async bot, at most ``concurrency`` at a time."""
+
+    async def run() -> tuple[list[tuple[float, bool]], float]:
+        semaphore = asyncio.Semaphore(concurrency)
+        async with make_bot() as bot:
+
+            async def operation() -> tuple[float, bool]:
+                async with semaphore:
+                    started = time.perf_counter()
+                    if name == "create_and_post":
+                        post_content, image_path, image_data = await bot.prepare_post_async()
+                        published = await bot.publish_post_async(post_content, image_path, image_data)
+                        ok = published and bool(image_path or image_data)
+                    else:
+                        generate = getattr(bot, f"generate_images_with_{name}_async")
+                        ok = bool(await generate("A turkey and provolone sandwich", 1))
+                    return time.perf_counter() - started, ok
+
+            started = time.perf_counter()
+            results = await asyncio.gather(*(operation() for _ in range(iterations)))
+            return list(results), time.perf_counter() - started
+
+    server.reset_counters()
+    results, elapsed = asyncio.run(run())
+    return summarize(name, results, elapsed, iterations, concurrency, server)
+
+
+def summarize(
+    name: str,
+    results: list[tuple[float, bool]],
+    elapsed: float,
+    iterations: int,
+    concurrency: int,
+    server: FakeApiServer,
+) -> dict[str, Any]:
+    connections, requests_served = server.reset_counters()
+    latencies = [latency for latency, _ in results]
+    errors = sum(1 for _, ok in results if not ok)
+    return {
+        "scenario": name,
+        "iterations": iterations,
+        "concurrency": concurrency,
+        "errors": errors,
+        "error_rate": errors / iterations if iterations else 0.0,
+        "throughput": iterations / elapsed if elapsed else 0.0,
+        "p50": percentile(latencies, 0.5),
+        "p90": percentile(latencies, 0.9),
+        "p99": percentile(latencies, 0.99),
+        "max": max(latencies, default=0.0),
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+        "connections": connections,
+        "requests": requests_served,
+    }
+
+
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Benchmark the sandwich bot against local fake API servers")
+    parser.add_argument(
+        "--scenarios", default=",".join(SCENARIOS), help="comma-separated subset of " + ", ".join(SCENARIOS)
+    )
+    parser.add_argument("--iterations", type=int, default=20, help="operations per scenario")
+    parser.add_argument(
+        "--concurrency", type=int, default=4, help="worker threads, each with its own bot, or in-flight coroutines"
+    )
+    parser.add_argument("--engine", choices=ENGINES, default="threads", help="blocking bots in threads, or asyncio")
+    parser.add_argument("--latency", type=float, default=0.02, help="fake server latency per request in seconds")
+    parser.add_argument("--jitter", type=float, default=0.0, help="uniform +/- jitter added to the latency")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests answered with HTTP 500")
+    parser.add_argument("--image-bytes", type=int, default=256 * 1024, help="size of each generated image")
+    parser.add_argument("--replicate-polls", type=int, default=1, help="status polls before a prediction succeeds")
+    parser.add_argument(
+        "--provider", choices=SCENARIOS[:3], default="openai", help="image provider for create_and_post"
+    )
+    parser.add_argument(
+        "--graph-usage",
+        default="",
+        help="comma-separated usage percentages the fake Graph API reports on successive responses, e.g. 40,80,95",
+    )
+    parser.add_argument("--save-images", action="store_true", help="write generated images to disk during posts")
+    parser.add_argument("--json", type=Path, help="also write the results to this JSON file")
+    return parser.parse_args(argv)
+
+
+def main(argv: list[str] | None = None) -> int:
+    args = parse_args(argv)
+    scenarios = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    unknown = sorted(set(scenarios) - set(SCENARIOS))
+    if unknown:
+        print(f"Unknown scenario(s): {', '.join(unknown)}")
+        return 2
+
+    try:
+        graph_usage = [float(value) for value in args.graph_usage.split(",") if value.strip()]
+    except ValueError:
+        print(f"Invalid --graph-usage: {args.graph_usage}")
+        return 2
+    server = FakeApiServer(
+        args.latency, args.jitter, args.error_rate, args.image_bytes, args.replicate_polls, graph_usage
+    )
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    credentials = {"openai": "openai_api_key", "stability": "stability_api_key", "replicate": "replicate_api_token"}
+
+    with tempfile.TemporaryDirectory(prefix="sandwich-bench-") as data_dir:
+        configure_environment(server, Path(data_dir), args.save_images)
+        sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+        import sandwiches
+
+        def bot_factory(provider: str) -> Callable[[], Any]:
+            def make_bot() -> Any:
+                if args.engine == "asyncio":
+                    bot = sandwiches.AsyncTurkeyProvoloneBot()
+                else:
+                    bot = sandwiches.TurkeyProvoloneBot()
+                setattr(bot, credentials[provider], "benchmark")
+                bot.allowed_download_schemes = frozenset({"http", "https"})
+                return bot
+
+            return make_bot
+
+        if args.engine == "asyncio" and sandwiches.load_aiohttp() is None:
+            print("--engine asyncio needs aiohttp: pip install aiohttp")
+            return 2
+        if args.engine == "asyncio":
+            # One shared async bot; let it open as many connections as the threads engine's bots would.
+            os.environ["HTTP_POOL_SIZE"] = str(max(1, args.concurrency))
+        run = run_scenario_async if args.engine == "asyncio" else run_scenario
+        results = []
+        for name in scenarios:
+            provider = args.provider if name == "create_and_post" else name
+            results.append(run(name, bot_factory(provider), max(1, args.iterations), max(1, args.concurrency), server))
+        server.shutdown()
+
+    header = (
+        f"{'scenario':<16}{'ops/s':>9}{'p50 ms':>9}{'p90 ms':>9}{'p99 ms':>9}"
+        f"{'errors':>8}{'conns':>7}{'reqs':>7}{'RSS MB':>9}"
+    )
+    print(header)
+    print("-" * len(header))
+    for result in results:
+        print(
+            f"{result['scenario']:<16}{result['throughput']:>9.1f}{result['p50'] * 1000:>9.1f}"
+            f"{result['p90'] * 1000:>9.1f}{result['p99'] * 1000:>9.1f}{result['errors']:>8}"
+            f"{result['connections']:>7}{result['requests']:>7}{result['peak_rss_mb']:>9.1f}"
+        )
+    if args.json:
+        settings = {**vars(args), "json": str(args.json)}
+        args.json.write_text(json.dumps({"settings": settings, "results": results}, indent=2) + "\n")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -3,429 +3,5767 @@
 
 from __future__ import annotations
 
-import base64
+import argparse
+import asyncio
+import atexit
+import binascii
+import bisect
+import difflib
+import email.utils
+import functools
+import hashlib
+import io
+import itertools
 import json
 import logging
+import logging.handlers
+import math
 import os
+import queue
 import random
+import signal
+import socket
+import sqlite3
+import sys
+import tempfile
+import threading
 import time
-from datetime import datetime, timezone
+import weakref
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import AbstractContextManager, ExitStack, closing, contextmanager, nullcontext
+from datetime import datetime, timedelta, timezone
 from pathlib import Path
-from typing import Any
-from urllib.parse import quote, urlparse
+from typing import Any, AsyncIterator, Awaitable, BinaryIO, Callable, Iterator, Sequence
+from urllib.parse import quote, unquote, urlencode, urlparse
 
 import requests
+from requests.adapters import HTTPAdapter
 
 
 BASE_DIR = Path(__file__).resolve().parent
-LOG_DIR = BASE_DIR / "logs"
-REPORT_DIR = BASE_DIR / "reports"
-SAVED_POST_DIR = BASE_DIR / "saved_posts"
-GENERATED_IMAGE_DIR = BASE_DIR / "generated_images"
+DATA_DIR = Path(os.getenv("SANDWICH_DATA_DIR") or BASE_DIR).resolve()
+LOG_DIR = DATA_DIR / "logs"
+REPORT_DIR = DATA_DIR / "reports"
+SAVED_POST_DIR = DATA_DIR / "saved_posts"
+GENERATED_IMAGE_DIR = DATA_DIR / "generated_images"
 SHOP_FILE = BASE_DIR / "sandwich_shops.json"
+SHOP_SNAPSHOT_FILE = DATA_DIR / ".cache" / "shops.json"
+SHOP_SNAPSHOT_VERSION = 1
+SHOP_FIELDS = ("name", "location", "specialty", "added_by", "date_added", "status")
+SHOP_FUZZY_CUTOFF = 0.6
 
 DEFAULT_TIMEOUT = (10, 60)
 POLL_TIMEOUT = (10, 30)
+RUN_DEADLINE = 12 * 60.0
+HTTP_MAX_RETRIES = 3
+HTTP_RETRY_BASE_DELAY = 1.0
+HTTP_RETRY_MAX_DELAY = 30.0
+HTTP_RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
 MAX_IMAGE_BYTES = 15 * 1024 * 1024
 MAX_CUSTOM_MESSAGE_LENGTH = 2_000
 FACEBOOK_API_VERSION = "v18.0"
+GRAPH_API_BASE = "https://graph.facebook.com"
+IMAGE_PROVIDER_MODES = ("serial", "race", "hedged")
+DEFAULT_HEDGE_DELAY = 5.0
+PROVIDER_ROUTING_STRATEGIES = ("latency", "cost", "fixed")
+PROVIDER_COSTS = {"OpenAI": 0.04, "Stability AI": 0.006, "Replicate": 0.004}
+ROUTER_EWMA_ALPHA = 0.3
+ROUTER_FAILURE_THRESHOLD = 3
+ROUTER_COOLDOWN = 15 * 60.0
+ROUTER_DEFAULT_LATENCY = 20.0
+ROUTER_MIN_SUCCESS_RATE = 0.05
+GRAPH_USAGE_HEADERS = ("X-App-Usage", "X-Page-Usage", "X-Business-Use-Case-Usage")
+GRAPH_BUCKET_FIELDS = ("usage", "updated_at", "tokens", "refilled_at", "blocked_until")
+GRAPH_USAGE_THRESHOLD = 75.0
+GRAPH_THROTTLE_RATE = 1.0
+GRAPH_THROTTLE_BURST = 5.0
+GRAPH_THROTTLE_COOLDOWN = 60.0
+GRAPH_THROTTLE_RECHECK = 1.0
+GRAPH_USAGE_WINDOW = 60 * 60.0
+REPLICATE_API_BASE = "https://api.replicate.com/v1"
+OPENAI_API_BASE = "https://api.openai.com/v1"
+STABILITY_API_BASE = "https://api.stability.ai/v1"
+REPLICATE_MODEL_VERSION = "39ed52f2a78e934b3ba6e2a89f5b1c712de7dfea535525255b1aa35c5565e08b"
+REPLICATE_SYNC_WAIT = 60
+REPLICATE_MAX_WAIT = 300.0
+REPLICATE_POLL_INITIAL_DELAY = 0.5
+REPLICATE_POLL_MAX_DELAY = 5.0
+REPLICATE_POLL_BACKOFF = 1.5
+REPLICATE_RESUME_TTL = 3600
+REPLICATE_WEBHOOK_HOST = "127.0.0.1"
+REPLICATE_WEBHOOK_PORT = 8787
+REPLICATE_WEBHOOK_CHECK_INTERVAL = 0.1
+MAX_WEBHOOK_BODY_BYTES = 1024 * 1024
+STABILITY_ENGINE = "stable-diffusion-xl-1024-v1-0"
+IMAGE_CACHE_DIR = GENERATED_IMAGE_DIR / "cache"
+IMAGE_CACHE_MAX_BYTES = 200 * 1024 * 1024
+IMAGE_CACHE_REUSE_AFTER = 10
+IMAGE_CACHE_POLICIES = ("lru", "lfu")
+IMAGE_POOL_DIR = GENERATED_IMAGE_DIR / "pool"
+IMAGE_HASH_INDEX_FILE = GENERATED_IMAGE_DIR / "hash_index.jsonl"
+IMAGE_HASH_SCAN_BATCH = 500
+IMAGE_DEDUP_ACTIONS = ("regenerate", "skip", "off")
+IMAGE_DEDUP_DISTANCE = 6
+IMAGE_DEDUP_WINDOW_DAYS = 7.0
+IMAGE_DEDUP_RETRIES = 2
+OPENAI_MAX_BATCH = 10
+STABILITY_MAX_BATCH = 10
+REPLICATE_MAX_BATCH = 4
+BASE64_DECODE_CHUNK = 64 * 1024
+MAX_JSON_OVERHEAD_BYTES = 64 * 1024
+UPLOAD_BLOCK_SIZE = 64 * 1024
+IMAGE_FORMATS = {
+    "jpeg": ("image/jpeg", ".jpg"),
+    "png": ("image/png", ".png"),
+    "webp": ("image/webp", ".webp"),
+    "gif": ("image/gif", ".gif"),
+}
+IMAGE_OUTPUT_FORMATS = ("jpeg", "webp", "original")
+IMAGE_QUALITY = 85
+IMAGE_MAX_DIMENSION = 2048
+GRAPH_BATCH_LIMIT = 50
+PAGE_CONCURRENCY = 8
+GENERATION_CONCURRENCY = 4
+DEFAULT_POOL_SIZE = 10
+DEFAULT_POST_SCHEDULE = "0 14 * * *"
+IMAGE_LEAD_SECONDS = 300.0
+SCHEDULE_MIN_LEAD = 10 * 60.0
+SCHEDULE_MAX_AHEAD = 30 * 24 * 60 * 60.0
+SCHEDULE_UPLOAD_ATTEMPTS = 3
+HEARTBEAT_FILE = LOG_DIR / "heartbeat.json"
+HEARTBEAT_INTERVAL = 30.0
+FAILED_POST_DB = SAVED_POST_DIR / "failed_posts.db"
+POST_HISTORY_DB = LOG_DIR / "post_history.db"
+LEGACY_RECENT_POSTS_FILE = LOG_DIR / "recent_posts.json"
+POLL_CONCURRENCY = 4
+POLL_WINDOW_DAYS = 7.0
+POLL_MAX_POSTS = 500
+POLL_MAX_PAGES = 10
+POLL_COMMENT_PAGE_SIZE = 100
+POLL_INSIGHT_METRICS = "post_impressions,post_engaged_users"
+CREDENTIAL_CACHE_FILE = DATA_DIR / ".cache" / "credentials.json"
+CREDENTIAL_CACHE_TTL = 3600.0
+CAPTION_STATE_FILE = LOG_DIR / "caption_cursor.json"
+FEATURED_SHOP_STATE_FILE = LOG_DIR / "featured_shop_cursor.json"
+PROVIDER_HEALTH_FILE = LOG_DIR / "provider_health.json"
+GRAPH_USAGE_FILE = LOG_DIR / "graph_usage.json"
+FEISTEL_ROUNDS = 4
+RETRY_CONCURRENCY = 4
+RETRY_MAX_ATTEMPTS = 8
+RETRY_BASE_DELAY = 60.0
+RETRY_MAX_DELAY = 6 * 60 * 60.0
+RETRY_LEASE_SECONDS = 300.0
+LOG_FILE = LOG_DIR / "bot.log"
+ACTIVITY_LOG_FILE = LOG_DIR / "sandwich_shop_activity.log"
+LOG_FORMATS = ("text", "json")
+LOG_ROTATIONS = ("size", "time")
+LOG_MAX_BYTES = 10 * 1024 * 1024
+LOG_BACKUP_COUNT = 5
+LOG_STRUCTURED_FIELDS = ("post_id", "page_id", "provider", "duration", "image_style")
+PROFILE_SAMPLE_INTERVAL = 0.005
+PROFILE_TOP = 30
 
-for directory in (LOG_DIR, REPORT_DIR, SAVED_POST_DIR, GENERATED_IMAGE_DIR):
-    directory.mkdir(parents=True, exist_ok=True)
-
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s - %(levelname)s - %(message)s",
-    handlers=[
-        logging.FileHandler(LOG_DIR / "bot.log", encoding="utf-8"),
-        logging.StreamHandler(),
-    ],
-)
 logger = logging.getLogger(__name__)
+activity_logger = logging.getLogger(f"{__name__}.activity")
+_log_listener: logging.handlers.QueueListener | None = None
+_log_queue_handler: logging.handlers.QueueHandler | None = None
+
+ImageGenerator = Callable[[str, int], list[bytes]]
+AsyncImageGenerator = Callable[[str, int], Awaitable[list[bytes]]]
+
+
+class DeadlineExceeded(requests.RequestException):
+    """The run deadline ran out before or during an HTTP request."""
+
+    def __init__(self, stage: str) -> None:
+        super().__init__(f"run deadline exhausted during {stage}")
+        self.stage = stage
+
+
+def load_pillow() -> Any:
+    """Return ``PIL.Image`` if Pillow is installed, importing it on first use."""
+    try:
+        from PIL import Image
+    except ImportError:  # Pillow is optional; without it images are uploaded as generated.
+        return None
+    return Image
+
+
+def load_aiohttp() -> Any:
+    """Return the ``aiohttp`` module if it is installed, importing it on first use."""
+    try:
+        import aiohttp
+    except ImportError:  # aiohttp is optional; only AsyncTurkeyProvoloneBot needs it.
+        return None
+    return aiohttp
+
+
+def ensure_directories() -> None:
+    """Create the runtime directories that the workflow uploads as artifacts."""
+    for directory in (LOG_DIR, REPORT_DIR, SAVED_POST_DIR, GENERATED_IMAGE_DIR):
+        directory.mkdir(parents=True, exist_ok=True)
+
+
+class JsonLinesFormatter(logging.Formatter):
+    """One JSON object per record, including structured ``extra`` fields such as post_id."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry: dict[str, Any] = {
+            "timestamp": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for field in LOG_STRUCTURED_FIELDS:
+            if hasattr(record, field):
+                entry[field] = getattr(record, field)
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class ActivityFormatter(logging.Formatter):
+    """``[<UTC ISO timestamp>] message`` lines, the format the workflow summary tails."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        return f"[{datetime.fromtimestamp(record.created, timezone.utc).isoformat()}] {record.getMessage()}"
+
+
+def _rotating_file_handler(path: Path) -> logging.Handler:
+    """File handler that rotates by size or, with LOG_ROTATION=time, by LOG_ROTATE_WHEN."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    backup_count = int(TurkeyProvoloneBot._get_float_env("LOG_BACKUP_COUNT", LOG_BACKUP_COUNT))
+    rotation = (TurkeyProvoloneBot._get_env("LOG_ROTATION") or "size").lower()
+    if rotation not in LOG_ROTATIONS:
+        logger.warning("Unknown LOG_ROTATION %r; rotating by size", rotation)
+    if rotation == "time":
+        return logging.handlers.TimedRotatingFileHandler(
+            path,
+            when=TurkeyProvoloneBot._get_env("LOG_ROTATE_WHEN") or "midnight",
+            backupCount=backup_count,
+            encoding="utf-8",
+            utc=True,
+        )
+    return logging.handlers.RotatingFileHandler(
+        path,
+        maxBytes=int(TurkeyProvoloneBot._get_float_env("LOG_MAX_BYTES", LOG_MAX_BYTES)),
+        backupCount=backup_count,
+        encoding="utf-8",
+    )
+
+
+def configure_logging() -> None:
+    """Log to ``logs/bot.log`` and the console; called by the CLI, not on import.
+
+    Records go through a ``QueueHandler`` and are written by a background
+    ``QueueListener``, so file I/O stays off the posting threads. Both log
+    files rotate, ``bot.log`` is written as JSON lines with LOG_FORMAT=json,
+    and queued records are flushed at exit.
+    """
+    global _log_listener, _log_queue_handler
+    if _log_listener is not None:
+        return
+
+    log_format = (TurkeyProvoloneBot._get_env("LOG_FORMAT") or "text").lower()
+    if log_format not in LOG_FORMATS:
+        log_format = "text"
+    text_formatter = logging.Formatter("%(asctime)s - %(levelname)s - %(message)s")
+    file_handler = _rotating_file_handler(LOG_FILE)
+    file_handler.setFormatter(JsonLinesFormatter() if log_format == "json" else text_formatter)
+    console_handler = logging.StreamHandler()
+    console_handler.setFormatter(text_formatter)
+    activity_handler = _rotating_file_handler(ACTIVITY_LOG_FILE)
+    activity_handler.setFormatter(ActivityFormatter())
+    activity_handler.addFilter(lambda record: record.name == activity_logger.name)
+    for handler in list(activity_logger.handlers):
+        activity_logger.removeHandler(handler)
+        handler.close()
+
+    log_queue: queue.SimpleQueue[logging.LogRecord] = queue.SimpleQueue()
+    _log_queue_handler = logging.handlers.QueueHandler(log_queue)
+    _log_listener = logging.handlers.QueueListener(
+        log_queue, console_handler, file_handler, activity_handler, respect_handler_level=True
+    )
+    _log_listener.start()
+    root_logger = logging.getLogger()
+    root_logger.setLevel(logging.INFO)
+    root_logger.addHandler(_log_queue_handler)
+    atexit.register(shutdown_logging)
+
+
+def shutdown_logging() -> None:
+    """Stop the logging listener, writing out every queued record, and close the log files."""
+    global _log_listener, _log_queue_handler
+    if _log_listener is None:
+        return
+    listener, _log_listener = _log_listener, None
+    logging.getLogger().removeHandler(_log_queue_handler)
+    _log_queue_handler = None
+    listener.stop()
+    for handler in listener.handlers:
+        handler.close()
+
+
+def sniff_image_format(data: bytes | bytearray | memoryview) -> str | None:
+    """Detect an image format from its magic bytes."""
+    header = bytes(data[:12])
+    if header.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "png"
+    if header.startswith(b"\xff\xd8\xff"):
+        return "jpeg"
+    if header[:4] == b"RIFF" and header[8:12] == b"WEBP":
+        return "webp"
+    if header[:6] in {b"GIF87a", b"GIF89a"}:
+        return "gif"
+    return None
+
+
+def image_extension(data: bytes | bytearray | memoryview) -> str:
+    """File extension for ``data``, falling back to ``.jpg`` for unknown formats."""
+    return IMAGE_FORMATS.get(sniff_image_format(data) or "jpeg", IMAGE_FORMATS["jpeg"])[1]
+
+
+class ReplicateWebhookListener:
+    """Small local HTTP listener that wakes Replicate pollers on webhook delivery.
+
+    The webhook body is only used to find the prediction id. The poller
+    always re-reads the prediction from the Replicate API, so an
+    unauthenticated caller can at most cause one early status poll. It
+    binds to loopback unless ``host`` opts in to other interfaces.
+    """
+
+    def __init__(self, port: int, host: str = REPLICATE_WEBHOOK_HOST) -> None:
+        # Imported here so module import stays fast when webhooks are unused.
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        self._events: dict[str, threading.Event] = {}
+        self._lock = threading.Lock()
+        listener = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self) -> None:
+                length = int(self.headers.get("Content-Length") or 0)
+                if length <= 0 or length > MAX_WEBHOOK_BODY_BYTES:
+                    self.send_response(413 if length > 0 else 400)
+                    self.end_headers()
+                    return
+                try:
+                    payload = json.loads(self.rfile.read(length))
+                except ValueError:
+                    payload = None
+                prediction_id = payload.get("id") if isinstance(payload, dict) else None
+                if prediction_id:
+                    listener.notify(str(prediction_id))
+                self.send_response(204)
+                self.end_headers()
+
+            def log_message(self, format: str, *args: Any) -> None:
+                logger.debug("Replicate webhook: " + format, *args)
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, name="replicate-webhook", daemon=True)
+        self._thread.start()
+        logger.info("Listening for Replicate webhooks on %s:%s", host, self.port)
+
+    @property
+    def port(self) -> int:
+        return self._server.server_address[1]
+
+    def event_for(self, prediction_id: str) -> threading.Event:
+        with self._lock:
+            return self._events.setdefault(prediction_id, threading.Event())
+
+    def notify(self, prediction_id: str) -> None:
+        with self._lock:
+            event = self._events.get(prediction_id)
+        if event is not None:
+            event.set()
+
+    def release(self, prediction_id: str) -> None:
+        with self._lock:
+            self._events.pop(prediction_id, None)
+
+    def close(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+
+class ImageCache:
+    """Content-addressed on-disk image cache bounded by a byte budget.
+
+    Entries are keyed by a hash of provider, model and full prompt and are
+    tracked in ``index.json`` together with hit/miss counters and a post
+    counter. An entry may be reused only after ``reuse_after`` other posts
+    have gone out since it was last posted.
+    """
+
+    def __init__(
+        self,
+        directory: Path = IMAGE_CACHE_DIR,
+        max_bytes: int = IMAGE_CACHE_MAX_BYTES,
+        policy: str = "lru",
+        reuse_after: int = IMAGE_CACHE_REUSE_AFTER,
+    ) -> None:
+        self.directory = directory
+        self.index_path = directory / "index.json"
+        self.max_bytes = max_bytes
+        self.policy = policy if policy in IMAGE_CACHE_POLICIES else "lru"
+        self.reuse_after = reuse_after
+        self._lock = threading.Lock()
+        self._index: dict[str, Any] | None = None
+
+    @staticmethod
+    def make_key(provider: str, model: str, prompt: str) -> str:
+        return hashlib.sha256("\0".join((provider, model, prompt)).encode("utf-8")).hexdigest()
+
+    def _load(self) -> dict[str, Any]:
+        if self._index is not None:
+            return self._index
+
+        index: dict[str, Any] = {"entries": {}, "hits": 0, "misses": 0, "evictions": 0, "post_count": 0}
+        try:
+            with self.index_path.open("r", encoding="utf-8") as file:
+                loaded = json.load(file)
+            if isinstance(loaded, dict) and isinstance(loaded.get("entries"), dict):
+                index.update(loaded)
+        except FileNotFoundError:
+            pass
+        except (OSError, json.JSONDecodeError) as exc:
+            logger.warning("Ignoring unreadable image cache index: %s", exc)
+
+        index["entries"] = {
+            key: entry
+            for key, entry in index["entries"].items()
+            if isinstance(entry, dict) and (self.directory / str(entry.get("file"))).is_file()
+        }
+        self._index = index
+        return index
+
+    def _save(self) -> None:
+        self.directory.mkdir(parents=True, exist_ok=True)
+        TurkeyProvoloneBot._atomic_write_json(self.index_path, self._index)
+
+    def _reusable(self, entry: dict[str, Any], post_count: int) -> bool:
+        last_posted = entry.get("last_posted")
+        return last_posted is None or post_count - int(last_posted) >= self.reuse_after
+
+    def lookup(self, keys: list[str]) -> Path | None:
+        """Return the first cached image for ``keys`` that the reuse policy allows."""
+        with self._lock:
+            index = self._load()
+            for key in keys:
+                entry = index["entries"].get(key)
+                if entry and self._reusable(entry, index["post_count"]):
+                    entry["hits"] = int(entry.get("hits", 0)) + 1
+                    entry["last_used"] = time.time()
+                    index["hits"] += 1
+                    self._save()
+                    return self.directory / entry["file"]
+            index["misses"] += 1
+            self._save()
+            return None
+
+    def store(self, provider: str, model: str, prompt: str, image_data: bytes) -> Path:
+        """Write ``image_data`` into the cache and evict entries over budget."""
+        key = self.make_key(provider, model, prompt)
+        with self._lock:
+            index = self._load()
+            self.directory.mkdir(parents=True, exist_ok=True)
+            filename = f"{key}{image_extension(image_data)}"
+            previous = index["entries"].get(key)
+            if previous and previous.get("file") != filename:
+                (self.directory / str(previous["file"])).unlink(missing_ok=True)
+            (self.directory / filename).write_bytes(image_data)
+            now = time.time()
+            index["entries"][key] = {
+                "file": filename,
+                "provider": provider,
+                "model": model,
+                "prompt": prompt,
+                "size": len(image_data),
+                "created": now,
+                "last_used": now,
+                "hits": 0,
+                "last_posted": None,
+            }
+            self._evict(keep=key)
+            self._save()
+            return self.directory / filename
+
+    def _evict(self, keep: str) -> None:
+        entries = self._index["entries"]
+        total = sum(int(entry.get("size", 0)) for entry in entries.values())
+        if total <= self.max_bytes:
+            return
+
+        if self.policy == "lfu":
+            order = sorted(entries, key=lambda key: (entries[key].get("hits", 0), entries[key].get("last_used", 0)))
+        else:
+            order = sorted(entries, key=lambda key: entries[key].get("last_used", 0))
+
+        for key in order:
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            entry = entries.pop(key)
+            total -= int(entry.get("size", 0))
+            (self.directory / entry["file"]).unlink(missing_ok=True)
+            self._index["evictions"] += 1
+            logger.info("Evicted cached image %s (%s bytes)", entry["file"], entry.get("size"))
+
+    def record_post(self, image_path: Path | None) -> None:
+        """Advance the post counter and mark ``image_path`` as just posted if cached."""
+        with self._lock:
+            index = self._load()
+            index["post_count"] += 1
+            if image_path is not None and image_path.parent == self.directory:
+                entry = index["entries"].get(image_path.stem)
+                if entry:
+                    entry["last_posted"] = index["post_count"]
+            self._save()
+
+    def stats(self) -> dict[str, int]:
+        with self._lock:
+            index = self._load()
+            return {
+                "entries": len(index["entries"]),
+                "bytes": sum(int(entry.get("size", 0)) for entry in index["entries"].values()),
+                "hits": index["hits"],
+                "misses": index["misses"],
+                "evictions": index["evictions"],
+            }
+
+
+class ImagePool:
+    """Pre-generated images waiting to be posted, grouped by image style.
+
+    ``index.json`` maps each style to a FIFO list of entries with the
+    provider, model, prompt and size of every pooled image.
+    """
+
+    def __init__(self, directory: Path = IMAGE_POOL_DIR) -> None:
+        self.directory = directory
+        self.index_path = directory / "index.json"
+        self._lock = threading.Lock()
+        self._index: dict[str, list[dict[str, Any]]] | None = None
+
+    def _load(self) -> dict[str, list[dict[str, Any]]]:
+        if self._index is not None:
+            return self._index
+
+        index: dict[str, list[dict[str, Any]]] = {}
+        try:
+            with self.index_path.open("r", encoding="utf-8") as file:
+                loaded = json.load(file)
+            if isinstance(loaded, dict):
+                index = {
+                    str(style): [
+                        entry
+                        for entry in entries
+                        if isinstance(entry, dict) and (self.directory / str(entry.get("file"))).is_file()
+                    ]
+                    for style, entries in loaded.items()
+                    if isinstance(entries, list)
+                }
+        except FileNotFoundError:
+            pass
+        except (OSError, json.JSONDecodeError) as exc:
+            logger.warning("Ignoring unreadable image pool index: %s", exc)
+        self._index = index
+        return index
+
+    def _save(self) -> None:
+        self.directory.mkdir(parents=True, exist_ok=True)
+        TurkeyProvoloneBot._atomic_write_json(self.index_path, self._index)
+
+    def size(self, style: str) -> int:
+        with self._lock:
+            return len(self._load().get(style, []))
+
+    def add(self, style: str, images: list[bytes], provider: str, model: str, prompt: str) -> int:
+        """Store ``images`` under ``style`` and return how many were added."""
+        if not images:
+            return 0
+        with self._lock:
+            index = self._load()
+            style_dir = self.directory / style
+            style_dir.mkdir(parents=True, exist_ok=True)
+            timestamp = datetime.now(timezone.utc).strftime("%Y%m%d_%H%M%S")
+            for image_data in images:
+                filename = f"{style}/{timestamp}_{os.urandom(4).hex()}{image_extension(image_data)}"
+                (self.directory / filename).write_bytes(image_data)
+                index.setdefault(style, []).append(
+                    {
+                        "file": filename,
+                        "provider": provider,
+                        "model": model,
+                        "prompt": prompt,
+                        "size": len(image_data),
+                        "created": datetime.now(timezone.utc).isoformat(),
+                    }
+                )
+            self._save()
+        return len(images)
+
+    def take(self, style: str) -> Path | None:
+        """Remove the oldest pooled image for ``style`` and return its new path."""
+        with self._lock:
+            index = self._load()
+            entries = index.get(style)
+            if not entries:
+                return None
+            entry = entries.pop(0)
+            self._save()
+
+        source = self.directory / entry["file"]
+        timestamp = datetime.now(timezone.utc).strftime("%Y%m%d_%H%M%S")
+        destination = GENERATED_IMAGE_DIR / f"sandwich_{timestamp}_{random.randrange(1000):03d}{source.suffix}"
+        source.replace(destination)
+        return destination
+
+
+class ImageHashIndex:
+    """Perceptual hashes of recent images, searchable by Hamming distance.
+
+    Every image under ``GENERATED_IMAGE_DIR`` except the pool is hashed once
+    with a 64-bit difference hash and remembered by path, mtime and size, so
+    a run only hashes new or changed files. Images accepted for posting are
+    recorded as well, including those that never touch the disk. Both go to
+    the append-only ``hash_index.jsonl``, one line per change, which is
+    rewritten only when superseded and expired lines outnumber live ones.
+    Hashes from the last ``window`` seconds are kept in a multi-index hash
+    table keyed by each 16-bit quarter, so a lookup within a small distance
+    checks a few buckets instead of every image.
+    """
+
+    def __init__(
+        self,
+        directory: Path = GENERATED_IMAGE_DIR,
+        index_path: Path = IMAGE_HASH_INDEX_FILE,
+        scan_batch: int = IMAGE_HASH_SCAN_BATCH,
+        window: float = IMAGE_DEDUP_WINDOW_DAYS * 86400,
+    ) -> None:
+        self.directory = directory
+        self.index_path = index_path
+        self.scan_batch = scan_batch
+        self.window = window
+        self.excluded = directory / IMAGE_POOL_DIR.relative_to(GENERATED_IMAGE_DIR)
+        self._lock = threading.Lock()
+        self._files: dict[str, list[Any]] | None = None
+        self._posts: list[list[Any]] = []
+        self._entries: list[tuple[int, float, str] | None] = []
+        self._file_entries: dict[str, int] = {}
+        self._tables: list[dict[int, list[int]]] = [{}, {}, {}, {}]
+        self._lines = 0
+        self._pruned_at = 0.0
+
+    @staticmethod
+    def image_hash(source: bytes | bytearray | Path) -> int | None:
+        """64-bit difference hash of an image, or None without Pillow or for an unreadable image."""
+        Image = load_pillow()
+        if Image is None:
+            return None
+        try:
+            with Image.open(source if isinstance(source, Path) else io.BytesIO(source)) as image:
+                image.draft("L", (64, 64))  # JPEGs decode at a reduced scale; other formats ignore this.
+                pixels = image.convert("L").resize((9, 8), Image.BOX).tobytes()
+        except (OSError, ValueError, Image.DecompressionBombError) as exc:
+            logger.warning("Could not hash image: %s", exc)
+            return None
+
+        value = 0
+        for row in range(0, 72, 9):
+            for column in range(row, row + 8):
+                value = (value << 1) | (pixels[column] < pixels[column + 1])
+        return value
+
+    def _key(self, path: Path) -> str | None:
+        try:
+            relative = Path(path).relative_to(self.directory)
+        except ValueError:
+            return None
+        return None if Path(path).is_relative_to(self.excluded) else relative.as_posix()
+
+    def _load(self) -> None:
+        if self._files is not None:
+            return
+
+        files: dict[str, list[Any]] = {}
+        posts: list[list[Any]] = []
+        skipped = 0
+        try:
+            with self.index_path.open("r", encoding="utf-8") as file:
+                for line in file:
+                    self._lines += 1
+                    try:
+                        record = json.loads(line)
+                        if record[0] == "file":
+                            files[str(record[1])] = [int(record[2]), int(record[3]), record[4]]
+                        elif record[0] == "gone":
+                            files.pop(str(record[1]), None)
+                        elif record[0] == "post":
+                            posts.append([str(record[3]), float(record[2]), str(record[1])])
+                    except (ValueError, TypeError, IndexError, KeyError):
+                        skipped += 1  # a line cut short by a crash, or from a newer format
+        except FileNotFoundError:
+            pass
+        except OSError as exc:
+            logger.warning("Ignoring unreadable image hash index: %s", exc)
+        if skipped:
+            logger.warning("Skipped %s unreadable line(s) in the image hash index", skipped)
+
+        self._files = files
+        self._posts = posts
+        self._append(self._scan())
+        self._rebuild(time.time())
+
+    def _scan(self) -> list[list[Any]]:
+        """Hash new or changed images on disk, at most ``scan_batch`` per run; return the index lines to append."""
+        assert self._files is not None
+        suffixes = {extension for _, extension in IMAGE_FORMATS.values()} | {".jpeg"}
+        seen: set[str] = set()
+        records: list[list[Any]] = []
+        hashed = deferred = 0
+        for root, directories, names in os.walk(self.directory):
+            root_path = Path(root)
+            directories[:] = [name for name in directories if root_path / name != self.excluded]
+            for name in names:
+                if Path(name).suffix.lower() not in suffixes:
+                    continue
+                path = root_path / name
+                key = path.relative_to(self.directory).as_posix()
+                try:
+                    stat = path.stat()
+                except OSError:
+                    continue
+                seen.add(key)
+                entry = self._files.get(key)
+                if entry and entry[0] == stat.st_mtime_ns and entry[1] == stat.st_size:
+                    continue
+                if hashed >= self.scan_batch:
+                    deferred += 1
+                    continue
+                hashed += 1
+                digest = self.image_hash(path)
+                self._files[key] = [stat.st_mtime_ns, stat.st_size, None if digest is None else f"{digest:016x}"]
+                records.append(["file", key, *self._files[key]])
+
+        for key in [key for key in self._files if key not in seen]:
+            del self._files[key]
+            records.append(["gone", key])
+        if hashed or deferred:
+            logger.info("Hashed %s new image(s) for duplicate checks; %s left for later runs", hashed, deferred)
+        return records
+
+    def _append(self, records: list[list[Any]]) -> None:
+        if not records:
+            return
+        self.index_path.parent.mkdir(parents=True, exist_ok=True)
+        with self.index_path.open("a", encoding="utf-8") as file:
+            file.write("".join(json.dumps(record, separators=(",", ":")) + "\n" for record in records))
+        self._lines += len(records)
+
+    def _compact(self) -> None:
+        """Rewrite the index with one line per live file and post."""
+        assert self._files is not None
+        records = [["file", key, *entry] for key, entry in self._files.items()]
+        records += [["post", key, timestamp, digest] for digest, timestamp, key in self._posts]
+        self.index_path.parent.mkdir(parents=True, exist_ok=True)
+        descriptor, temp_name = tempfile.mkstemp(
+            prefix=f".{self.index_path.name}.", suffix=".tmp", dir=self.index_path.parent
+        )
+        try:
+            with os.fdopen(descriptor, "w", encoding="utf-8") as file:
+                file.write("".join(json.dumps(record, separators=(",", ":")) + "\n" for record in records))
+            os.replace(temp_name, self.index_path)
+        except BaseException:
+            Path(temp_name).unlink(missing_ok=True)
+            raise
+        self._lines = len(records)
+
+    def _rebuild(self, now: float) -> None:
+        """Drop posts older than the window and rebuild the lookup tables from what is left.
+
+        The index file is compacted as well once it holds more than twice as
+        many lines as there are live records.
+        """
+        assert self._files is not None
+        cutoff = now - self.window
+        self._posts = [post for post in self._posts if post[1] >= cutoff]
+        self._entries = []
+        self._file_entries = {}
+        self._tables = [{}, {}, {}, {}]
+        for key, (mtime_ns, _, digest) in self._files.items():
+            if digest and mtime_ns / 1e9 >= cutoff:
+                self._file_entries[key] = self._insert(int(digest, 16), mtime_ns / 1e9, key)
+        for digest, timestamp, key in self._posts:
+            self._insert(int(digest, 16), timestamp, key)
+        self._pruned_at = now
+        if self._lines > 2 * (len(self._files) + len(self._posts)) + 64:
+            self._compact()
+
+    def _insert(self, value: int, timestamp: float, key: str) -> int:
+        entry_id = len(self._entries)
+        self._entries.append((value, timestamp, key))
+        for table, shift in zip(self._tables, range(0, 64, 16)):
+            table.setdefault((value >> shift) & 0xFFFF, []).append(entry_id)
+        return entry_id
+
+    @staticmethod
+    @functools.lru_cache(maxsize=None)
+    def _probe_masks(radius: int) -> tuple[int, ...]:
+        """Every 16-bit mask with at most ``radius`` bits set."""
+        return tuple(
+            sum(1 << bit for bit in bits)
+            for flips in range(radius + 1)
+            for bits in itertools.combinations(range(16), flips)
+        )
+
+    def _search(self, value: int, radius: int) -> Iterator[tuple[int, tuple[int, float, str]]]:
+        """Yield ``(distance, entry)`` for every indexed hash within ``radius`` of ``value``.
+
+        Two hashes within ``radius`` bits of each other differ by at most
+        ``radius // 4`` bits in one of their four 16-bit quarters, so only
+        buckets that close to one of the query's quarters need checking.
+        """
+        seen: set[int] = set()
+        masks = self._probe_masks(min(radius // 4, 16))
+        for table, shift in zip(self._tables, range(0, 64, 16)):
+            quarter = (value >> shift) & 0xFFFF
+            for mask in masks:
+                for entry_id in table.get(quarter ^ mask, ()):
+                    entry = self._entries[entry_id]
+                    if entry is not None and entry_id not in seen:
+                        seen.add(entry_id)
+                        distance = (entry[0] ^ value).bit_count()
+                        if distance <= radius:
+                            yield distance, entry
+
+    def file_hash(self, path: Path) -> int | None:
+        """Hash of the image at ``path``, reused from the index while the file is unchanged."""
+        with self._lock:
+            self._load()
+            assert self._files is not None
+            key = self._key(path)
+            try:
+                stat = Path(path).stat()
+            except OSError:
+                return None
+            entry = self._files.get(key) if key else None
+            if entry and entry[0] == stat.st_mtime_ns and entry[1] == stat.st_size:
+                return int(entry[2], 16) if entry[2] else None
+            digest = self.image_hash(Path(path))
+            if key:
+                self._files[key] = [stat.st_mtime_ns, stat.st_size, None if digest is None else f"{digest:016x}"]
+                self._append([["file", key, *self._files[key]]])
+                previous = self._file_entries.pop(key, None)
+                if previous is not None:
+                    self._entries[previous] = None
+                if digest is not None:
+                    self._file_entries[key] = self._insert(digest, stat.st_mtime_ns / 1e9, key)
+            return digest
+
+    def claim(self, value: int, key: str, max_distance: int, exclude: Sequence[str] = ()) -> tuple[int, str] | None:
+        """Record ``value`` as posted under ``key`` unless an image from the last ``window`` seconds is near it.
+
+        Returns the ``(distance, key)`` of the closest such image instead.
+        Entries stored under a key in ``exclude`` are skipped, so an image is
+        never reported as a duplicate of itself.
+        """
+        with self._lock:
+            self._load()
+            now = time.time()
+            if now - self._pruned_at >= self.window / 4:
+                self._rebuild(now)
+            since = now - self.window
+            match: tuple[int, str] | None = None
+            for distance, (_, timestamp, entry_key) in self._search(value, max_distance):
+                if timestamp >= since and entry_key not in exclude and (match is None or distance < match[0]):
+                    match = (distance, entry_key)
+            if match is not None:
+                return match
+
+            self._posts.append([f"{value:016x}", now, key])
+            self._insert(value, now, key)
+            self._append([["post", key, now, f"{value:016x}"]])
+            return None
+
+    def claim_image(self, source: bytes | bytearray | Path, max_distance: int) -> tuple[int, str] | None:
+        """``claim`` for image bytes or an image file; images that cannot be hashed always pass."""
+        if isinstance(source, Path):
+            value = self.file_hash(source)
+            key = self._key(source) or str(source)
+            # A cached file was recorded under its content key when it was first posted from memory; when its
+            # cache entry is reused, IMAGE_CACHE_REUSE_AFTER decides whether it may repeat, not its own record.
+            exclude: Sequence[str] = (key, self.content_key(source))
+        else:
+            value = self.image_hash(source)
+            key = self.content_key(source)
+            exclude = ()
+        return None if value is None else self.claim(value, key, max_distance, exclude)
+
+    @staticmethod
+    def content_key(source: bytes | bytearray | Path) -> str:
+        """Index key of an image recorded from memory: a prefix of the SHA-256 of its bytes."""
+        if isinstance(source, Path):
+            try:
+                source = source.read_bytes()
+            except OSError:
+                return ""
+        return f"sha256:{hashlib.sha256(source).hexdigest()[:16]}"
+
+    def __len__(self) -> int:
+        with self._lock:
+            self._load()
+            return sum(1 for entry in self._entries if entry is not None)
+
+
+class CronSchedule:
+    """Minimal five-field cron expression evaluated in UTC.
+
+    Supports ``*``, lists, ranges and ``/`` steps. As in Vixie cron, when
+    both day-of-month and day-of-week are restricted either one may match;
+    a day field starting with ``*``, such as ``*/2``, is not restricted.
+    """
+
+    _FIELDS = ((0, 59), (0, 23), (1, 31), (1, 12), (0, 7))
+
+    def __init__(self, expression: str) -> None:
+        self.expression = expression.strip()
+        parts = self.expression.split()
+        if len(parts) != 5:
+            raise ValueError(f"cron expression must have 5 fields: {expression!r}")
+
+        fields = [self._parse_field(part, low, high) for part, (low, high) in zip(parts, self._FIELDS)]
+        self.minutes, self.hours, self.days, self.months, weekdays = fields
+        self.weekdays = {day % 7 for day in weekdays}
+        self.day_restricted = not parts[2].startswith("*")
+        self.weekday_restricted = not parts[4].startswith("*")
+
+    @staticmethod
+    def _parse_field(field: str, low: int, high: int) -> set[int]:
+        values: set[int] = set()
+        for item in field.split(","):
+            base, _, step_text = item.partition("/")
+            step = int(step_text) if step_text else 1
+            if base == "*":
+                start, end = low, high
+            elif "-" in base:
+                start_text, end_text = base.split("-", 1)
+                start, end = int(start_text), int(end_text)
+            else:
+                start = int(base)
+                end = high if step_text else start
+            if step < 1 or start < low or end > high or start > end:
+                raise ValueError(f"invalid cron field {field!r}")
+            values.update(range(start, end + 1, step))
+        return values
+
+    def _day_matches(self, moment: datetime) -> bool:
+        day_ok = moment.day in self.days
+        weekday_ok = (moment.weekday() + 1) % 7 in self.weekdays
+        if self.day_restricted and self.weekday_restricted:
+            return day_ok or weekday_ok
+        return day_ok and weekday_ok
+
+    def next_after(self, moment: datetime) -> datetime:
+        """Return the first matching minute strictly after ``moment``."""
+        candidate = moment.astimezone(timezone.utc).replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limit = candidate + timedelta(days=366 * 5)
+        while candidate < limit:
+            if candidate.month not in self.months:
+                year = candidate.year + candidate.month // 12
+                candidate = candidate.replace(year=year, month=candidate.month % 12 + 1, day=1, hour=0, minute=0)
+            elif not self._day_matches(candidate):
+                candidate = candidate.replace(hour=0, minute=0) + timedelta(days=1)
+            elif candidate.hour not in self.hours:
+                candidate = candidate.replace(minute=0) + timedelta(hours=1)
+            elif candidate.minute not in self.minutes:
+                candidate += timedelta(minutes=1)
+            else:
+                return candidate
+        raise ValueError(f"cron expression never matches: {self.expression!r}")
+
+
+class FailedPostQueue:
+    """Durable SQLite queue of failed posts awaiting retry.
+
+    Every row records the post content, generated image path, attempt count
+    and next retry time. Rows are claimed with a short lease so several
+    workers, or processes, never replay the same post at once.
+    """
+
+    def __init__(
+        self,
+        path: Path = FAILED_POST_DB,
+        max_attempts: int = RETRY_MAX_ATTEMPTS,
+        base_delay: float = RETRY_BASE_DELAY,
+        max_delay: float = RETRY_MAX_DELAY,
+    ) -> None:
+        self.path = path
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._initialized = False
+
+    def _connect(self) -> sqlite3.Connection:
+        if not self._initialized:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+        connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        connection.row_factory = sqlite3.Row
+        if not self._initialized:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                """
+                CREATE TABLE IF NOT EXISTS failed_posts (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    post_content TEXT NOT NULL,
+                    image_path TEXT,
+                    created_at TEXT NOT NULL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    next_retry_at REAL NOT NULL,
+                    status TEXT NOT NULL DEFAULT 'pending',
+                    last_error TEXT,
+                    post_id TEXT
+                )
+                """
+            )
+            connection.execute(
+                "CREATE INDEX IF NOT EXISTS failed_posts_due ON failed_posts (status, next_retry_at)"
+            )
+            self._initialized = True
+        return connection
+
+    def enqueue(
+        self, post_content: dict[str, Any], image_path: Path | None = None, created_at: str | None = None
+    ) -> int:
+        with closing(self._connect()) as connection:
+            cursor = connection.execute(
+                "INSERT INTO failed_posts (post_content, image_path, created_at, next_retry_at) VALUES (?, ?, ?, ?)",
+                (
+                    json.dumps(post_content),
+                    str(image_path) if image_path else None,
+                    created_at or datetime.now(timezone.utc).isoformat(),
+                    time.time(),
+                ),
+            )
+            return int(cursor.lastrowid)
+
+    def claim_due(self, limit: int, lease_seconds: float = RETRY_LEASE_SECONDS) -> list[dict[str, Any]]:
+        """Lease up to ``limit`` pending rows whose retry time has passed."""
+        now = time.time()
+        with closing(self._connect()) as connection:
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                rows = connection.execute(
+                    "SELECT id, post_content, image_path, attempts FROM failed_posts "
+                    "WHERE status = 'pending' AND next_retry_at <= ? ORDER BY next_retry_at LIMIT ?",
+                    (now, limit),
+                ).fetchall()
+                connection.executemany(
+                    "UPDATE failed_posts SET next_retry_at = ? WHERE id = ?",
+                    [(now + lease_seconds, row["id"]) for row in rows],
+                )
+                connection.execute("COMMIT")
+            except sqlite3.Error:
+                connection.execute("ROLLBACK")
+                raise
+
+        items = []
+        for row in rows:
+            try:
+                post_content = json.loads(row["post_content"])
+            except json.JSONDecodeError:
+                post_content = {}
+            items.append(
+                {
+                    "id": row["id"],
+                    "post_content": post_content if isinstance(post_content, dict) else {},
+                    "image_path": row["image_path"],
+                    "attempts": row["attempts"],
+                }
+            )
+        return items
+
+    def mark_posted(self, item_id: int, post_id: str) -> None:
+        with closing(self._connect()) as connection:
+            connection.execute(
+                "UPDATE failed_posts SET status = 'posted', post_id = ?, attempts = attempts + 1 WHERE id = ?",
+                (post_id, item_id),
+            )
+
+    def mark_failed(self, item_id: int, error: str) -> None:
+        with closing(self._connect()) as connection:
+            row = connection.execute("SELECT attempts FROM failed_posts WHERE id = ?", (item_id,)).fetchone()
+            attempts = (row["attempts"] if row else 0) + 1
+            delay = min(self.base_delay * 2 ** (attempts - 1), self.max_delay)
+            status = "dead" if attempts >= self.max_attempts else "pending"
+            connection.execute(
+                "UPDATE failed_posts SET attempts = ?, next_retry_at = ?, status = ?, last_error = ? WHERE id = ?",
+                (attempts, time.time() + random.uniform(delay / 2, delay), status, error[:500], item_id),
+            )
+        if status == "dead":
+            logger.error("Failed post #%s gave up after %s attempts", item_id, attempts)
+
+    def pending_count(self) -> int:
+        with closing(self._connect()) as connection:
+            return int(connection.execute("SELECT COUNT(*) FROM failed_posts WHERE status = 'pending'").fetchone()[0])
+
+    def import_legacy_files(self, directory: Path) -> int:
+        """Move old ``failed_post_*.json`` files into the queue."""
+        imported = 0
+        for path in sorted(directory.glob("failed_post_*.json")):
+            try:
+                with path.open("r", encoding="utf-8") as file:
+                    payload = json.load(file)
+            except (OSError, json.JSONDecodeError) as exc:
+                logger.warning("Skipping unreadable failed post file %s: %s", path.name, exc)
+                continue
+            if not isinstance(payload, dict):
+                continue
+            created_at = payload.pop("timestamp", None)
+            self.enqueue(payload, None, created_at=str(created_at) if created_at else None)
+            path.replace(path.with_name(f"{path.name}.imported"))
+            imported += 1
+        return imported
+
+
+class PostHistory:
+    """Indexed SQLite history of every published post.
+
+    Appends are single inserts and lookups use indexes on the post ID, the
+    posting time, the image style and the ``checked`` flag, so the history is
+    kept in full without slowing down. WAL mode lets several runs write at
+    once.
+    """
+
+    def __init__(self, path: Path = POST_HISTORY_DB, legacy_path: Path | None = LEGACY_RECENT_POSTS_FILE) -> None:
+        self.path = path
+        self.legacy_path = legacy_path
+        self._initialized = False
+
+    def _connect(self) -> sqlite3.Connection:
+        if not self._initialized:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+        connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        connection.row_factory = sqlite3.Row
+        if not self._initialized:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                """
+                CREATE TABLE IF NOT EXISTS post_history (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    post_id TEXT NOT NULL UNIQUE,
+                    page_id TEXT,
+                    posted_at REAL NOT NULL,
+                    image_style TEXT,
+                    text TEXT,
+                    checked INTEGER NOT NULL DEFAULT 0
+                )
+                """
+            )
+            connection.execute("CREATE INDEX IF NOT EXISTS post_history_posted_at ON post_history (posted_at)")
+            connection.execute(
+                "CREATE INDEX IF NOT EXISTS post_history_style ON post_history (image_style, posted_at)"
+            )
+            connection.execute("CREATE INDEX IF NOT EXISTS post_history_checked ON post_history (checked, posted_at)")
+            connection.execute(
+                """
+                CREATE TABLE IF NOT EXISTS post_checkpoints (
+                    post_id TEXT PRIMARY KEY,
+                    comments_after TEXT,
+                    comments_since REAL,
+                    engagement TEXT,
+                    polled_at REAL
+                )
+                """
+            )
+            connection.execute(
+                """
+                CREATE TABLE IF NOT EXISTS post_comments (
+                    comment_id TEXT PRIMARY KEY,
+                    post_id TEXT NOT NULL,
+                    author TEXT,
+                    message TEXT,
+                    created_at REAL
+                )
+                """
+            )
+            connection.execute("CREATE INDEX IF NOT EXISTS post_comments_post ON post_comments (post_id, created_at)")
+            connection.execute(
+                """
+                CREATE TABLE IF NOT EXISTS scheduled_posts (
+                    post_id TEXT PRIMARY KEY,
+                    page_id TEXT,
+                    publish_at REAL NOT NULL,
+                    scheduled_at REAL NOT NULL,
+                    image_style TEXT,
+                    text TEXT
+                )
+                """
+            )
+            connection.execute(
+                "CREATE INDEX IF NOT EXISTS scheduled_posts_publish_at ON scheduled_posts (publish_at, page_id)"
+            )
+            self._initialized = True
+            if self.legacy_path is not None and self.legacy_path.exists():
+                imported = self._import_legacy_file(connection, self.legacy_path)
+                logger.info("Imported %s post(s) from %s into the post history", imported, self.legacy_path.name)
+        return connection
+
+    @staticmethod
+    def _timestamp(value: datetime | str | float | None) -> float:
+        if value is None:
+            return time.time()
+        if isinstance(value, (int, float)):
+            return float(value)
+        if isinstance(value, str):
+            value = datetime.fromisoformat(value)
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        return value.timestamp()
+
+    @staticmethod
+    def _row_to_dict(row: sqlite3.Row) -> dict[str, Any]:
+        return {
+            "post_id": row["post_id"],
+            "page_id": row["page_id"],
+            "timestamp": datetime.fromtimestamp(row["posted_at"], timezone.utc).isoformat(),
+            "image_style": row["image_style"],
+            "text": row["text"],
+            "checked": bool(row["checked"]),
+        }
+
+    def add(
+        self,
+        post_id: str,
+        page_id: str | None = None,
+        image_style: str | None = None,
+        text: str | None = None,
+        posted_at: datetime | str | float | None = None,
+        checked: bool = False,
+    ) -> bool:
+        """Record a post; returns False when the post ID is already known."""
+        with closing(self._connect()) as connection:
+            cursor = connection.execute(
+                "INSERT OR IGNORE INTO post_history (post_id, page_id, posted_at, image_style, text, checked) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (post_id, page_id, self._timestamp(posted_at), image_style, text, int(checked)),
+            )
+            return cursor.rowcount > 0
+
+    def add_scheduled(
+        self,
+        post_id: str,
+        page_id: str | None,
+        publish_at: datetime | str | float,
+        image_style: str | None = None,
+        text: str | None = None,
+    ) -> bool:
+        """Record a post scheduled on Facebook; it joins the history, and comment polling, at ``publish_at``."""
+        publish_time = self._timestamp(publish_at)
+        with closing(self._connect()) as connection:
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                cursor = connection.execute(
+                    "INSERT OR IGNORE INTO scheduled_posts "
+                    "(post_id, page_id, publish_at, scheduled_at, image_style, text) VALUES (?, ?, ?, ?, ?, ?)",
+                    (post_id, page_id, publish_time, time.time(), image_style, text),
+                )
+                connection.execute(
+                    "INSERT OR IGNORE INTO post_history (post_id, page_id, posted_at, image_style, text) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (post_id, page_id, publish_time, image_style, text),
+                )
+                connection.execute("COMMIT")
+            except sqlite3.Error:
+                connection.execute("ROLLBACK")
+                raise
+        return cursor.rowcount > 0
+
+    def scheduled(
+        self, since: datetime | str | float | None = None, page_id: str | None = None
+    ) -> list[dict[str, Any]]:
+        """Scheduled posts going live at or after ``since`` (default now), soonest first."""
+        sql = "SELECT * FROM scheduled_posts WHERE publish_at >= ?"
+        params: list[Any] = [self._timestamp(since)]
+        if page_id is not None:
+            sql += " AND page_id = ?"
+            params.append(page_id)
+        with closing(self._connect()) as connection:
+            rows = connection.execute(sql + " ORDER BY publish_at, post_id", params).fetchall()
+        return [
+            {
+                "post_id": row["post_id"],
+                "page_id": row["page_id"],
+                "publish_at": datetime.fromtimestamp(row["publish_at"], timezone.utc).isoformat(),
+                "image_style": row["image_style"],
+                "text": row["text"],
+            }
+            for row in rows
+        ]
+
+    def get(self, post_id: str) -> dict[str, Any] | None:
+        with closing(self._connect()) as connection:
+            row = connection.execute("SELECT * FROM post_history WHERE post_id = ?", (post_id,)).fetchone()
+        return self._row_to_dict(row) if row else None
+
+    def query(
+        self,
+        since: datetime | str | float | None = None,
+        until: datetime | str | float | None = None,
+        image_style: str | None = None,
+        checked: bool | None = None,
+        page_id: str | None = None,
+        limit: int | None = None,
+        newest_first: bool = True,
+    ) -> list[dict[str, Any]]:
+        """Return posts matching every given filter; ``until`` is exclusive."""
+        clauses: list[str] = []
+        params: list[Any] = []
+        if since is not None:
+            clauses.append("posted_at >= ?")
+            params.append(self._timestamp(since))
+        if until is not None:
+            clauses.append("posted_at < ?")
+            params.append(self._timestamp(until))
+        if image_style is not None:
+            clauses.append("image_style = ?")
+            params.append(image_style)
+        if checked is not None:
+            clauses.append("checked = ?")
+            params.append(int(checked))
+        if page_id is not None:
+            clauses.append("page_id = ?")
+            params.append(page_id)
+
+        sql = "SELECT * FROM post_history"
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        sql += f" ORDER BY posted_at {'DESC' if newest_first else 'ASC'}, id {'DESC' if newest_first else 'ASC'}"
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(int(limit))
+        with closing(self._connect()) as connection:
+            rows = connection.execute(sql, params).fetchall()
+        return [self._row_to_dict(row) for row in rows]
+
+    def mark_checked(self, post_ids: list[str], checked: bool = True) -> int:
+        with closing(self._connect()) as connection:
+            cursor = connection.executemany(
+                "UPDATE post_history SET checked = ? WHERE post_id = ?",
+                [(int(checked), post_id) for post_id in post_ids],
+            )
+            return cursor.rowcount
+
+    def count(self) -> int:
+        with closing(self._connect()) as connection:
+            return int(connection.execute("SELECT COUNT(*) FROM post_history").fetchone()[0])
+
+    def poll_targets(self, limit: int = POLL_MAX_POSTS) -> list[dict[str, Any]]:
+        """Return unchecked, already published posts with their poll checkpoints, least recently polled first."""
+        with closing(self._connect()) as connection:
+            rows = connection.execute(
+                "SELECT h.post_id, h.page_id, h.posted_at, c.comments_after, c.comments_since "
+                "FROM post_history h LEFT JOIN post_checkpoints c ON c.post_id = h.post_id "
+                "WHERE h.checked = 0 AND h.posted_at <= ? "
+                "ORDER BY c.polled_at IS NOT NULL, c.polled_at, h.posted_at DESC LIMIT ?",
+                (time.time(), int(limit)),
+            ).fetchall()
+        return [
+            {
+                "post_id": row["post_id"],
+                "page_id": row["page_id"],
+                "posted_at": row["posted_at"],
+                "comments_after": row["comments_after"],
+                "comments_since": row["comments_since"],
+            }
+            for row in rows
+        ]
+
+    def save_poll(
+        self, checkpoints: list[dict[str, Any]], comments: list[dict[str, Any]], checked: list[str]
+    ) -> int:
+        """Store one poll cycle's checkpoints and comments atomically; returns new comment count."""
+        with closing(self._connect()) as connection:
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                before = connection.total_changes
+                connection.executemany(
+                    "INSERT OR IGNORE INTO post_comments (comment_id, post_id, author, message, created_at) "
+                    "VALUES (:comment_id, :post_id, :author, :message, :created_at)",
+                    comments,
+                )
+                added = connection.total_changes - before
+                connection.executemany(
+                    "INSERT INTO post_checkpoints "
+                    "(post_id, comments_after, comments_since, engagement, polled_at) "
+                    "VALUES (:post_id, :comments_after, :comments_since, :engagement, :polled_at) "
+                    "ON CONFLICT (post_id) DO UPDATE SET comments_after = excluded.comments_after, "
+                    "comments_since = excluded.comments_since, "
+                    "engagement = COALESCE(excluded.engagement, engagement), polled_at = excluded.polled_at",
+                    checkpoints,
+                )
+                connection.executemany(
+                    "UPDATE post_history SET checked = 1 WHERE post_id = ?", [(post_id,) for post_id in checked]
+                )
+                connection.execute("COMMIT")
+            except sqlite3.Error:
+                connection.execute("ROLLBACK")
+                raise
+        return added
+
+    def comments(self, post_id: str, since: datetime | str | float | None = None) -> list[dict[str, Any]]:
+        with closing(self._connect()) as connection:
+            rows = connection.execute(
+                "SELECT comment_id, author, message, created_at FROM post_comments "
+                "WHERE post_id = ? AND created_at >= ? ORDER BY created_at",
+                (post_id, self._timestamp(since) if since is not None else 0.0),
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def engagement(self, post_id: str) -> dict[str, Any]:
+        with closing(self._connect()) as connection:
+            row = connection.execute("SELECT engagement FROM post_checkpoints WHERE post_id = ?", (post_id,)).fetchone()
+        try:
+            return json.loads(row["engagement"]) if row and row["engagement"] else {}
+        except json.JSONDecodeError:
+            return {}
+
+    def _import_legacy_file(self, connection: sqlite3.Connection, path: Path) -> int:
+        """Move entries from the old ``recent_posts.json`` into the history."""
+        try:
+            with path.open("r", encoding="utf-8") as file:
+                payload = json.load(file)
+        except (OSError, json.JSONDecodeError) as exc:
+            logger.warning("Skipping unreadable recent posts file %s: %s", path.name, exc)
+            return 0
+
+        rows = []
+        for post in payload if isinstance(payload, list) else []:
+            if not isinstance(post, dict) or not post.get("post_id"):
+                continue
+            try:
+                posted_at = self._timestamp(post.get("timestamp"))
+            except (TypeError, ValueError):
+                posted_at = time.time()
+            rows.append((str(post["post_id"]), post.get("page_id"), posted_at, int(bool(post.get("checked")))))
+        connection.executemany(
+            "INSERT OR IGNORE INTO post_history (post_id, page_id, posted_at, checked) VALUES (?, ?, ?, ?)", rows
+        )
+        path.replace(path.with_name(f"{path.name}.imported"))
+        return len(rows)
+
+
+class MultipartStream:
+    """Streaming ``multipart/form-data`` body for one file field.
+
+    The file part is read straight from a bytes-like buffer or an open file
+    in small blocks, so uploads never build a second copy of the image the
+    way ``requests``' ``files=`` encoding does.
+    """
+
+    def __init__(
+        self,
+        fields: dict[str, str],
+        file_field: str,
+        filename: str,
+        file_content_type: str,
+        source: bytes | bytearray | memoryview | BinaryIO,
+    ) -> None:
+        boundary = os.urandom(16).hex()
+        self.content_type = f"multipart/form-data; boundary={boundary}"
+        head = "".join(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'
+            for name, value in fields.items()
+        )
+        head += (
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{file_field}"; filename="{filename}"\r\n'
+            f"Content-Type: {file_content_type}\r\n\r\n"
+        )
+        tail = f"\r\n--{boundary}--\r\n".encode("ascii")
+
+        if isinstance(source, (bytes, bytearray, memoryview)):
+            file_part: memoryview | BinaryIO = memoryview(source)
+            file_size = len(file_part)
+        else:
+            file_part = source
+            file_size = os.fstat(source.fileno()).st_size - source.tell()
+        self.from_file = not isinstance(file_part, memoryview)
+        self._file_start = 0 if isinstance(file_part, memoryview) else file_part.tell()
+        self._parts: list[memoryview | BinaryIO] = [memoryview(head.encode("utf-8")), file_part, memoryview(tail)]
+        self._length = len(self._parts[0]) + file_size + len(tail)
+        self._index = 0
+        self._offset = 0
+
+    def rewind(self) -> None:
+        """Start the body over, so a retried request sends it again from the beginning."""
+        self._index = 0
+        self._offset = 0
+        if not isinstance(self._parts[1], memoryview):
+            self._parts[1].seek(self._file_start)
+
+    def __len__(self) -> int:
+        return self._length
+
+    def __iter__(self) -> Iterator[bytes]:
+        while chunk := self.read(UPLOAD_BLOCK_SIZE):
+            yield chunk
+
+    def read(self, size: int = -1) -> bytes:
+        if size is None or size < 0:
+            size = self._length
+        while self._index < len(self._parts):
+            part = self._parts[self._index]
+            if isinstance(part, memoryview):
+                chunk = bytes(part[self._offset : self._offset + size])
+                self._offset += len(chunk)
+            else:
+                chunk = part.read(size)
+            if chunk:
+                return chunk
+            self._index += 1
+            self._offset = 0
+        return b""
+
+
+class CredentialCache:
+    """Small JSON cache of successful credential checks with a TTL.
+
+    Entries are keyed by a hash of the credentials, never the credentials
+    themselves. Page access tokens obtained from a user token are stored so
+    a cached run can post without another lookup, which is why the file
+    lives outside the uploaded artifact directories and is created 0600.
+    """
+
+    def __init__(self, path: Path = CREDENTIAL_CACHE_FILE, ttl: float = CREDENTIAL_CACHE_TTL) -> None:
+        self.path = path
+        self.ttl = ttl
+
+    @staticmethod
+    def make_key(*parts: str) -> str:
+        return hashlib.sha256("\0".join(parts).encode("utf-8")).hexdigest()
+
+    def _load(self) -> dict[str, Any]:
+        try:
+            with self.path.open("r", encoding="utf-8") as file:
+                loaded = json.load(file)
+        except FileNotFoundError:
+            return {}
+        except (OSError, json.JSONDecodeError) as exc:
+            logger.warning("Ignoring unreadable credential cache: %s", exc)
+            return {}
+        return loaded if isinstance(loaded, dict) else {}
+
+    def get(self, key: str) -> dict[str, Any] | None:
+        if self.ttl <= 0:
+            return None
+        entry = self._load().get(key)
+        if not isinstance(entry, dict) or time.time() - float(entry.get("verified_at", 0)) > self.ttl:
+            return None
+        return entry
+
+    def set(self, key: str, value: dict[str, Any]) -> None:
+        if self.ttl <= 0:
+            return
+        now = time.time()
+        entries = {
+            cached_key: entry
+            for cached_key, entry in self._load().items()
+            if isinstance(entry, dict) and now - float(entry.get("verified_at", 0)) <= self.ttl
+        }
+        entries[key] = {**value, "verified_at": now}
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            temp_path = self.path.with_name(f"{self.path.name}.{os.getpid()}.tmp")
+            with os.fdopen(os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), "w") as file:
+                json.dump(entries, file)
+            temp_path.replace(self.path)
+        except OSError as exc:
+            logger.warning("Could not write credential cache: %s", exc)
+
+
+class CaptionScheduler:
+    """Walk a seeded permutation of a Cartesian product without repeats.
+
+    A combination is a tuple of indices, one per dimension, encoded as one
+    mixed-radix integer. Positions map to combinations through a keyed
+    Feistel network with cycle walking, so the next combination and the
+    "already used?" check are both constant time and need no history scan.
+    Only the seed and a cursor are persisted. When the cursor reaches the
+    end of the space a new cycle starts with a fresh seed.
+    """
+
+    def __init__(
+        self,
+        radices: list[int],
+        signature: str,
+        seed: str | None = None,
+        state_path: Path = CAPTION_STATE_FILE,
+        label: str = "caption",
+    ) -> None:
+        self.radices = radices
+        self.label = label
+        self.size = 1
+        for radix in radices:
+            self.size *= max(radix, 1)
+        self.signature = signature
+        self.state_path = state_path
+        self._fixed_seed = seed
+        self._half_bits = max(1, ((self.size - 1).bit_length() + 1) // 2)
+        self._mask = (1 << self._half_bits) - 1
+        self._lock = threading.Lock()
+        self._state: dict[str, Any] | None = None
+        self._key = b""
+
+    def encode(self, combination: tuple[int, ...]) -> int:
+        index = 0
+        for value, radix in zip(combination, self.radices):
+            index = index * radix + value
+        return index
+
+    def decode(self, index: int) -> tuple[int, ...]:
+        values = []
+        for radix in reversed(self.radices):
+            index, value = divmod(index, radix)
+            values.append(value)
+        return tuple(reversed(values))
+
+    def _load(self) -> dict[str, Any]:
+        if self._state is not None:
+            return self._state
+
+        state: dict[str, Any] = {}
+        try:
+            with self.state_path.open("r", encoding="utf-8") as file:
+                loaded = json.load(file)
+            if isinstance(loaded, dict) and loaded.get("signature") == self.signature:
+                state = loaded
+            elif isinstance(loaded, dict):
+                logger.info("%s choices changed; starting a new %s cycle", self.label.capitalize(), self.label)
+        except FileNotFoundError:
+            pass
+        except (OSError, json.JSONDecodeError) as exc:
+            logger.warning("Ignoring unreadable caption cursor: %s", exc)
+
+        if not state:
+            seed = self._fixed_seed or os.urandom(16).hex()
+            state = {"signature": self.signature, "seed": seed, "cycle": 0, "cursor": 0}
+        self._set_state(state)
+        return state
+
+    def _set_state(self, state: dict[str, Any]) -> None:
+        self._state = state
+        self._key = hashlib.sha256(f"{state['seed']}:{state['cycle']}".encode("utf-8")).digest()[:16]
+
+    def _round(self, round_number: int, value: int) -> int:
+        digest = hashlib.blake2b(value.to_bytes(16, "big") + bytes([round_number]), key=self._key, digest_size=16)
+        return int.from_bytes(digest.digest(), "big") & self._mask
+
+    def _encrypt(self, value: int) -> int:
+        left, right = value >> self._half_bits, value & self._mask
+        for round_number in range(FEISTEL_ROUNDS):
+            left, right = right, left ^ self._round(round_number, right)
+        return (left << self._half_bits) | right
+
+    def _decrypt(self, value: int) -> int:
+        left, right = value >> self._half_bits, value & self._mask
+        for round_number in reversed(range(FEISTEL_ROUNDS)):
+            left, right = right ^ self._round(round_number, left), left
+        return (left << self._half_bits) | right
+
+    def _at(self, position: int) -> int:
+        index = self._encrypt(position)
+        while index >= self.size:
+            index = self._encrypt(index)
+        return index
+
+    def _position_of(self, index: int) -> int:
+        position = self._decrypt(index)
+        while position >= self.size:
+            position = self._decrypt(position)
+        return position
+
+    def next_combination(self) -> tuple[int, ...]:
+        """Consume and return the next unused combination."""
+        with self._lock:
+            state = self._load()
+            if state["cursor"] >= self.size:
+                logger.info("Every %s has been used; starting cycle %s", self.label, state["cycle"] + 1)
+                self._set_state({**state, "cycle": state["cycle"] + 1, "cursor": 0})
+                state = self._state
+            combination = self.decode(self._at(state["cursor"]))
+            state["cursor"] += 1
+            TurkeyProvoloneBot._atomic_write_json(self.state_path, state)
+            return combination
+
+    def peek(self, count: int) -> list[tuple[int, ...]]:
+        """Return up to ``count`` upcoming combinations without consuming them."""
+        with self._lock:
+            state = self._load()
+            end = min(state["cursor"] + max(count, 0), self.size)
+            return [self.decode(self._at(position)) for position in range(state["cursor"], end)]
+
+    def is_used(self, index: int) -> bool:
+        """Whether the encoded combination ``index`` was used in the current cycle."""
+        with self._lock:
+            state = self._load()
+            return 0 <= index < self.size and self._position_of(index) < state["cursor"]
+
+
+class ShopRegistry:
+    """Sandwich shops indexed by name, location and status.
+
+    Built-in shops come first, then the shops in ``path``. Shops are held
+    column by column, and the validated file is cached as a columnar JSON
+    snapshot keyed on the file's mtime and size, so a startup with an
+    unchanged file skips validation and ``refresh`` costs one ``stat``
+    unless the file changed. Only the name index is built on load; the
+    location and status indexes, the sorted name list used by prefix
+    search and the trigram index used by fuzzy search are built on first
+    use.
+    """
+
+    def __init__(
+        self,
+        builtin_shops: list[dict[str, str]],
+        path: Path = SHOP_FILE,
+        snapshot_path: Path = SHOP_SNAPSHOT_FILE,
+    ) -> None:
+        self.builtin_shops = builtin_shops
+        self.path = path
+        self.snapshot_path = snapshot_path
+        self.signature = ""
+        self._lock = threading.RLock()
+        self._loaded = False
+        self._source: list[Any] | None = None
+        self._columns: dict[str, list[str | None]] = {field: [] for field in SHOP_FIELDS}
+        self._by_name: dict[str, int] = {}
+        self._by_location: dict[str, list[int]] | None = None
+        self._by_status: dict[str, list[int]] | None = None
+        self._sorted_names: tuple[list[str], list[int]] | None = None
+        self._trigrams: dict[str, list[int]] | None = None
+
+    def __len__(self) -> int:
+        self._ensure_loaded()
+        return len(self._columns["name"])
+
+    def _ensure_loaded(self) -> None:
+        if not self._loaded:
+            self.refresh()
+
+    def refresh(self) -> bool:
+        """Reload the shop file if its mtime or size changed; returns whether the shops were reloaded."""
+        with self._lock:
+            try:
+                stat = self.path.stat()
+                source: list[Any] | None = [str(self.path), stat.st_mtime_ns, stat.st_size]
+            except FileNotFoundError:
+                source = None
+            except OSError as exc:
+                logger.warning("Error loading shops: %s", exc)
+                source = self._source
+            if self._loaded and source == self._source:
+                return False
+
+            columns, signature = self._read_file(source) if source else ({}, "")
+            self._build(columns, signature)
+            self._source = source
+            self._loaded = True
+            return True
+
+    @staticmethod
+    def _append_shop(columns: dict[str, list[str | None]], shop: dict[Any, Any], name: str) -> None:
+        count = len(columns["name"])
+        columns["name"].append(name)
+        for key, value in shop.items():
+            key = str(key)
+            if value is None or key == "name":
+                continue
+            column = columns.get(key)
+            if column is None:
+                column = columns[key] = [None] * count
+            column.append(str(value))
+        for column in columns.values():
+            if len(column) == count:
+                column.append(None)
+
+    def _read_file(self, source: list[Any]) -> tuple[dict[str, list[str | None]], str]:
+        snapshot = self._load_snapshot(source)
+        if snapshot is not None:
+            return snapshot
+
+        columns: dict[str, list[str | None]] = {field: [] for field in SHOP_FIELDS}
+        try:
+            with self.path.open("r", encoding="utf-8") as file:
+                loaded_shops = json.load(file)
+        except (OSError, json.JSONDecodeError) as exc:
+            logger.warning("Error loading shops: %s", exc)
+            return columns, ""
+        if not isinstance(loaded_shops, list):
+            logger.warning("Ignoring sandwich shop file because it does not contain a list")
+            return columns, ""
+
+        seen: set[str] = set()
+        for shop in loaded_shops:
+            if not isinstance(shop, dict) or not isinstance(shop.get("name"), str):
+                continue
+            name = shop["name"].strip()
+            if not name or name.lower() in seen:
+                continue
+            seen.add(name.lower())
+            self._append_shop(columns, shop, name)
+        signature = hashlib.sha256("\n".join(columns["name"]).encode("utf-8")).hexdigest()
+        logger.info("Loaded %s shops from file", len(columns["name"]))
+
+        try:
+            TurkeyProvoloneBot._atomic_write_json(
+                self.snapshot_path,
+                {"version": SHOP_SNAPSHOT_VERSION, "source": source, "signature": signature, "columns": columns},
+                indent=None,
+            )
+        except OSError as exc:
+            logger.warning("Could not write shop snapshot: %s", exc)
+        return columns, signature
+
+    def _load_snapshot(self, source: list[Any]) -> tuple[dict[str, list[str | None]], str] | None:
+        try:
+            with self.snapshot_path.open("r", encoding="utf-8") as file:
+                snapshot = json.load(file)
+        except FileNotFoundError:
+            return None
+        except (OSError, json.JSONDecodeError) as exc:
+            logger.warning("Ignoring unreadable shop snapshot: %s", exc)
+            return None
+        if (
+            not isinstance(snapshot, dict)
+            or snapshot.get("version") != SHOP_SNAPSHOT_VERSION
+            or snapshot.get("source") != source
+            or not isinstance(snapshot.get("columns"), dict)
+            or not isinstance(snapshot["columns"].get("name"), list)
+        ):
+            return None
+        columns = snapshot["columns"]
+        if any(not isinstance(column, list) or len(column) != len(columns["name"]) for column in columns.values()):
+            return None
+        logger.info("Loaded %s shops from snapshot", len(columns["name"]))
+        return columns, str(snapshot.get("signature", ""))
+
+    def _build(self, file_columns: dict[str, list[str | None]], file_signature: str) -> None:
+        columns: dict[str, list[str | None]] = {field: [] for field in SHOP_FIELDS}
+        for shop in self.builtin_shops:
+            self._append_shop(columns, shop, shop["name"].strip())
+        by_name = {str(name).lower(): index for index, name in enumerate(columns["name"])}
+
+        file_names = file_columns.get("name", [])
+        kept = [index for index, name in enumerate(file_names) if str(name).lower() not in by_name]
+        builtin_count = len(columns["name"])
+        for field in columns.keys() | file_columns.keys():
+            column = columns.setdefault(field, [None] * builtin_count)
+            file_column = file_columns.get(field)
+            column.extend([file_column[index] for index in kept] if file_column else [None] * len(kept))
+        for index, name in enumerate(columns["name"][builtin_count:], start=builtin_count):
+            by_name[str(name).lower()] = index
+
+        self._columns = columns
+        self._by_name = by_name
+        self._by_location = self._by_status = self._sorted_names = self._trigrams = None
+        builtin_names = "\n".join(str(name) for name in columns["name"][:builtin_count])
+        self.signature = hashlib.sha256(f"{builtin_names}\n{file_signature}".encode("utf-8")).hexdigest()
+
+    def _field_index(self, field: str) -> dict[str, list[int]]:
+        index: dict[str, list[int]] = {}
+        for position, value in enumerate(self._columns.get(field) or []):
+            index.setdefault(str(value or "").strip().lower(), []).append(position)
+        return index
+
+    def shop(self, index: int) -> dict[str, str]:
+        """The shop at ``index`` in registry order as a plain dict."""
+        self._ensure_loaded()
+        return {field: column[index] for field, column in self._columns.items() if column[index] is not None}
+
+    def shops(self) -> list[dict[str, str]]:
+        return [self.shop(index) for index in range(len(self))]
+
+    def get(self, name: str) -> dict[str, str] | None:
+        """Look up a shop by name, ignoring case and surrounding whitespace."""
+        self._ensure_loaded()
+        index = self._by_name.get(name.strip().lower())
+        return None if index is None else self.shop(index)
+
+    def ids(self, status: str | None = None) -> Sequence[int]:
+        """Registry positions of every shop, or of the shops with ``status``, in registry order."""
+        self._ensure_loaded()
+        if status is None:
+            return range(len(self._columns["name"]))
+        with self._lock:
+            if self._by_status is None:
+                self._by_status = self._field_index("status")
+            return self._by_status.get(status.strip().lower(), [])
+
+    def by_location(self, location: str) -> list[dict[str, str]]:
+        self._ensure_loaded()
+        with self._lock:
+            if self._by_location is None:
+                self._by_location = self._field_index("location")
+            positions = self._by_location.get(location.strip().lower(), [])
+        return [self.shop(index) for index in positions]
+
+    def by_status(self, status: str) -> list[dict[str, str]]:
+        return [self.shop(index) for index in self.ids(status)]
+
+    def search_prefix(self, prefix: str, limit: int = 10) -> list[dict[str, str]]:
+        """Shops whose name starts with ``prefix``, in alphabetical order."""
+        self._ensure_loaded()
+        with self._lock:
+            if self._sorted_names is None:
+                names = sorted(self._by_name)
+                self._sorted_names = (names, [self._by_name[name] for name in names])
+            names, positions = self._sorted_names
+        prefix = prefix.strip().lower()
+        start = bisect.bisect_left(names, prefix)
+        matches = []
+        for position in range(start, min(start + max(limit, 0), len(names))):
+            if not names[position].startswith(prefix):
+                break
+            matches.append(self.shop(positions[position]))
+        return matches
+
+    @staticmethod
+    def _name_trigrams(name: str) -> set[str]:
+        padded = f"  {name} "
+        return {padded[index : index + 3] for index in range(len(padded) - 2)}
+
+    def search(self, query: str, limit: int = 10, cutoff: float = SHOP_FUZZY_CUTOFF) -> list[dict[str, str]]:
+        """Shops whose name is similar to ``query``, best match first.
+
+        Candidates sharing the most trigrams with the query are ranked by
+        ``difflib`` similarity; matches below ``cutoff`` are dropped.
+        """
+        self._ensure_loaded()
+        query = query.strip().lower()
+        if not query:
+            return []
+        with self._lock:
+            if self._trigrams is None:
+                trigrams: dict[str, list[int]] = {}
+                for name, position in self._by_name.items():
+                    for trigram in self._name_trigrams(name):
+                        trigrams.setdefault(trigram, []).append(position)
+                self._trigrams = trigrams
+            trigram_index = self._trigrams
+        shared: Counter[int] = Counter()
+        for trigram in self._name_trigrams(query):
+            shared.update(trigram_index.get(trigram, ()))
+
+        matcher = difflib.SequenceMatcher(b=query, autojunk=False)
+        scored = []
+        for position, _ in shared.most_common(max(limit, 1) * 10):
+            matcher.set_seq1(str(self._columns["name"][position]).lower())
+            score = matcher.ratio()
+            if score >= cutoff:
+                scored.append((score, position))
+        scored.sort(key=lambda item: (-item[0], item[1]))
+        return [self.shop(position) for _, position in scored[:limit]]
+
+
+def percentile(values: list[float], fraction: float) -> float:
+    """Nearest-rank percentile of ``values``; ``fraction`` is between 0 and 1."""
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, max(0, math.ceil(fraction * len(ordered)) - 1))]
+
+
+def metric_key(stage: str, labels: dict[str, Any]) -> str:
+    """``stage[label=value,...]`` key that groups timings across runs, ignoring ``ok``."""
+    parts = [f"{name}={value}" for name, value in sorted(labels.items()) if name != "ok" and value is not None]
+    return f"{stage}[{','.join(parts)}]" if parts else stage
+
+
+class RunMetrics:
+    """Thread-safe stage timings and counters for one bot run.
+
+    Stages are timed with :meth:`stage` or :meth:`record` and labelled with
+    fields such as the provider or page; byte and retry counts are added
+    with :meth:`count`. :meth:`finish` returns the run report and starts a
+    new run, so a long-lived process writes one report per post.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._start()
+
+    def _start(self) -> None:
+        self.started_at = datetime.now(timezone.utc)
+        self._started = time.perf_counter()
+        self.stages: list[dict[str, Any]] = []
+        self.counters: dict[str, float] = {}
+
+    @contextmanager
+    def stage(self, name: str, **labels: Any) -> Iterator[dict[str, Any]]:
+        """Time the ``with`` block; the yielded labels can be updated, e.g. ``ok=False``."""
+        started = time.perf_counter()
+        try:
+            yield labels
+        except BaseException:
+            labels["ok"] = False
+            raise
+        finally:
+            self.record(name, time.perf_counter() - started, **labels)
+
+    def record(self, name: str, duration: float, **labels: Any) -> None:
+        entry = {"stage": name, "duration": round(duration, 4), "ok": bool(labels.pop("ok", True)), **labels}
+        with self._lock:
+            self.stages.append(entry)
+
+    def count(self, name: str, value: float = 1) -> None:
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def finish(self, run: str) -> dict[str, Any]:
+        with self._lock:
+            stages, counters = self.stages, self.counters
+            report = {
+                "run": run,
+                "started_at": self.started_at.isoformat(),
+                "finished_at": datetime.now(timezone.utc).isoformat(),
+                "duration": round(time.perf_counter() - self._started, 4),
+                "pid": os.getpid(),
+            }
+            self._start()
+
+        summary: dict[str, dict[str, Any]] = {}
+        for entry in stages:
+            key = metric_key(entry["stage"], {k: v for k, v in entry.items() if k not in {"stage", "duration"}})
+            item = summary.setdefault(key, {"count": 0, "failures": 0, "total": 0.0, "max": 0.0})
+            item["count"] += 1
+            item["failures"] += 0 if entry["ok"] else 1
+            item["total"] = round(item["total"] + entry["duration"], 4)
+            item["max"] = max(item["max"], entry["duration"])
+        report.update(stages=stages, summary=summary, counters=counters)
+        return report
+
+
+class RunProfiler:
+    """Opt-in CPU, allocation and HTTP profiling, written to REPORT_DIR.
+
+    :meth:`profile` runs cProfile on the calling thread, samples the stacks
+    of every thread into a flame-graph-ready collapsed-stack file, and diffs
+    tracemalloc snapshots taken before and after the block. :meth:`instrument`
+    and :meth:`aiohttp_trace` record the wall time, bytes and connection
+    reuse of every HTTP request. The bot only creates a profiler when
+    PROFILE or ``--profile`` is set.
+    """
+
+    def __init__(
+        self, directory: Path = REPORT_DIR, interval: float = PROFILE_SAMPLE_INTERVAL, top: int = PROFILE_TOP
+    ) -> None:
+        self.directory = directory
+        self.interval = interval
+        self.top = top
+        self._lock = threading.Lock()
+        self._requests: list[dict[str, Any]] = []
+        self._sockets: weakref.WeakSet[Any] = weakref.WeakSet()
+
+    def _record_request(
+        self,
+        method: str,
+        url: str,
+        status: int | None,
+        seconds: float,
+        sent: int | None,
+        received: int | None,
+        reused: bool | None,
+    ) -> dict[str, Any]:
+        parsed = urlparse(url)
+        entry = {
+            "method": method,
+            "host": parsed.netloc,
+            "path": parsed.path,  # the query string can carry access tokens
+            "status": status,
+            "seconds": round(seconds, 4),
+            "bytes_sent": sent,
+            "bytes_received": received,
+            "reused": reused,
+        }
+        with self._lock:
+            self._requests.append(entry)
+        return entry
+
+    def _connection_reused(self, response: requests.Response) -> bool | None:
+        connection = getattr(response.raw, "connection", None)
+        sock = getattr(connection, "sock", None)
+        if sock is None:
+            return None
+        with self._lock:
+            if sock in self._sockets:
+                return True
+            self._sockets.add(sock)
+            return False
+
+    def instrument(self, session: requests.Session) -> None:
+        """Wrap ``session.send`` so every request, redirects included, is recorded.
+
+        Responses are fetched with ``stream=True`` so the connection can be
+        inspected before the body is read; the body is then read here unless
+        the caller asked to stream it, in which case Content-Length stands
+        in for the bytes received.
+        """
+        send = session.send
+
+        def profiled_send(request: requests.PreparedRequest, **kwargs: Any) -> requests.Response:
+            stream = kwargs.get("stream", False)
+            kwargs["stream"] = True
+            started = time.perf_counter()
+            response = reused = received = None
+            try:
+                response = send(request, **kwargs)
+                reused = self._connection_reused(response)
+                if stream:
+                    received = int(response.headers.get("Content-Length") or 0) or None
+                else:
+                    received = len(response.content)
+                return response
+            finally:
+                body = request.body
+                sent = int(request.headers.get("Content-Length") or 0) or (
+                    len(body) if isinstance(body, (bytes, str)) else 0
+                )
+                self._record_request(
+                    str(request.method),
+                    str(request.url),
+                    response.status_code if response is not None else None,
+                    time.perf_counter() - started,
+                    sent,
+                    received,
+                    reused,
+                )
+
+        session.send = profiled_send
+
+    def aiohttp_trace(self, aiohttp: Any) -> Any:
+        """An ``aiohttp.TraceConfig`` that records requests like :meth:`instrument`.
+
+        The entry is written when the response headers arrive. Bytes received
+        come from Content-Length, or from the body chunks read afterwards
+        when the response has none.
+        """
+        trace = aiohttp.TraceConfig()
+
+        async def on_request_start(_session: Any, context: Any, _params: Any) -> None:
+            context.started = time.perf_counter()
+            context.sent = 0
+            context.reused = None
+            context.entry = None
+
+        async def on_connection_create_end(_session: Any, context: Any, _params: Any) -> None:
+            context.reused = False
+
+        async def on_connection_reuseconn(_session: Any, context: Any, _params: Any) -> None:
+            context.reused = True
+
+        async def on_request_chunk_sent(_session: Any, context: Any, params: Any) -> None:
+            context.sent += len(params.chunk)
+
+        async def on_request_end(_session: Any, context: Any, params: Any) -> None:
+            length = params.response.content_length
+            entry = self._record_request(
+                params.method,
+                str(params.url),
+                params.response.status,
+                time.perf_counter() - context.started,
+                context.sent,
+                length or 0,
+                context.reused,
+            )
+            context.entry = entry if length is None else None
+
+        async def on_request_exception(_session: Any, context: Any, params: Any) -> None:
+            self._record_request(
+                params.method, str(params.url), None, time.perf_counter() - context.started, context.sent, 0, None
+            )
+
+        async def on_response_chunk_received(_session: Any, context: Any, params: Any) -> None:
+            if context.entry is not None:
+                with self._lock:
+                    context.entry["bytes_received"] += len(params.chunk)
+
+        trace.on_request_start.append(on_request_start)
+        trace.on_connection_create_end.append(on_connection_create_end)
+        trace.on_connection_reuseconn.append(on_connection_reuseconn)
+        trace.on_request_chunk_sent.append(on_request_chunk_sent)
+        trace.on_request_end.append(on_request_end)
+        trace.on_request_exception.append(on_request_exception)
+        trace.on_response_chunk_received.append(on_response_chunk_received)
+        return trace
+
+    def _sample(self, stop: threading.Event, stacks: Counter[str], target: int, ignored: set[int | None]) -> None:
+        """Count the stacks of ``target`` and of threads not in ``ignored`` each ``interval`` until ``stop`` is set."""
+        ignored = ignored | {threading.get_ident()}
+        while not stop.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident in ignored and ident != target:
+                    continue
+                frames: list[str] = []
+                while frame is not None:
+                    code = frame.f_code
+                    frames.append(f"{code.co_name} ({Path(code.co_filename).name}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                frames.append(names.get(ident, str(ident)))
+                stacks[";".join(reversed(frames))] += 1
+
+    @contextmanager
+    def profile(self, name: str) -> Iterator[None]:
+        """Profile the ``with`` block and write ``profile_<time>_<name>_<pid>.*`` to ``directory``."""
+        # Imported here so module import stays fast when profiling is off.
+        import cProfile
+        import tracemalloc
+
+        started_at = datetime.now(timezone.utc)
+        started = time.perf_counter()
+        with self._lock:
+            first_request = len(self._requests)
+        started_tracing = not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+        before = tracemalloc.take_snapshot()
+
+        # Threads that were already running, such as the log listener, are left out of the sampled stacks.
+        stacks: Counter[str] = Counter()
+        stop = threading.Event()
+        running = {thread.ident for thread in threading.enumerate()}
+        sampler = threading.Thread(
+            target=self._sample,
+            args=(stop, stacks, threading.get_ident(), running),
+            name="profile-sampler",
+            daemon=True,
+        )
+        sampler.start()
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            stop.set()
+            sampler.join()
+            after = tracemalloc.take_snapshot()
+            _, peak = tracemalloc.get_traced_memory()
+            if started_tracing:
+                tracemalloc.stop()
+            with self._lock:
+                calls = self._requests[first_request:]
+            self._write(name, started_at, time.perf_counter() - started, profiler, stacks, before, after, peak, calls)
+
+    def _write(
+        self,
+        name: str,
+        started_at: datetime,
+        duration: float,
+        profiler: Any,
+        stacks: Counter[str],
+        before: Any,
+        after: Any,
+        peak: int,
+        calls: list[dict[str, Any]],
+    ) -> None:
+        import pstats
+        import tracemalloc
+
+        stem = f"profile_{started_at.strftime('%Y%m%dT%H%M%S.%fZ')}_{name}_{os.getpid()}"
+        stats = pstats.Stats(profiler)
+        functions = sorted(stats.stats.items(), key=lambda item: item[1][3], reverse=True)[: self.top]
+        ignored = [
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        ]
+        allocations = after.filter_traces(ignored).compare_to(before.filter_traces(ignored), "lineno")[: self.top]
+        summary = {
+            "name": name,
+            "started_at": started_at.isoformat(),
+            "duration": round(duration, 4),
+            "pid": os.getpid(),
+            "functions": [
+                {
+                    "function": f"{function} ({Path(filename).name}:{line})",
+                    "calls": calls_count,
+                    "self_seconds": round(self_time, 4),
+                    "cumulative_seconds": round(cumulative, 4),
+                }
+                for (filename, line, function), (_, calls_count, self_time, cumulative, _) in functions
+            ],
+            "allocations": {
+                "peak_bytes": peak,
+                "top": [
+                    {
+                        "location": f"{Path(stat.traceback[0].filename).name}:{stat.traceback[0].lineno}",
+                        "size_diff": stat.size_diff,
+                        "count_diff": stat.count_diff,
+                    }
+                    for stat in allocations
+                ],
+            },
+            "http": {
+                "requests": len(calls),
+                "reused_connections": sum(1 for call in calls if call["reused"]),
+                "new_connections": sum(1 for call in calls if call["reused"] is False),
+                "seconds": round(sum(call["seconds"] for call in calls), 4),
+                "bytes_sent": sum(call["bytes_sent"] or 0 for call in calls),
+                "bytes_received": sum(call["bytes_received"] or 0 for call in calls),
+                "calls": calls,
+            },
+        }
+        try:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            stats.dump_stats(self.directory / f"{stem}.pstats")
+            (self.directory / f"{stem}.collapsed").write_text(
+                "".join(f"{stack} {count}\n" for stack, count in sorted(stacks.items())), encoding="utf-8"
+            )
+            TurkeyProvoloneBot._atomic_write_json(self.directory / f"{stem}.json", summary)
+        except OSError as exc:
+            logger.error("Could not write profile %s: %s", stem, exc)
+            return
+        logger.info(
+            "Wrote profile %s: %s HTTP request(s), %s reused, peak %s traced bytes",
+            stem,
+            len(calls),
+            summary["http"]["reused_connections"],
+            peak,
+        )
+
+
+def summarize_reports(directory: Path = REPORT_DIR, limit: int | None = None) -> dict[str, dict[str, float]]:
+    """Latency percentiles per stage and label set across the saved run reports."""
+    paths = sorted(directory.glob("run_*.json"))
+    durations: dict[str, list[float]] = {}
+    for path in paths[-limit:] if limit else paths:
+        try:
+            with path.open("r", encoding="utf-8") as file:
+                report = json.load(file)
+        except (OSError, json.JSONDecodeError) as exc:
+            logger.warning("Skipping unreadable run report %s: %s", path.name, exc)
+            continue
+        for entry in report.get("stages") or [] if isinstance(report, dict) else []:
+            if not isinstance(entry, dict) or "stage" not in entry:
+                continue
+            labels = {k: v for k, v in entry.items() if k not in {"stage", "duration"}}
+            durations.setdefault(metric_key(entry["stage"], labels), []).append(float(entry.get("duration") or 0))
+    return {
+        key: {
+            "count": len(values),
+            "p50": percentile(values, 0.5),
+            "p90": percentile(values, 0.9),
+            "p99": percentile(values, 0.99),
+            "max": max(values),
+        }
+        for key, values in sorted(durations.items())
+    }
+
+
+def write_prometheus_textfile(report: dict[str, Any], path: Path) -> None:
+    """Write a run report in the Prometheus node_exporter textfile format."""
+
+    def labels_text(labels: dict[str, Any]) -> str:
+        escaped = (
+            (name, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+            for name, value in sorted(labels.items())
+            if value is not None
+        )
+        return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+    lines = [
+        "# HELP sandwich_stage_seconds_total Time spent in each stage during the last run.",
+        "# TYPE sandwich_stage_seconds_total gauge",
+    ]
+    totals: dict[str, tuple[dict[str, Any], float, int]] = {}
+    for entry in report.get("stages", []):
+        labels = {k: v for k, v in entry.items() if k not in {"duration", "ok"}}
+        key = metric_key(entry["stage"], labels)
+        _, total, count = totals.get(key, (labels, 0.0, 0))
+        totals[key] = (labels, total + entry["duration"], count + 1)
+    lines += [f"sandwich_stage_seconds_total{labels_text(labels)} {total}" for labels, total, _ in totals.values()]
+    lines += ["# TYPE sandwich_stage_count gauge"]
+    lines += [f"sandwich_stage_count{labels_text(labels)} {count}" for labels, _, count in totals.values()]
+    lines += ["# TYPE sandwich_run_counter gauge"]
+    lines += [
+        f"sandwich_run_counter{labels_text({'name': name})} {value}"
+        for name, value in sorted(report.get("counters", {}).items())
+    ]
+    lines += [
+        "# TYPE sandwich_last_run_duration_seconds gauge",
+        f"sandwich_last_run_duration_seconds{labels_text({'run': report.get('run')})} {report.get('duration', 0)}",
+        "# TYPE sandwich_last_run_timestamp_seconds gauge",
+        f"sandwich_last_run_timestamp_seconds {time.time():.3f}",
+    ]
+    path.parent.mkdir(parents=True, exist_ok=True)
+    descriptor, temp_name = tempfile.mkstemp(prefix=f".{path.name}.", suffix=".tmp", dir=path.parent)
+    with os.fdopen(descriptor, "w", encoding="utf-8") as file:
+        file.write("\n".join(lines) + "\n")
+    os.replace(temp_name, path)
+
+
+def send_statsd(report: dict[str, Any], address: str, prefix: str = "sandwich") -> int:
+    """Send stage timings and counters to a StatsD server over UDP; returns packets sent."""
+    host, _, port = address.rpartition(":")
+    if not host or not port.isdigit():
+        raise ValueError(f"STATSD_ADDRESS must be host:port, got {address!r}")
+
+    def name_part(value: Any) -> str:
+        return "".join(char if char.isalnum() else "_" for char in str(value)).strip("_").lower()
+
+    lines = []
+    for entry in report.get("stages", []):
+        metric = ".".join(
+            name_part(part) for part in (prefix, entry["stage"], entry.get("provider")) if part is not None
+        )
+        lines.append(f"{metric}:{entry['duration'] * 1000:.1f}|ms")
+    lines += [f"{prefix}.{name_part(name)}:{value:g}|c" for name, value in report.get("counters", {}).items()]
+
+    with closing(socket.socket(socket.AF_INET, socket.SOCK_DGRAM)) as sock:
+        for line in lines:
+            sock.sendto(line.encode("utf-8"), (host, int(port)))
+    return len(lines)
+
+
+class ProviderRouter:
+    """Orders image providers by their recent health, persisted across runs.
+
+    Each provider keeps an exponentially weighted success rate and success
+    latency. ``latency`` routing tries the provider with the lowest expected
+    time-to-image (latency divided by success rate) first, ``cost`` the one
+    with the lowest expected cost per image, and ``fixed`` keeps the
+    configured order. A provider that fails ``failure_threshold`` times in a
+    row is skipped until its cooldown ends, after which one trial attempt
+    decides whether the circuit closes again. ``clock`` supplies the wall
+    time used for cooldowns.
+    """
+
+    def __init__(
+        self,
+        path: Path = PROVIDER_HEALTH_FILE,
+        strategy: str = "latency",
+        costs: dict[str, float] | None = None,
+        alpha: float = ROUTER_EWMA_ALPHA,
+        failure_threshold: int = ROUTER_FAILURE_THRESHOLD,
+        cooldown: float = ROUTER_COOLDOWN,
+        clock: Callable[[], float] = time.time,
+    ) -> None:
+        self.path = path
+        self.strategy = strategy
+        self.costs = {**PROVIDER_COSTS, **(costs or {})}
+        self.alpha = alpha
+        self.failure_threshold = max(1, failure_threshold)
+        self.cooldown = cooldown
+        self.clock = clock
+        self._lock = threading.Lock()
+
+    def _load(self) -> dict[str, dict[str, Any]]:
+        try:
+            with self.path.open("r", encoding="utf-8") as file:
+                loaded = json.load(file)
+        except FileNotFoundError:
+            return {}
+        except (OSError, json.JSONDecodeError) as exc:
+            logger.warning("Ignoring unreadable provider health file: %s", exc)
+            return {}
+        if not isinstance(loaded, dict):
+            return {}
+        return {name: entry for name, entry in loaded.items() if isinstance(entry, dict)}
+
+    def health(self, name: str) -> dict[str, Any]:
+        with self._lock:
+            return {**self._default_health(), **self._load().get(name, {})}
+
+    @staticmethod
+    def _default_health() -> dict[str, Any]:
+        return {
+            "success_rate": 1.0,
+            "latency": ROUTER_DEFAULT_LATENCY,
+            "samples": 0,
+            "consecutive_failures": 0,
+            "open_until": 0.0,
+        }
+
+    def _score(self, name: str, health: dict[str, Any]) -> float:
+        success_rate = max(float(health["success_rate"]), ROUTER_MIN_SUCCESS_RATE)
+        if self.strategy == "cost":
+            return self.costs.get(name, 0.0) / success_rate
+        return float(health["latency"]) / success_rate
+
+    def order(self, providers: list[tuple[str, ImageGenerator]]) -> list[tuple[str, ImageGenerator]]:
+        """Return the providers to try, best first, leaving out those with an open circuit."""
+        with self._lock:
+            state = self._load()
+        now = self.clock()
+        available: list[tuple[float, int, tuple[str, ImageGenerator]]] = []
+        skipped: list[str] = []
+        decisions: list[str] = []
+        for index, provider in enumerate(providers):
+            name = provider[0]
+            health = {**self._default_health(), **state.get(name, {})}
+            if float(health["open_until"]) > now:
+                skipped.append(name)
+                decisions.append(f"{name}=circuit open for {float(health['open_until']) - now:.0f}s")
+                continue
+            score = self._score(name, health) if self.strategy != "fixed" else float(index)
+            available.append((score, index, provider))
+            decisions.append(
+                f"{name}=score {score:.3g} (success {float(health['success_rate']):.2f}, "
+                f"latency {float(health['latency']):.2f}s, {health['samples']} samples)"
+            )
+
+        if not available:
+            logger.warning("Every image provider circuit is open; trying them all in configured order")
+            return list(providers)
+        ordered = [provider for _, _, provider in sorted(available, key=lambda item: (item[0], item[1]))]
+        logger.info(
+            "Provider routing (%s): %s -> order %s%s",
+            self.strategy,
+            "; ".join(decisions),
+            ", ".join(name for name, _ in ordered),
+            f"; skipped {', '.join(skipped)}" if skipped else "",
+        )
+        return ordered
+
+    def record(self, name: str, succeeded: bool, duration: float) -> None:
+        """Fold one attempt into the provider's health and open or close its circuit."""
+        with self._lock:
+            state = self._load()
+            health = {**self._default_health(), **state.get(name, {})}
+            health["samples"] = int(health["samples"]) + 1
+            health["success_rate"] = round(
+                (1 - self.alpha) * float(health["success_rate"]) + self.alpha * (1.0 if succeeded else 0.0), 4
+            )
+            if succeeded:
+                successes = int(health.get("successes", 0))
+                latency = (1 - self.alpha) * float(health["latency"]) + self.alpha * duration if successes else duration
+                health.update(latency=round(latency, 3), successes=successes + 1)
+                if health["consecutive_failures"] or health["open_until"]:
+                    logger.info("Closing circuit for image provider %s after a success", name)
+                health.update(consecutive_failures=0, open_until=0.0)
+            else:
+                health["consecutive_failures"] = int(health["consecutive_failures"]) + 1
+                if health["consecutive_failures"] >= self.failure_threshold:
+                    health["open_until"] = self.clock() + self.cooldown
+                    logger.warning(
+                        "Opening circuit for image provider %s for %.0fs after %s consecutive failures",
+                        name,
+                        self.cooldown,
+                        health["consecutive_failures"],
+                    )
+            health["updated_at"] = datetime.now(timezone.utc).isoformat()
+            state[name] = health
+            try:
+                TurkeyProvoloneBot._atomic_write_json(self.path, state)
+            except OSError as exc:
+                logger.warning("Could not persist provider health: %s", exc)
+
+
+class GraphThrottle:
+    """Paces Graph API calls by the usage Facebook reports in response headers.
+
+    ``X-App-Usage`` reports the app's share of its rolling one-hour limit,
+    and ``X-Page-Usage`` and ``X-Business-Use-Case-Usage`` report each
+    page's share, as percentages. Every app and page gets a token bucket.
+    Below ``threshold`` percent calls are not paced. Above it the bucket
+    refills at ``rate`` calls per second, scaled down linearly as usage
+    approaches 100%. At 100%, or when Facebook sends an
+    ``estimated_time_to_regain_access``, the bucket is closed until access
+    returns, or for ``cooldown`` seconds without an estimate. Callers that
+    find no token wait and ask again, so queued calls go out at the paced
+    rate instead of failing, and speed up as soon as a response reports
+    lower usage. Readings are persisted so the next run starts paced.
+    """
+
+    def __init__(
+        self,
+        path: Path = GRAPH_USAGE_FILE,
+        threshold: float = GRAPH_USAGE_THRESHOLD,
+        rate: float = GRAPH_THROTTLE_RATE,
+        burst: float = GRAPH_THROTTLE_BURST,
+        cooldown: float = GRAPH_THROTTLE_COOLDOWN,
+    ) -> None:
+        self.path = path
+        self.threshold = min(max(threshold, 0.0), 99.0)
+        self.rate = max(rate, 0.001)
+        self.burst = max(burst, 1.0)
+        self.cooldown = max(cooldown, 0.0)
+        self._lock = threading.Lock()
+        self._buckets: dict[str, dict[str, float]] | None = None
+
+    def _load(self) -> dict[str, dict[str, float]]:
+        if self._buckets is not None:
+            return self._buckets
+        buckets: dict[str, dict[str, float]] = {}
+        try:
+            with self.path.open("r", encoding="utf-8") as file:
+                loaded = json.load(file)
+        except FileNotFoundError:
+            loaded = {}
+        except (OSError, json.JSONDecodeError) as exc:
+            logger.warning("Ignoring unreadable Graph usage file: %s", exc)
+            loaded = {}
+        if isinstance(loaded, dict):
+            for key, entry in loaded.items():
+                try:
+                    buckets[key] = {field: float(entry[field]) for field in GRAPH_BUCKET_FIELDS}
+                except (KeyError, TypeError, ValueError):
+                    continue
+        self._buckets = buckets
+        return buckets
+
+    def _save(self, buckets: dict[str, dict[str, float]]) -> None:
+        try:
+            TurkeyProvoloneBot._atomic_write_json(self.path, buckets)
+        except OSError as exc:
+            logger.warning("Could not write Graph usage file: %s", exc)
+
+    def _paced(self, bucket: dict[str, float], now: float) -> bool:
+        fresh = now - bucket["updated_at"] < GRAPH_USAGE_WINDOW
+        return bucket["blocked_until"] > now or (fresh and bucket["usage"] >= self.threshold)
+
+    def _refill_rate(self, bucket: dict[str, float]) -> float:
+        headroom = max(100.0 - min(bucket["usage"], 99.0), 1.0)
+        return self.rate * headroom / (100.0 - self.threshold)
+
+    def acquire(self, keys: Sequence[str]) -> float:
+        """Take one call from each bucket in ``keys``; returns 0, or the seconds to wait before asking again."""
+        now = time.time()
+        wait = 0.0
+        ready = []
+        with self._lock:
+            buckets = self._load()
+            for key in keys:
+                bucket = buckets.get(key)
+                if bucket is None or not self._paced(bucket, now):
+                    continue
+                if bucket["blocked_until"] > now:
+                    wait = max(wait, bucket["blocked_until"] - now)
+                    continue
+                rate = self._refill_rate(bucket)
+                tokens = min(self.burst, bucket["tokens"] + max(now - bucket["refilled_at"], 0.0) * rate)
+                bucket["tokens"], bucket["refilled_at"] = tokens, now
+                if tokens < 1:
+                    wait = max(wait, min((1 - tokens) / rate, GRAPH_THROTTLE_RECHECK))
+                else:
+                    ready.append(bucket)
+            if wait > 0:
+                return wait
+            for bucket in ready:
+                bucket["tokens"] -= 1
+        return 0.0
+
+    def update(self, key: str, usage: float, regain_after: float = 0.0) -> None:
+        """Record ``usage`` percent for ``key``, closing the bucket at 100% or while access is being regained."""
+        now = time.time()
+        with self._lock:
+            buckets = self._load()
+            bucket = buckets.get(key) or {
+                "usage": 0.0,
+                "updated_at": now,
+                "tokens": self.burst,
+                "refilled_at": now,
+                "blocked_until": 0.0,
+            }
+            was_paced = self._paced(bucket, now)
+            bucket["usage"], bucket["updated_at"] = usage, now
+            if usage >= 100.0 or regain_after > 0:
+                blocked_until = now + (regain_after or self.cooldown)
+                if blocked_until > bucket["blocked_until"]:
+                    logger.warning(
+                        "Graph API %s usage at %.0f%%; holding its calls for %.0fs", key, usage, blocked_until - now
+                    )
+                    # One call goes through when access returns; its headers decide the pace after that.
+                    bucket.update(blocked_until=blocked_until, tokens=1.0, refilled_at=blocked_until)
+            elif not was_paced and usage >= self.threshold:
+                logger.info("Graph API %s usage at %.0f%%; pacing its calls", key, usage)
+                bucket.update(tokens=self.burst, refilled_at=now)
+            buckets[key] = bucket
+            if was_paced or self._paced(bucket, now):
+                self._save(buckets)
+
+    @staticmethod
+    def _usage(entry: Any) -> float:
+        if not isinstance(entry, dict):
+            return 0.0
+        values = [entry.get(field) for field in ("call_count", "total_cputime", "total_time")]
+        return max([float(value) for value in values if isinstance(value, (int, float))], default=0.0)
+
+    def observe(self, headers: Any, page_id: str | None = None) -> None:
+        """Update the buckets from a Graph response's usage headers; ``page_id`` is the page the call was for."""
+        readings: list[tuple[str, float, float]] = []
+        for header in GRAPH_USAGE_HEADERS:
+            raw = headers.get(header)
+            if not raw:
+                continue
+            try:
+                usage = json.loads(raw)
+            except ValueError:
+                logger.debug("Ignoring malformed %s header", header)
+                continue
+            if header == "X-App-Usage":
+                readings.append(("app", self._usage(usage), 0.0))
+            elif header == "X-Page-Usage":
+                if page_id:
+                    readings.append((f"page:{page_id}", self._usage(usage), 0.0))
+            elif isinstance(usage, dict):
+                for business_id, entries in usage.items():
+                    entries = entries if isinstance(entries, list) else [entries]
+                    regain_minutes = [
+                        entry.get("estimated_time_to_regain_access")
+                        for entry in entries
+                        if isinstance(entry, dict)
+                    ]
+                    regain = max([float(m) for m in regain_minutes if isinstance(m, (int, float))], default=0.0)
+                    readings.append(
+                        (f"page:{business_id}", max(map(self._usage, entries), default=0.0), regain * 60)
+                    )
+        for key, usage, regain_after in readings:
+            self.update(key, usage, regain_after)
 
 
 class TurkeyProvoloneBot:
     """Create sandwich captions, generate images, and publish to Facebook."""
 
-    def __init__(self, session: requests.Session | None = None) -> None:
-        self.session = session or requests.Session()
+    def __init__(self, session: requests.Session | None = None) -> None:
+        self.session = session or requests.Session()
+
+        self.facebook_access_token = self._get_env("FACEBOOK_ACCESS_TOKEN")
+        self.facebook_page_ids = self._get_page_ids()
+        self.facebook_page_id = self.facebook_page_ids[0] if self.facebook_page_ids else None
+        self.page_access_tokens: dict[str, str] = {}
+        graph_api_base = (self._get_env("FACEBOOK_GRAPH_URL") or GRAPH_API_BASE).rstrip("/")
+        self.graph_api_url = f"{graph_api_base}/{FACEBOOK_API_VERSION}"
+        self.page_concurrency = max(1, int(self._get_float_env("PAGE_CONCURRENCY", PAGE_CONCURRENCY)))
+        self.generation_concurrency = max(
+            1, int(self._get_float_env("GENERATION_CONCURRENCY", GENERATION_CONCURRENCY))
+        )
+        self._facebook_ready = False
+        self._facebook_checked = False
+        self._facebook_lock = threading.RLock()
+        self.credential_cache = CredentialCache(
+            ttl=self._get_float_env("CREDENTIAL_CACHE_TTL", CREDENTIAL_CACHE_TTL)
+        )
+        pool_size = max(DEFAULT_POOL_SIZE, min(len(self.facebook_page_ids), self.page_concurrency) + 4)
+        self.http_pool_size = max(pool_size, int(self._get_float_env("HTTP_POOL_SIZE", 0)))
+        if session is None:
+            # Retries are handled by _request, which knows the run deadline and Retry-After.
+            adapter = HTTPAdapter(pool_connections=DEFAULT_POOL_SIZE, pool_maxsize=self.http_pool_size, max_retries=0)
+            self.session.mount("https://", adapter)
+            self.session.mount("http://", adapter)
+        self.http_max_retries = int(self._get_float_env("HTTP_MAX_RETRIES", HTTP_MAX_RETRIES))
+        self.deadline: float | None = None
+        self.deadline_exhausted_stage: str | None = None
+
+        self.openai_api_key = self._get_env("OPENAI_API_KEY")
+        self.stability_api_key = self._get_env("STABILITY_API_KEY")
+        self.replicate_api_token = self._get_env("REPLICATE_API_TOKEN")
+        self.replicate_api_base = (self._get_env("REPLICATE_API_BASE") or REPLICATE_API_BASE).rstrip("/")
+        self.openai_api_base = (self._get_env("OPENAI_API_BASE") or OPENAI_API_BASE).rstrip("/")
+        self.stability_api_base = (self._get_env("STABILITY_API_BASE") or STABILITY_API_BASE).rstrip("/")
+        self.allowed_download_schemes = frozenset({"https"})
+        self.replicate_sync_wait = min(int(self._get_float_env("REPLICATE_SYNC_WAIT", REPLICATE_SYNC_WAIT)), 60)
+        self.replicate_max_wait = self._get_float_env("REPLICATE_MAX_WAIT", REPLICATE_MAX_WAIT)
+        self.replicate_webhook_url = self._get_env("REPLICATE_WEBHOOK_URL")
+        self.replicate_webhook_host = self._get_env("REPLICATE_WEBHOOK_HOST") or REPLICATE_WEBHOOK_HOST
+        self.replicate_webhook_port = int(self._get_float_env("REPLICATE_WEBHOOK_PORT", REPLICATE_WEBHOOK_PORT))
+        self._replicate_webhook: ReplicateWebhookListener | None = None
+        self._replicate_webhook_lock = threading.Lock()
+        self.openai_image_model = self._get_env("OPENAI_IMAGE_MODEL") or "dall-e-3"
+        self.image_provider_mode = (self._get_env("IMAGE_PROVIDER_MODE") or "serial").lower()
+        if self.image_provider_mode not in IMAGE_PROVIDER_MODES:
+            logger.warning("Unknown IMAGE_PROVIDER_MODE %r; using serial", self.image_provider_mode)
+            self.image_provider_mode = "serial"
+        self.image_hedge_delay = self._get_float_env("IMAGE_HEDGE_DELAY", DEFAULT_HEDGE_DELAY)
+        # The cancel event of the hedged race the current thread's provider runs in, if any.
+        self._provider_race = threading.local()
+        routing = (self._get_env("PROVIDER_ROUTING") or "latency").lower()
+        if routing not in PROVIDER_ROUTING_STRATEGIES:
+            logger.warning("Unknown PROVIDER_ROUTING %r; using latency", routing)
+            routing = "latency"
+        self.provider_router = ProviderRouter(
+            strategy=routing,
+            costs=self._get_provider_costs(),
+            failure_threshold=int(self._get_float_env("PROVIDER_FAILURE_THRESHOLD", ROUTER_FAILURE_THRESHOLD)),
+            cooldown=self._get_float_env("PROVIDER_COOLDOWN", ROUTER_COOLDOWN),
+        )
+        self.graph_throttle = GraphThrottle(
+            threshold=self._get_float_env("GRAPH_USAGE_THRESHOLD", GRAPH_USAGE_THRESHOLD),
+            rate=self._get_float_env("GRAPH_THROTTLE_RATE", GRAPH_THROTTLE_RATE),
+            burst=self._get_float_env("GRAPH_THROTTLE_BURST", GRAPH_THROTTLE_BURST),
+            cooldown=self._get_float_env("GRAPH_THROTTLE_COOLDOWN", GRAPH_THROTTLE_COOLDOWN),
+        )
+        self.last_image_report: dict[str, Any] = {}
+        self.metrics = RunMetrics()
+        self.profiler: RunProfiler | None = None
+        if self._get_bool_env("PROFILE", False):
+            self.profiler = RunProfiler(
+                interval=self._get_float_env("PROFILE_SAMPLE_INTERVAL", PROFILE_SAMPLE_INTERVAL),
+                top=max(int(self._get_float_env("PROFILE_TOP", PROFILE_TOP)), 1),
+            )
+            self.profiler.instrument(self.session)
+        self.image_output_format = (self._get_env("IMAGE_OUTPUT_FORMAT") or "jpeg").lower()
+        if self.image_output_format not in IMAGE_OUTPUT_FORMATS:
+            logger.warning("Unknown IMAGE_OUTPUT_FORMAT %r; using jpeg", self.image_output_format)
+            self.image_output_format = "jpeg"
+        self.image_quality = min(max(int(self._get_float_env("IMAGE_QUALITY", IMAGE_QUALITY)), 1), 100)
+        self.image_max_dimension = max(int(self._get_float_env("IMAGE_MAX_DIMENSION", IMAGE_MAX_DIMENSION)), 1)
+        self.image_batch_size = max(1, int(self._get_float_env("IMAGE_BATCH_SIZE", 1)))
+        self.image_pool = ImagePool()
+        self.save_generated_images = self._get_bool_env("SAVE_GENERATED_IMAGES", True)
+        self.image_url_passthrough = self._get_bool_env("IMAGE_URL_PASSTHROUGH", False)
+        self.image_url_archive = self._get_bool_env("IMAGE_URL_ARCHIVE", False)
+        self._archive_executor: ThreadPoolExecutor | None = None
+        self._archive_lock = threading.Lock()
+        self.failed_posts = FailedPostQueue()
+        self.post_history = PostHistory()
+        self.image_cache: ImageCache | None = None
+        if self._get_bool_env("IMAGE_CACHE", True):
+            self.image_cache = ImageCache(
+                max_bytes=int(self._get_float_env("IMAGE_CACHE_MAX_BYTES", IMAGE_CACHE_MAX_BYTES)),
+                policy=(self._get_env("IMAGE_CACHE_POLICY") or "lru").lower(),
+                reuse_after=int(self._get_float_env("IMAGE_CACHE_REUSE_AFTER", IMAGE_CACHE_REUSE_AFTER)),
+            )
+        self.image_dedup = (self._get_env("IMAGE_DEDUP") or "regenerate").lower()
+        if self.image_dedup not in IMAGE_DEDUP_ACTIONS:
+            logger.warning("Unknown IMAGE_DEDUP %r; using regenerate", self.image_dedup)
+            self.image_dedup = "regenerate"
+        self.image_dedup_distance = max(int(self._get_float_env("IMAGE_DEDUP_DISTANCE", IMAGE_DEDUP_DISTANCE)), 0)
+        self.image_dedup_window = self._get_float_env("IMAGE_DEDUP_WINDOW_DAYS", IMAGE_DEDUP_WINDOW_DAYS) * 86400
+        self.image_dedup_retries = max(int(self._get_float_env("IMAGE_DEDUP_RETRIES", IMAGE_DEDUP_RETRIES)), 0)
+        self.image_hashes = ImageHashIndex(
+            scan_batch=max(int(self._get_float_env("IMAGE_HASH_SCAN_BATCH", IMAGE_HASH_SCAN_BATCH)), 0),
+            window=self.image_dedup_window,
+        )
+
+        self.image_prompts = [
+            "A perfectly crafted turkey and provolone sandwich on fresh sourdough bread, professional food photography, appetizing lighting, restaurant quality",
+            "Close-up of a gourmet turkey and provolone sandwich with crisp lettuce and tomato, artisanal bread, food photography style",
+            "A delicious turkey and provolone panini with golden crispy bread, melted cheese visible, professional food styling",
+            "Fresh turkey and provolone sandwich on ciabatta bread with avocado, natural lighting, food magazine quality photo",
+            "A mouth-watering turkey and provolone club sandwich with multiple layers, professional food photography",
+            "Grilled turkey and provolone sandwich cut in half showing the layers, steam rising, warm lighting",
+            "Turkey and provolone sandwich on a rustic wooden board with herbs, artisanal presentation, food blog style",
+            "A hearty turkey and provolone sandwich on whole grain bread, fresh vegetables, clean food photography",
+            "Gourmet turkey and provolone sandwich with herb aioli, professional kitchen background, chef's presentation",
+            "A classic turkey and provolone sandwich on fresh white bread, simple and appetizing, deli-style photography",
+        ]
+
+        self.style_additions = [
+            ", 4K high resolution, professional food photography",
+            ", warm natural lighting, shallow depth of field",
+            ", commercial food photography, appetizing presentation",
+            ", rustic wooden background, artisanal style",
+            ", clean white background, minimalist food photography",
+            ", cozy cafe atmosphere, warm lighting",
+            ", vintage food photography style, film grain",
+            ", modern food styling, geometric plating",
+        ]
+
+        self.caption_templates = [
+            "Chat, this turkey and provolone on {bread} is actually elite. {condiment} pullin up with S-tier aura. #NoCap #SandwichTok",
+            "Lowkey this {bread} turkey-provolone stack got main character energy. Add {addon} and suddenly it's a certified W.",
+            "POV: the {condiment} hit, the provolone melted, and the turkey sandwich started acting famous. Big lunch aura.",
+            "This turkey and provolone with {addon} is bussin respectfully. Zero crumbs, maximum rizz.",
+            "Not to glaze, but this {bread} situation is giving legendary. Turkey, provolone, {condiment}. Say less.",
+            "The lunch meta just shifted: turkey, provolone, {addon}, {condiment}. This build is cracked.",
+            "Be so for real, this turkey-provolone combo clears. {bread} plus {addon} equals instant aura farming.",
+            "Skibidi sandwich check: turkey stacked, provolone locked in, {condiment} carrying the squad.",
+            "This is not a regular sandwich, this is a side quest reward. {bread}, turkey, provolone, {addon}. W eats.",
+            "Turkey and provolone woke up and chose rizz. {condiment} on {bread} is the final boss of lunch.",
+        ]
+
+        self.featured_shop_templates = [
+            "Shop spotlight: {name} in {location} is lowkey the turkey-provolone final boss. {specialty}? Certified W.",
+            "{name} in {location} said bet and served {specialty}. Main character sandwich energy.",
+            "Not to glaze, but {name} ({location}) has S-tier aura. Pull up for {specialty}. No cap.",
+            "Side quest unlocked: {name}, {location}. Reward: {specialty}. W eats.",
+            "Featured shop check: {name} is carrying {location} with {specialty}. Say less.",
+        ]
+
+        self.image_style_prompts = {
+            "grilled_panini": "A perfectly grilled turkey and provolone panini sandwich, golden crispy bread with grill marks, melted cheese oozing out",
+            "gourmet_close_up": "Extreme close-up of a gourmet turkey and provolone sandwich, focusing on the layers and textures",
+            "classic_deli": "A classic deli-style turkey and provolone sandwich on fresh bread, traditional presentation",
+            "gourmet_weekend": "Fresh turkey and provolone sandwich on ciabatta bread with avocado and olive oil, natural light",
+            "classic_full": "A turkey and provolone sandwich with lettuce and tomato, neatly cut and plated",
+        }
+
+        self._sandwich_shops = [
+            {
+                "name": "Tony's Deli",
+                "location": "Downtown",
+                "specialty": "Classic turkey and provolone on fresh Italian bread",
+                "added_by": "admin",
+                "date_added": "2025-01-01",
+                "status": "verified",
+            },
+            {
+                "name": "Corner Bistro",
+                "location": "Main Street",
+                "specialty": "Gourmet turkey with aged provolone and herb aioli",
+                "added_by": "admin",
+                "date_added": "2025-01-01",
+                "status": "verified",
+            },
+        ]
+
+        self.bread_types = [
+            "sourdough",
+            "ciabatta",
+            "whole wheat",
+            "rye",
+            "focaccia",
+            "kaiser roll",
+            "everything bagel",
+            "french bread",
+            "pumpernickel",
+        ]
+
+        self.add_ons = [
+            "crisp lettuce",
+            "ripe tomatoes",
+            "red onion",
+            "pickles",
+            "avocado",
+            "sprouts",
+            "roasted red peppers",
+            "cucumber",
+        ]
+
+        self.condiments = [
+            "mayo",
+            "mustard",
+            "pesto",
+            "olive oil",
+            "balsamic glaze",
+            "herb aioli",
+            "honey mustard",
+            "chipotle mayo",
+        ]
+        self.shop_registry = ShopRegistry(self._sandwich_shops)
+        self.featured_shop_rate = min(self._get_float_env("FEATURED_SHOP_RATE", 0.0), 1.0)
+        self.featured_shop_status = self._get_env("FEATURED_SHOP_STATUS")
+        self._caption_scheduler: CaptionScheduler | None = None
+        self._caption_vocabulary: list[list[str]] = []
+        self._featured_shop_scheduler: CaptionScheduler | None = None
+
+    @property
+    def facebook_ready(self) -> bool:
+        """Whether at least one page is usable; verifies credentials on first use."""
+        with self._facebook_lock:
+            if not self._facebook_checked:
+                self.setup_facebook()
+            return self._facebook_ready
+
+    @facebook_ready.setter
+    def facebook_ready(self, value: bool) -> None:
+        with self._facebook_lock:
+            self._facebook_ready = value
+            self._facebook_checked = True
+
+    @property
+    def sandwich_shops(self) -> list[dict[str, str]]:
+        """Built-in shops plus ``sandwich_shops.json``, loaded on first use."""
+        return self.shop_registry.shops()
+
+    @staticmethod
+    def _get_env(name: str) -> str | None:
+        value = os.getenv(name)
+        return value.strip() if value and value.strip() else None
+
+    @classmethod
+    def _get_page_ids(cls) -> list[str]:
+        """Page ids from FACEBOOK_PAGE_IDS (comma separated) or FACEBOOK_PAGE_ID."""
+        configured = cls._get_env("FACEBOOK_PAGE_IDS") or cls._get_env("FACEBOOK_PAGE_ID") or ""
+        page_ids: list[str] = []
+        for page_id in configured.split(","):
+            page_id = page_id.strip()
+            if page_id and page_id not in page_ids:
+                page_ids.append(page_id)
+        return page_ids
+
+    @classmethod
+    def _get_provider_costs(cls) -> dict[str, float]:
+        """Per-image costs from PROVIDER_COSTS, e.g. ``OpenAI=0.04,Stability AI=0.006``."""
+        costs: dict[str, float] = {}
+        for item in (cls._get_env("PROVIDER_COSTS") or "").split(","):
+            name, _, value = item.partition("=")
+            try:
+                costs[name.strip()] = float(value)
+            except ValueError:
+                if item.strip():
+                    logger.warning("Ignoring invalid PROVIDER_COSTS entry %r", item.strip())
+        return costs
+
+    @classmethod
+    def _get_float_env(cls, name: str, default: float) -> float:
+        value = cls._get_env(name)
+        if value is None:
+            return default
+        try:
+            number = float(value)
+        except ValueError:
+            logger.warning("Ignoring non-numeric %s=%r", name, value)
+            return default
+        return max(number, 0.0)
+
+    @classmethod
+    def _get_bool_env(cls, name: str, default: bool) -> bool:
+        """A flag that is on unless set to 0, false, no or off; ``default`` when unset."""
+        value = cls._get_env(name)
+        if value is None:
+            return default
+        return value.lower() not in {"0", "false", "no", "off"}
+
+    @staticmethod
+    def _clean_message(value: Any, limit: int = MAX_CUSTOM_MESSAGE_LENGTH) -> str:
+        text = str(value or "").strip()
+        text = "".join(char for char in text if char.isprintable() or char in "\n\t")
+        if len(text) > limit:
+            logger.warning("Custom message exceeded %s characters and was truncated", limit)
+            text = text[:limit].rstrip()
+        return text
+
+    @staticmethod
+    def _safe_json(response: requests.Response) -> dict[str, Any]:
+        try:
+            data = response.json()
+        except ValueError:
+            return {}
+        return data if isinstance(data, dict) else {}
+
+    @staticmethod
+    def _atomic_write_json(path: Path, payload: Any, indent: int | None = 2) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        descriptor, temp_name = tempfile.mkstemp(prefix=f".{path.name}.", suffix=".tmp", dir=path.parent)
+        try:
+            with os.fdopen(descriptor, "w", encoding="utf-8") as file:
+                json.dump(payload, file, indent=indent, separators=None if indent else (",", ":"))
+                file.write("\n")
+            os.replace(temp_name, path)
+        except BaseException:
+            Path(temp_name).unlink(missing_ok=True)
+            raise
+
+    def _log_http_error(self, provider: str, response: requests.Response) -> None:
+        self._log_error_payload(provider, response.status_code, self._safe_json(response), response.reason)
+
+    @staticmethod
+    def _log_error_payload(provider: str, status_code: int, data: dict[str, Any], reason: str | None = None) -> None:
+        error = data.get("error") if isinstance(data.get("error"), dict) else {}
+        message = error.get("message") or data.get("message") or reason
+        trace_id = data.get("fbtrace_id") or error.get("fbtrace_id")
+        suffix = f" trace_id={trace_id}" if trace_id else ""
+        logger.error("%s request failed: HTTP %s %s%s", provider, status_code, message, suffix)
+
+    def start_deadline(self, seconds: float | None = None) -> None:
+        """Start the run budget that every HTTP request and wait shares; RUN_DEADLINE=0 disables it."""
+        budget = self._get_float_env("RUN_DEADLINE", RUN_DEADLINE) if seconds is None else seconds
+        self.deadline = time.monotonic() + budget if budget > 0 else None
+        self.deadline_exhausted_stage = None
+
+    def remaining_budget(self, stage: str) -> float:
+        """Seconds left in the run budget; raises DeadlineExceeded, naming ``stage``, when none are left."""
+        if self.deadline is None:
+            return float("inf")
+        remaining = self.deadline - time.monotonic()
+        if remaining <= 0:
+            self._deadline_exhausted(stage)
+        return remaining
+
+    def _deadline_exhausted(self, stage: str) -> None:
+        if self.deadline_exhausted_stage is None:
+            self.deadline_exhausted_stage = stage
+            self.metrics.count("deadline_exhausted")
+            logger.error("Run deadline exhausted during %s", stage)
+        raise DeadlineExceeded(stage)
+
+    def _graph_target(self, url: str) -> tuple[list[str], str | None] | None:
+        """Throttle buckets for a Graph API ``url`` and the configured page it addresses; None for other URLs."""
+        if not url.startswith(self.graph_api_url):
+            return None
+        rest = url[len(self.graph_api_url) :]
+        if rest and rest[0] not in "/?":
+            return None
+        segment = unquote(rest.lstrip("/").split("?", 1)[0].split("/", 1)[0])
+        page_id = segment if segment in self.facebook_page_ids else None
+        return (["app", f"page:{page_id}"] if page_id else ["app"]), page_id
+
+    def _graph_throttle_delay(self, keys: list[str], stage: str) -> float:
+        """Seconds to wait for a Graph API call slot; raises DeadlineExceeded if the wait outlasts the run budget."""
+        delay = self.graph_throttle.acquire(keys)
+        if delay > 0 and delay >= self.remaining_budget(stage):
+            logger.warning("%s would wait %.0fs for Graph API usage to drop; no run budget left", stage, delay)
+            self._deadline_exhausted(stage)
+        return delay
+
+    def _record_graph_wait(self, stage: str, waited: float) -> None:
+        self.metrics.count("graph_throttle_waits")
+        self.metrics.count("graph_throttle_seconds", round(waited, 3))
+        logger.info("%s waited %.1fs for Graph API usage to drop", stage, waited)
+
+    def _wait_for_graph_slot(self, keys: list[str], stage: str) -> None:
+        delay = self._graph_throttle_delay(keys, stage)
+        if delay <= 0:
+            return
+        started = time.monotonic()
+        while delay > 0:
+            time.sleep(delay)
+            delay = self._graph_throttle_delay(keys, stage)
+        self._record_graph_wait(stage, time.monotonic() - started)
+
+    def _request(
+        self,
+        method: str,
+        url: str,
+        stage: str,
+        timeout: tuple[float, float] = DEFAULT_TIMEOUT,
+        idempotent: bool = True,
+        **kwargs: Any,
+    ) -> requests.Response:
+        """Send a request within the run deadline, retrying throttling and transient failures.
+
+        Connect and read timeouts are capped at the budget left. 429 responses
+        are retried for every request; 5xx responses and connection errors
+        only for ``idempotent`` ones, so a post is never created twice. Waits
+        use jittered exponential backoff or the server's ``Retry-After``, and
+        a ``MultipartStream`` body is rewound before each retry. Graph API
+        calls wait for a ``graph_throttle`` slot and report the usage headers
+        of every response back to it.
+        """
+        retry_statuses = HTTP_RETRY_STATUSES if idempotent else frozenset({429})
+        graph_target = self._graph_target(url)
+        attempt = 0
+        while True:
+            if graph_target:
+                self._wait_for_graph_slot(graph_target[0], stage)
+            remaining = self.remaining_budget(stage)
+            if attempt and isinstance(kwargs.get("data"), MultipartStream):
+                kwargs["data"].rewind()
+            try:
+                response = self.session.request(
+                    method, url, timeout=(min(timeout[0], remaining), min(timeout[1], remaining)), **kwargs
+                )
+            except (requests.ConnectionError, requests.Timeout) as exc:
+                if self.deadline is not None and time.monotonic() >= self.deadline:
+                    self._deadline_exhausted(stage)
+                if attempt >= self.http_max_retries or not (idempotent or isinstance(exc, requests.ConnectTimeout)):
+                    raise
+                delay, reason = self._retry_delay(attempt), type(exc).__name__
+            else:
+                if graph_target:
+                    self.graph_throttle.observe(response.headers, graph_target[1])
+                if response.status_code not in retry_statuses or attempt >= self.http_max_retries:
+                    return response
+                delay = self._retry_delay(attempt, response.headers.get("Retry-After"))
+                reason = f"HTTP {response.status_code}"
+                if self.deadline is not None and time.monotonic() + delay >= self.deadline:
+                    logger.warning("%s returned %s; no run budget left to retry", stage, reason)
+                    self.deadline_exhausted_stage = self.deadline_exhausted_stage or stage
+                    return response
+                try:
+                    response.content  # drain the error body so the connection goes back to the pool
+                except requests.RequestException:
+                    pass
+                response.close()
+
+            attempt += 1
+            self.metrics.count("http_retries")
+            logger.warning(
+                "%s failed with %s; retry %s/%s in %.1fs", stage, reason, attempt, self.http_max_retries, delay
+            )
+            time.sleep(min(delay, self.remaining_budget(stage)))
+
+    @staticmethod
+    def _retry_delay(attempt: int, retry_after: str | None = None) -> float:
+        """Seconds to wait before retry ``attempt + 1``, preferring a valid ``Retry-After`` header."""
+        if retry_after:
+            try:
+                return max(float(retry_after), 0.0)
+            except ValueError:
+                pass
+            try:
+                retry_at = email.utils.parsedate_to_datetime(retry_after)
+            except (TypeError, ValueError):
+                retry_at = None
+            if retry_at is not None:
+                if retry_at.tzinfo is None:
+                    retry_at = retry_at.replace(tzinfo=timezone.utc)
+                return max((retry_at - datetime.now(timezone.utc)).total_seconds(), 0.0)
+        delay = min(HTTP_RETRY_BASE_DELAY * 2**attempt, HTTP_RETRY_MAX_DELAY)
+        return random.uniform(delay / 2, delay)
+
+    def _graph_batch(
+        self, operations: list[dict[str, Any]], access_token: str, label: str, max_workers: int = 1
+    ) -> list[tuple[int, dict[str, Any]]]:
+        """Send Graph API operations as batch requests of up to 50.
+
+        Returns one ``(status_code, body)`` pair per operation, in order. An
+        operation that Facebook did not run comes back as ``(0, {})``. With
+        ``max_workers`` above one, batch requests are sent concurrently.
+        """
+        chunks = [
+            operations[start : start + GRAPH_BATCH_LIMIT] for start in range(0, len(operations), GRAPH_BATCH_LIMIT)
+        ]
+        if max_workers > 1 and len(chunks) > 1:
+            with ThreadPoolExecutor(max_workers=min(max_workers, len(chunks)), thread_name_prefix="graph") as executor:
+                parts = executor.map(lambda chunk: self._graph_batch(chunk, access_token, label), chunks)
+                return [result for part in parts for result in part]
+
+        results: list[tuple[int, dict[str, Any]]] = []
+        for chunk in chunks:
+            with self.metrics.stage("graph_batch", operations=len(chunk)) as labels:
+                response = self._request(
+                    "POST",
+                    self.graph_api_url,
+                    label,
+                    idempotent=all(operation.get("method") == "GET" for operation in chunk),
+                    headers={"Authorization": f"Bearer {access_token}"},
+                    data={"batch": json.dumps(chunk), "include_headers": "false"},
+                )
+                labels["ok"] = response.ok
+            if not response.ok:
+                self._log_http_error(label, response)
+                results.extend([(response.status_code, {})] * len(chunk))
+                continue
+
+            try:
+                payload = response.json()
+            except ValueError:
+                payload = None
+            results.extend(self._parse_batch_results(len(chunk), payload))
+        return results
+
+    @staticmethod
+    def _parse_batch_results(count: int, payload: Any) -> list[tuple[int, dict[str, Any]]]:
+        items = payload if isinstance(payload, list) else []
+        results: list[tuple[int, dict[str, Any]]] = []
+        for index in range(count):
+            item = items[index] if index < len(items) and isinstance(items[index], dict) else {}
+            try:
+                body = json.loads(item.get("body") or "{}")
+            except (TypeError, ValueError):
+                body = {}
+            results.append((int(item.get("code") or 0), body if isinstance(body, dict) else {}))
+        return results
+
+    def setup_facebook(self) -> None:
+        """Verify that Facebook credentials can access every configured page.
+
+        All pages are checked in one Graph batch request, which also returns
+        each page's own access token when the configured token is a user
+        token that manages several pages. A successful result is cached for
+        CREDENTIAL_CACHE_TTL seconds so repeat runs skip the network call.
+        """
+        with self._facebook_lock:
+            self._facebook_checked = True
+            if not self.facebook_access_token or not self.facebook_page_ids:
+                logger.error("Facebook credentials not provided")
+                return
+
+            cache_key = CredentialCache.make_key("facebook", self.facebook_access_token, *self.facebook_page_ids)
+            if self._use_cached_pages(cache_key):
+                return
+
+            self._verify_facebook_pages(cache_key)
+
+    def _use_cached_pages(self, cache_key: str) -> bool:
+        cached = self.credential_cache.get(cache_key)
+        if not cached or not isinstance(cached.get("pages"), dict):
+            return False
+        for page_id, page in cached["pages"].items():
+            self.page_access_tokens[page_id] = page.get("access_token") or self.facebook_access_token
+            logger.info("Using cached verification for Facebook page: %s", page.get("name", "Unknown"))
+        self._facebook_ready = bool(self.page_access_tokens)
+        return True
+
+    def _page_verification_operations(self) -> list[dict[str, Any]]:
+        return [
+            {"method": "GET", "relative_url": f"{quote(page_id, safe='')}?fields=name,access_token"}
+            for page_id in self.facebook_page_ids
+        ]
+
+    def _verify_facebook_pages(self, cache_key: str) -> None:
+        try:
+            results = self._graph_batch(
+                self._page_verification_operations(), self.facebook_access_token, "Facebook setup"
+            )
+        except requests.RequestException as exc:
+            logger.error("Error setting up Facebook API: %s", exc)
+            return
+        self._apply_page_verification(cache_key, results)
+
+    def _apply_page_verification(self, cache_key: str, results: list[tuple[int, dict[str, Any]]]) -> None:
+        verified_pages: dict[str, dict[str, str]] = {}
+        for page_id, (status_code, page_info) in zip(self.facebook_page_ids, results):
+            if status_code == 200:
+                page_token = page_info.get("access_token") or self.facebook_access_token
+                self.page_access_tokens[page_id] = page_token
+                verified_pages[page_id] = {"name": str(page_info.get("name", "Unknown"))}
+                if page_token != self.facebook_access_token:
+                    verified_pages[page_id]["access_token"] = page_token
+                logger.info("Connected to Facebook page: %s", page_info.get("name", "Unknown"))
+            else:
+                self._log_error_payload(
+                    f"Facebook setup for page {page_id}", status_code, page_info, "no result in batch response"
+                )
+        self._facebook_ready = bool(self.page_access_tokens)
+        if len(verified_pages) == len(self.facebook_page_ids):
+            self.credential_cache.set(cache_key, {"pages": verified_pages})
+
+    def validate_credentials(self) -> bool:
+        """Check Facebook and OpenAI credentials, using cached results when fresh."""
+        valid = self.facebook_ready
+        if self.openai_api_key:
+            valid = self._validate_openai_key() and valid
+        return valid
+
+    def _validate_openai_key(self) -> bool:
+        cache_key = CredentialCache.make_key("openai", str(self.openai_api_key))
+        if self.credential_cache.get(cache_key):
+            logger.info("Using cached OpenAI API key validation")
+            return True
+
+        try:
+            response = self._request(
+                "GET",
+                f"{self.openai_api_base}/models",
+                "OpenAI credential validation",
+                timeout=POLL_TIMEOUT,
+                headers={"Authorization": f"Bearer {self.openai_api_key}"},
+            )
+        except requests.RequestException as exc:
+            logger.error("Error validating OpenAI API key: %s", exc)
+            return False
+        if not response.ok:
+            self._log_http_error("OpenAI credential validation", response)
+            return False
+        logger.info("OpenAI API key validated")
+        self.credential_cache.set(cache_key, {})
+        return True
+
+    def _decode_image(self, encoded_image: str | bytes | memoryview | None, provider: str) -> bytearray | None:
+        """Decode base64 image data chunk by chunk into one presized buffer."""
+        if not encoded_image:
+            logger.error("%s response did not include image data", provider)
+            return None
+
+        if len(encoded_image) % 4:
+            logger.error("%s returned invalid base64 image data: incorrect padding", provider)
+            return None
+        if len(encoded_image) // 4 * 3 - 2 > MAX_IMAGE_BYTES:
+            logger.error("%s image exceeded %s bytes", provider, MAX_IMAGE_BYTES)
+            return None
+
+        image_data = bytearray(len(encoded_image) // 4 * 3)
+        position = 0
+        try:
+            for offset in range(0, len(encoded_image), BASE64_DECODE_CHUNK):
+                decoded = binascii.a2b_base64(encoded_image[offset : offset + BASE64_DECODE_CHUNK], strict_mode=True)
+                image_data[position : position + len(decoded)] = decoded
+                position += len(decoded)
+        except (ValueError, TypeError) as exc:
+            logger.error("%s returned invalid base64 image data: %s", provider, exc)
+            return None
+        del image_data[position:]
+
+        if not self._valid_image_size(image_data, provider):
+            return None
+        return image_data
+
+    @staticmethod
+    def _read_body(response: requests.Response, limit: int) -> bytearray | None:
+        """Read a streamed response into a bytearray presized from Content-Length.
+
+        Returns None when the body is, or announces itself as, larger than ``limit``.
+        """
+        content_length = response.headers.get("Content-Length", "")
+        expected = int(content_length) if content_length.isdigit() else 0
+        if expected > limit:
+            return None
+
+        body = bytearray(expected)
+        total = 0
+        for chunk in response.iter_content(chunk_size=64 * 1024):
+            if not chunk:
+                continue
+            if total + len(chunk) > limit:
+                return None
+            # Fills the presized buffer in place and grows it only if the server under-reported.
+            body[total : total + len(chunk)] = chunk
+            total += len(chunk)
+        del body[total:]
+        return body
+
+    @staticmethod
+    def _base64_fields(body: bytearray, field: str) -> list[memoryview] | None:
+        """Return views of every ``"field": "<base64>"`` string in a raw JSON body.
+
+        This avoids materializing the JSON document and its multi-megabyte
+        strings. None means the layout was unexpected and the caller should
+        fall back to a normal JSON parse.
+        """
+        view = memoryview(body)
+        marker = f'"{field}"'.encode("ascii")
+        values = []
+        start = body.find(marker)
+        while start != -1:
+            position = start + len(marker)
+            while position < len(body) and body[position] in b" \t\r\n:":
+                position += 1
+            if position >= len(body) or body[position] != ord('"'):
+                return None
+            end = body.find(b'"', position + 1)
+            if end == -1 or body.find(b"\\", position + 1, end) != -1:
+                return None
+            values.append(view[position + 1 : end])
+            start = body.find(marker, end + 1)
+        return values
+
+    def _read_base64_images(
+        self, response: requests.Response, container: str, field: str, provider: str, count: int
+    ) -> list[str | memoryview] | None:
+        body = self._read_body(response, count * (MAX_IMAGE_BYTES * 4 // 3 + MAX_JSON_OVERHEAD_BYTES))
+        if body is None:
+            logger.error("%s response exceeded the image size limit", provider)
+            return None
+        return self._parse_base64_images(body, container, field)
+
+    def _parse_base64_images(self, body: bytearray, container: str, field: str) -> list[str | memoryview]:
+        encoded_images: list[str | memoryview] = list(self._base64_fields(body, field) or [])
+        if encoded_images:
+            return encoded_images
+
+        try:
+            result = json.loads(body)
+        except ValueError:
+            return []
+        items = result.get(container) if isinstance(result, dict) else None
+        if not isinstance(items, list):
+            return []
+        return [item[field] for item in items if isinstance(item, dict) and isinstance(item.get(field), str)]
+
+    @staticmethod
+    def _valid_image_size(image_data: bytes, provider: str) -> bool:
+        size = len(image_data)
+        if size == 0:
+            logger.error("%s returned an empty image", provider)
+            return False
+        if size > MAX_IMAGE_BYTES:
+            logger.error("%s image exceeded %s bytes", provider, MAX_IMAGE_BYTES)
+            return False
+        return True
+
+    def _decode_images(self, encoded_images: list[str | memoryview] | None, provider: str) -> list[bytes]:
+        if encoded_images is None:
+            return []
+        images = []
+        for encoded_image in encoded_images or [None]:
+            image_data = self._decode_image(encoded_image, provider)
+            if image_data:
+                images.append(image_data)
+        if images:
+            logger.info("Generated %s image(s) with %s", len(images), provider)
+        return images
+
+    def _openai_request(self, prompt: str, count: int) -> dict[str, Any]:
+        # dall-e-3 only accepts n=1; other image models take batches.
+        limit = 1 if self.openai_image_model == "dall-e-3" else OPENAI_MAX_BATCH
+        return {
+            "headers": {"Authorization": f"Bearer {self.openai_api_key}", "Content-Type": "application/json"},
+            "json": {
+                "model": self.openai_image_model,
+                "prompt": prompt,
+                "n": max(1, min(count, limit)),
+                "size": "1024x1024",
+                "quality": "standard",
+                "response_format": "b64_json",
+            },
+        }
+
+    def _stability_request(self, prompt: str, count: int) -> dict[str, Any]:
+        return {
+            "headers": {"Authorization": f"Bearer {self.stability_api_key}", "Content-Type": "application/json"},
+            "json": {
+                "text_prompts": [{"text": prompt}],
+                "cfg_scale": 7,
+                "height": 1024,
+                "width": 1024,
+                "samples": max(1, min(count, STABILITY_MAX_BATCH)),
+                "steps": 30,
+            },
+        }
+
+    def generate_image_with_openai(self, prompt: str) -> bytes | None:
+        """Generate an image using OpenAI Images API."""
+        images = self.generate_images_with_openai(prompt)
+        return images[0] if images else None
+
+    def generate_images_with_openai(self, prompt: str, count: int = 1) -> list[bytes]:
+        """Generate up to ``count`` images in one OpenAI Images API call."""
+        if not self.openai_api_key:
+            return []
+
+        try:
+            with self._request(
+                "POST",
+                f"{self.openai_api_base}/images/generations",
+                "OpenAI image generation",
+                stream=True,
+                **self._openai_request(prompt, count),
+            ) as response:
+                if not response.ok:
+                    self._log_http_error("OpenAI image generation", response)
+                    return []
+                encoded_images = self._read_base64_images(response, "data", "b64_json", "OpenAI", count)
+            return self._decode_images(encoded_images, "OpenAI")
+        except requests.RequestException as exc:
+            logger.error("Error with OpenAI image generation: %s", exc)
+            return []
+
+    def generate_image_with_stability(self, prompt: str) -> bytes | None:
+        """Generate an image using Stability AI."""
+        images = self.generate_images_with_stability(prompt)
+        return images[0] if images else None
+
+    def generate_images_with_stability(self, prompt: str, count: int = 1) -> list[bytes]:
+        """Generate up to ``count`` images in one Stability AI call."""
+        if not self.stability_api_key:
+            return []
+
+        try:
+            with self._request(
+                "POST",
+                f"{self.stability_api_base}/generation/{STABILITY_ENGINE}/text-to-image",
+                "Stability AI image generation",
+                stream=True,
+                **self._stability_request(prompt, count),
+            ) as response:
+                if not response.ok:
+                    self._log_http_error("Stability AI image generation", response)
+                    return []
+                encoded_images = self._read_base64_images(response, "artifacts", "base64", "Stability AI", count)
+            return self._decode_images(encoded_images, "Stability AI")
+        except requests.RequestException as exc:
+            logger.error("Error with Stability AI image generation: %s", exc)
+            return []
+
+    def generate_image_with_replicate(self, prompt: str) -> bytes | None:
+        """Generate an image using Replicate API."""
+        images = self.generate_images_with_replicate(prompt)
+        return images[0] if images else None
+
+    def generate_images_with_replicate(self, prompt: str, count: int = 1) -> list[bytes]:
+        """Generate up to ``count`` images with one Replicate prediction.
+
+        Predictions are created with a blocking ``Prefer: wait`` request, then
+        polled with jittered exponential backoff. When a webhook is configured
+        the local listener wakes the poller as soon as Replicate reports
+        completion. Unfinished predictions are persisted so the next run for
+        the same prompt resumes them instead of paying for a new one.
+        """
+        images = []
+        for image_url in self.generate_image_urls_with_replicate(prompt, count):
+            image_data = self._download_generated_image(image_url)
+            if image_data:
+                images.append(image_data)
+        return images
+
+    def generate_image_urls_with_replicate(self, prompt: str, count: int = 1) -> list[str]:
+        """Run one Replicate prediction and return its output URLs that pass the download checks, unfetched."""
+        if not self.replicate_api_token:
+            return []
+
+        headers = self._replicate_headers()
+        try:
+            prediction = self._resume_replicate_prediction(prompt, headers)
+            if prediction is None:
+                prediction = self._create_replicate_prediction(prompt, headers, count)
+            if prediction is None:
+                return []
+
+            prediction = self._wait_for_replicate_prediction(prompt, prediction, headers)
+            if prediction is None:
+                return []
+        except requests.RequestException as exc:
+            logger.error("Error with Replicate image generation: %s", exc)
+            return []
+        return self._prediction_image_urls(prediction)
+
+    def _prediction_image_urls(self, prediction: dict[str, Any]) -> list[str]:
+        """Output URLs of a finished prediction that pass the download checks."""
+        output = prediction.get("output")
+        image_urls = output if isinstance(output, list) and output else [None]
+        return [image_url for image_url in image_urls if self._valid_download_url(image_url)]
+
+    def _replicate_headers(self) -> dict[str, str]:
+        return {"Authorization": f"Token {self.replicate_api_token}", "Content-Type": "application/json"}
+
+    def _replicate_prediction_url(self, prediction_id: Any = None) -> str:
+        url = f"{self.replicate_api_base}/predictions"
+        if prediction_id is not None:
+            url += f"/{quote(str(prediction_id), safe='')}"
+        return url
+
+    def _create_replicate_prediction(
+        self, prompt: str, headers: dict[str, str], count: int = 1
+    ) -> dict[str, Any] | None:
+        response = self._request(
+            "POST",
+            self._replicate_prediction_url(),
+            "Replicate prediction create",
+            idempotent=False,
+            **self._replicate_create_request(prompt, headers, count),
+        )
+
+        if response.status_code not in {200, 201}:
+            self._log_http_error("Replicate prediction create", response)
+            return None
+        return self._created_prediction(self._safe_json(response))
+
+    @staticmethod
+    def _created_prediction(prediction: dict[str, Any]) -> dict[str, Any] | None:
+        if not prediction.get("id"):
+            logger.error("Replicate response did not include a prediction id")
+            return None
+        return prediction
+
+    def _replicate_create_request(self, prompt: str, headers: dict[str, str], count: int) -> dict[str, Any]:
+        payload: dict[str, Any] = {
+            "version": REPLICATE_MODEL_VERSION,
+            "input": {
+                "prompt": prompt,
+                "width": 1024,
+                "height": 1024,
+                "num_outputs": max(1, min(count, REPLICATE_MAX_BATCH)),
+                "guidance_scale": 7.5,
+                "num_inference_steps": 20,
+            },
+        }
+        request_headers = dict(headers)
+        timeout = DEFAULT_TIMEOUT
+        if self.replicate_sync_wait:
+            request_headers["Prefer"] = f"wait={self.replicate_sync_wait}"
+            timeout = (DEFAULT_TIMEOUT[0], max(DEFAULT_TIMEOUT[1], self.replicate_sync_wait + 15))
+        if self.replicate_webhook_url:
+            payload["webhook"] = self.replicate_webhook_url
+            payload["webhook_events_filter"] = ["completed"]
+        return {"timeout": timeout, "headers": request_headers, "json": payload}
+
+    def _resume_replicate_prediction(self, prompt: str, headers: dict[str, str]) -> dict[str, Any] | None:
+        pending = self._load_replicate_pending()
+        entry = pending.get(self._replicate_prompt_key(prompt))
+        if not entry:
+            return None
+
+        status_response = self._request(
+            "GET",
+            self._replicate_prediction_url(entry["id"]),
+            "Replicate prediction resume",
+            timeout=POLL_TIMEOUT,
+            headers=headers,
+        )
+        prediction = self._safe_json(status_response) if status_response.ok else {}
+        if not self._resumable_prediction(entry["id"], prediction):
+            self._forget_replicate_prediction(prompt)
+            return None
+        return prediction
+
+    @staticmethod
+    def _resumable_prediction(prediction_id: Any, prediction: dict[str, Any]) -> bool:
+        """Whether a remembered prediction, as Replicate now reports it, is worth waiting on again."""
+        if prediction.get("status") in {"failed", "canceled"} or not prediction.get("id"):
+            return False
+        logger.info("Resuming Replicate prediction %s", prediction_id)
+        return True
+
+    def _wait_for_replicate_prediction(
+        self, prompt: str, prediction: dict[str, Any], headers: dict[str, str]
+    ) -> dict[str, Any] | None:
+        prediction_id = prediction["id"]
+        webhook_event = None
+        if self.replicate_webhook_url:
+            webhook_event = self._replicate_webhook_listener().event_for(str(prediction_id))
+
+        deadline = self._replicate_wait_deadline()
+        delay = REPLICATE_POLL_INITIAL_DELAY
+        polls = 0
+        try:
+            while True:
+                settled = self._settled_prediction(prediction, polls)
+                if settled is not None:
+                    self._forget_replicate_prediction(prompt)
+                    return prediction if settled else None
+
+                self._remember_replicate_prediction(prompt, prediction_id)
+                pause = self._replicate_poll_pause(prediction_id, delay, deadline)
+                if pause is None:
+                    return None
+                if webhook_event is not None:
+                    if webhook_event.wait(pause):
+                        webhook_event.clear()
+                else:
+                    self._provider_pause(pause)
+                if self._race_decided():
+                    logger.info("Another image provider won; prediction %s kept for resume", prediction_id)
+                    return None
+                delay = min(delay * REPLICATE_POLL_BACKOFF, REPLICATE_POLL_MAX_DELAY)
+
+                with self.metrics.stage("replicate_poll", provider="Replicate") as labels:
+                    status_response = self._request(
+                        "GET",
+                        self._replicate_prediction_url(prediction_id),
+                        "Replicate prediction poll",
+                        timeout=POLL_TIMEOUT,
+                        headers=headers,
+                    )
+                    labels["ok"] = status_response.ok
+                polls += 1
+                self.metrics.count("replicate_polls")
+                if not status_response.ok:
+                    self._log_http_error("Replicate prediction status", status_response)
+                    return None
+                prediction = self._safe_json(status_response)
+        finally:
+            if webhook_event is not None:
+                self._replicate_webhook_listener().release(str(prediction_id))
+
+    def _replicate_wait_deadline(self) -> float:
+        deadline = time.monotonic() + self.replicate_max_wait
+        return deadline if self.deadline is None else min(deadline, self.deadline)
+
+    @staticmethod
+    def _settled_prediction(prediction: dict[str, Any], polls: int) -> bool | None:
+        """True once ``prediction`` succeeded, False once it failed or was canceled, None while it runs."""
+        status = prediction.get("status")
+        if status == "succeeded":
+            logger.info("Replicate prediction %s succeeded after %s polls", prediction.get("id"), polls)
+            return True
+        if status in {"failed", "canceled"}:
+            logger.error("Replicate generation ended with status: %s", status)
+            return False
+        return None
+
+    def _replicate_poll_pause(self, prediction_id: Any, delay: float, deadline: float) -> float | None:
+        """Jittered seconds to wait before the next poll, or None once ``deadline`` has passed."""
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            self.remaining_budget("Replicate prediction wait")
+            logger.error("Replicate generation timed out; prediction %s kept for resume", prediction_id)
+            return None
+        return min(random.uniform(delay / 2, delay), remaining)
+
+    @staticmethod
+    def _replicate_prompt_key(prompt: str) -> str:
+        return hashlib.sha256(f"{REPLICATE_MODEL_VERSION}\n{prompt}".encode("utf-8")).hexdigest()
+
+    def _load_replicate_pending(self) -> dict[str, dict[str, Any]]:
+        path = LOG_DIR / "replicate_predictions.json"
+        try:
+            with path.open("r", encoding="utf-8") as file:
+                loaded = json.load(file)
+        except FileNotFoundError:
+            return {}
+        except (OSError, json.JSONDecodeError) as exc:
+            logger.warning("Ignoring unreadable Replicate prediction file: %s", exc)
+            return {}
+
+        cutoff = time.time() - REPLICATE_RESUME_TTL
+        if not isinstance(loaded, dict):
+            return {}
+        return {
+            key: entry
+            for key, entry in loaded.items()
+            if isinstance(entry, dict) and entry.get("id") and float(entry.get("created", 0)) > cutoff
+        }
+
+    def _remember_replicate_prediction(self, prompt: str, prediction_id: Any) -> None:
+        pending = self._load_replicate_pending()
+        key = self._replicate_prompt_key(prompt)
+        if pending.get(key, {}).get("id") == prediction_id:
+            return
+        pending[key] = {"id": prediction_id, "created": time.time()}
+        try:
+            self._atomic_write_json(LOG_DIR / "replicate_predictions.json", pending)
+        except OSError as exc:
+            logger.warning("Could not persist Replicate prediction %s: %s", prediction_id, exc)
+
+    def _forget_replicate_prediction(self, prompt: str) -> None:
+        pending = self._load_replicate_pending()
+        if pending.pop(self._replicate_prompt_key(prompt), None) is None:
+            return
+        try:
+            self._atomic_write_json(LOG_DIR / "replicate_predictions.json", pending)
+        except OSError as exc:
+            logger.warning("Could not update Replicate prediction file: %s", exc)
+
+    def _replicate_webhook_listener(self) -> ReplicateWebhookListener:
+        with self._replicate_webhook_lock:
+            if self._replicate_webhook is None:
+                self._replicate_webhook = ReplicateWebhookListener(
+                    self.replicate_webhook_port, self.replicate_webhook_host
+                )
+            return self._replicate_webhook
+
+    def _download_generated_image(self, image_url: Any) -> bytes | None:
+        if not self._valid_download_url(image_url):
+            return None
+
+        try:
+            with (
+                self.metrics.stage("download", provider="Replicate") as labels,
+                self._request("GET", image_url, "Replicate image download", stream=True) as response,
+            ):
+                labels["ok"] = False
+                if not response.ok:
+                    self._log_http_error("Replicate image download", response)
+                    return None
+                if not self._valid_download_headers(response.headers):
+                    return None
+
+                image_data = self._read_body(response, MAX_IMAGE_BYTES)
+                if image_data is None:
+                    logger.error("Replicate image download exceeded %s bytes", MAX_IMAGE_BYTES)
+                    return None
+                labels["ok"] = True
+                self.metrics.count("download_bytes", len(image_data))
+
+            if self._valid_image_size(image_data, "Replicate"):
+                logger.info("Generated image with Replicate")
+                return image_data
+        except (requests.RequestException, ValueError) as exc:
+            logger.error("Error downloading Replicate image: %s", exc)
+        return None
+
+    def _valid_download_url(self, image_url: Any) -> bool:
+        if not isinstance(image_url, str):
+            logger.error("Replicate output did not include an image URL")
+            return False
+        parsed = urlparse(image_url)
+        if parsed.scheme not in self.allowed_download_schemes or not parsed.netloc:
+            logger.error("Rejected Replicate image URL with invalid scheme or host")
+            return False
+        return True
+
+    @staticmethod
+    def _valid_download_headers(headers: Any) -> bool:
+        content_type = headers.get("Content-Type", "")
+        if content_type and not content_type.lower().startswith("image/"):
+            logger.error("Rejected Replicate download with content type: %s", content_type)
+            return False
+        content_length = headers.get("Content-Length")
+        if content_length and int(content_length) > MAX_IMAGE_BYTES:
+            logger.error("Rejected Replicate image larger than %s bytes", MAX_IMAGE_BYTES)
+            return False
+        return True
+
+    def _check_image_url(self, image_url: str) -> bool:
+        """Whether a HEAD request shows ``image_url`` serving an image Facebook can fetch in our place."""
+        try:
+            with (
+                self.metrics.stage("url_check", provider="Replicate") as labels,
+                self._request("HEAD", image_url, "Replicate image check", allow_redirects=True) as response,
+            ):
+                labels["ok"] = False
+                if not response.ok:
+                    self._log_http_error("Replicate image check", response)
+                    return False
+                labels["ok"] = self._passthrough_headers(response.headers)
+                return labels["ok"]
+        except (requests.RequestException, ValueError) as exc:
+            logger.warning("Error checking Replicate image URL: %s", exc)
+            return False
+
+    def _passthrough_headers(self, headers: Any) -> bool:
+        """Whether a HEAD response's headers show an image Facebook can fetch within the size limit."""
+        if not headers.get("Content-Type"):
+            logger.warning("Replicate image URL did not report a content type")
+            return False
+        if not self._valid_download_headers(headers):
+            return False
+        self.metrics.count("passthrough_bytes", int(headers.get("Content-Length") or 0))
+        return True
+
+    def _archive_image_url(self, image_url: str, full_prompt: str, image_data: bytes | None = None) -> None:
+        """Keep a passed-through image like a generated one, downloading it in the background unless given."""
+
+        def archive() -> None:
+            nonlocal image_data
+            image_data = image_data or self._download_generated_image(image_url)
+            if not image_data:
+                logger.warning("Could not archive the passed-through Replicate image")
+                return
+            try:
+                if self.image_cache is not None:
+                    filename = self.image_cache.store(
+                        "Replicate", self._image_provider_model("Replicate"), full_prompt, image_data
+                    )
+                    logger.info("Archived passed-through image to cache: %s", filename)
+                else:
+                    self._save_generated_image(image_data)
+            except OSError as exc:
+                logger.error("Error archiving passed-through image: %s", exc)
+
+        with self._archive_lock:
+            if self._archive_executor is None:
+                # Not daemon threads: the interpreter finishes pending archives before it exits.
+                self._archive_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="archive")
+            self._archive_executor.submit(archive)
+
+    def _configured_image_providers(self) -> list[tuple[str, ImageGenerator]]:
+        providers: list[tuple[str, ImageGenerator]] = []
+        if self.openai_api_key:
+            providers.append(("OpenAI", self.generate_images_with_openai))
+        if self.stability_api_key:
+            providers.append(("Stability AI", self.generate_images_with_stability))
+        if self.replicate_api_token:
+            providers.append(("Replicate", self.generate_images_with_replicate))
+        return providers
+
+    def _image_provider_model(self, provider: str) -> str:
+        return {
+            "OpenAI": self.openai_image_model,
+            "Stability AI": STABILITY_ENGINE,
+            "Replicate": REPLICATE_MODEL_VERSION,
+        }.get(provider, "")
+
+    def generate_image_data(self, prompt: str) -> bytes | None:
+        """Generate one image's bytes using the configured IMAGE_PROVIDER_MODE."""
+        images = self.generate_images(prompt)
+        return images[0] if images else None
+
+    def generate_images(self, prompt: str, count: int = 1) -> list[bytes]:
+        """Generate up to ``count`` images using the configured IMAGE_PROVIDER_MODE.
+
+        ``serial`` tries providers one after another, ``race`` starts every
+        provider at once, and ``hedged`` starts the next provider after
+        IMAGE_HEDGE_DELAY seconds or as soon as the in-flight ones fail.
+        """
+        images, _ = self._generate_images(prompt, count)
+        return images
+
+    def _generate_images(
+        self, prompt: str, count: int, image_urls: list[str] | None = None
+    ) -> tuple[list[bytes], dict[str, Any]]:
+        """Generate images and return them with this call's provider report.
+
+        With ``image_urls``, Replicate runs as the passthrough provider of
+        ``_generate_passthrough_with_replicate`` and leaves its URL there.
+        """
+        # Each call keeps its own report, since scheduled posts are prepared in several threads at once.
+        report: dict[str, Any] = {"mode": self.image_provider_mode, "winner": None, "attempts": []}
+        providers = self._with_passthrough(
+            self._configured_image_providers(), self._generate_passthrough_with_replicate, image_urls
+        )
+        providers = self._route_image_providers(providers, report)
+        if not providers:
+            return [], report
+
+        hedge_delay = self._hedge_delay(providers)
+        if hedge_delay is None:
+            images = self._generate_image_serial(prompt, providers, count, report)
+        else:
+            images = self._generate_image_hedged(prompt, providers, hedge_delay, count, report)
+
+        original_bytes = sum(len(image) for image in images)
+        images = [self.optimize_image(image) for image in images]
+        self._finish_image_report(report, original_bytes, images)
+        return images, report
+
+    @staticmethod
+    def _with_passthrough(
+        providers: list[tuple[str, Any]], passthrough: Callable[..., Any], image_urls: list[str] | None
+    ) -> list[tuple[str, Any]]:
+        """``providers`` with Replicate swapped for ``passthrough`` filling ``image_urls``; unchanged without them."""
+        if image_urls is None:
+            return providers
+        return [
+            (name, functools.partial(passthrough, image_urls=image_urls)) if name == "Replicate" else (name, generate)
+            for name, generate in providers
+        ]
+
+    def _route_image_providers(self, providers: list[tuple[str, Any]], report: dict[str, Any]) -> list[tuple[str, Any]]:
+        """Order ``providers`` for one generation and note the order in its report.
+
+        With no provider configured the empty report is published straight away.
+        """
+        if not providers:
+            self._publish_image_report(report)
+            return []
+        providers = self.provider_router.order(providers)
+        report["order"] = [name for name, _ in providers]
+        return providers
+
+    def _hedge_delay(self, providers: list[tuple[str, Any]]) -> float | None:
+        """Seconds between hedged provider launches; None when providers are tried one after another."""
+        if self.image_provider_mode == "serial" or len(providers) == 1:
+            return None
+        return 0.0 if self.image_provider_mode == "race" else self.image_hedge_delay
+
+    def _finish_image_report(self, report: dict[str, Any], original_bytes: int, images: list[bytes]) -> None:
+        final_bytes = sum(len(image) for image in images)
+        report.update(original_bytes=original_bytes, final_bytes=final_bytes, bytes_saved=original_bytes - final_bytes)
+        self.metrics.count("image_bytes_original", original_bytes)
+        self.metrics.count("image_bytes_final", final_bytes)
+        self._publish_image_report(report)
+
+    def _publish_image_report(self, report: dict[str, Any]) -> None:
+        """Expose a finished generation's report to the run report; the copy is never mutated afterwards."""
+        self.last_image_report = {**report, "attempts": list(report["attempts"])}
+
+    def optimize_image(self, image_data: bytes) -> bytes:
+        """Re-encode an image to IMAGE_OUTPUT_FORMAT within IMAGE_MAX_DIMENSION.
+
+        The original bytes are kept when Pillow is not installed, the output
+        format is ``original``, the data cannot be decoded, or re-encoding
+        would not make the image smaller.
+        """
+        source_format = sniff_image_format(image_data)
+        Image = load_pillow()
+        if Image is None or self.image_output_format == "original" or source_format is None:
+            return image_data
+
+        try:
+            with Image.open(io.BytesIO(image_data)) as image:
+                resized = max(image.size) > self.image_max_dimension
+                if resized:
+                    image.thumbnail((self.image_max_dimension, self.image_max_dimension), Image.LANCZOS)
+                if self.image_output_format == "jpeg" and image.mode not in {"RGB", "L"}:
+                    image = image.convert("RGB")
+                output = io.BytesIO()
+                image.save(output, format=self.image_output_format.upper(), quality=self.image_quality, optimize=True)
+        except (OSError, ValueError, Image.DecompressionBombError) as exc:
+            logger.warning("Could not recompress %s image: %s", source_format, exc)
+            return image_data
+
+        optimized = output.getvalue()
+        if len(optimized) >= len(image_data) and not resized:
+            return image_data
+        logger.info(
+            "Recompressed %s image to %s: %s -> %s bytes (saved %s)",
+            source_format.upper(),
+            self.image_output_format.upper(),
+            len(image_data),
+            len(optimized),
+            len(image_data) - len(optimized),
+        )
+        return optimized
+
+    def _record_image_attempt(self, provider: str, duration: float, status: str, report: dict[str, Any]) -> None:
+        report["attempts"].append({"provider": provider, "duration": round(duration, 3), "status": status})
+        self.metrics.record("provider_attempt", duration, provider=provider, status=status, ok=status != "failed")
+        if status in {"won", "failed"}:
+            self.provider_router.record(provider, status == "won", duration)
+
+    def _generate_image_serial(
+        self, prompt: str, providers: list[tuple[str, ImageGenerator]], count: int, report: dict[str, Any]
+    ) -> list[bytes]:
+        for name, generate in providers:
+            started = time.monotonic()
+            images = generate(prompt, count)
+            if self._settle_serial_attempt(name, time.monotonic() - started, images, report):
+                return images
+        return []
+
+    def _settle_serial_attempt(self, name: str, duration: float, images: list[bytes], report: dict[str, Any]) -> bool:
+        """Record one serial provider attempt; True when it produced the images."""
+        if not images:
+            self._record_image_attempt(name, duration, "failed", report)
+            return False
+        self._record_image_attempt(name, duration, "won", report)
+        report["winner"] = name
+        logger.info(
+            "Image provider %s succeeded in %.2fs",
+            name,
+            duration,
+            extra={"provider": name, "duration": round(duration, 3)},
+        )
+        return True
+
+    def _generate_image_hedged(
+        self,
+        prompt: str,
+        providers: list[tuple[str, ImageGenerator]],
+        hedge_delay: float,
+        count: int,
+        report: dict[str, Any],
+    ) -> list[bytes]:
+        results: queue.Queue[tuple[str, list[bytes], float]] = queue.Queue()
+        started_at: dict[str, float] = {}
+        decided = threading.Event()
+
+        def run(name: str, generate: ImageGenerator) -> None:
+            self._provider_race.decided = decided
+            try:
+                images = generate(prompt, count)
+            except Exception:  # a crashed provider must not hang the race
+                logger.exception("%s image generation crashed", name)
+                images = []
+            results.put((name, images, time.monotonic() - started_at[name]))
+
+        next_index = 0
+        in_flight = 0
+        next_launch = time.monotonic()
+        images: list[bytes] = []
+        winner = None
+
+        while winner is None and (next_index < len(providers) or in_flight):
+            now = time.monotonic()
+            if next_index < len(providers) and (in_flight == 0 or now >= next_launch):
+                name, generate = providers[next_index]
+                next_index += 1
+                in_flight += 1
+                started_at[name] = now
+                next_launch = now + hedge_delay
+                logger.info("Starting image provider %s", name)
+                # Daemon threads so abandoned losers never delay interpreter exit.
+                threading.Thread(target=run, args=(name, generate), name=f"image-{name}", daemon=True).start()
+                continue
+
+            wait_for = max(next_launch - now, 0.0) if next_index < len(providers) else None
+            try:
+                name, result, duration = results.get(timeout=wait_for)
+            except queue.Empty:
+                continue
+            in_flight -= 1
+            if result:
+                winner, images = name, result
+                self._record_image_attempt(name, duration, "won", report)
+            else:
+                self._record_image_attempt(name, duration, "failed", report)
+                next_launch = time.monotonic()
+
+        # Losers still polling stop at their next pause instead of running to their own timeout.
+        decided.set()
+        report["winner"] = winner
+        self._finish_image_race(started_at, report)
+        return images
+
+    def _finish_image_race(self, started_at: dict[str, float], report: dict[str, Any]) -> None:
+        """Record every started provider without an outcome as abandoned, then log the race."""
+        finished = time.monotonic()
+        for name, started in started_at.items():
+            if not any(attempt["provider"] == name for attempt in report["attempts"]):
+                self._record_image_attempt(name, finished - started, "abandoned", report)
+        self._log_image_race(report)
+
+    def _race_decided(self) -> bool:
+        """Whether the hedged race this thread's provider runs in already has a winner."""
+        decided = getattr(self._provider_race, "decided", None)
+        return decided is not None and decided.is_set()
+
+    def _provider_pause(self, seconds: float) -> None:
+        """Sleep between provider polls, waking early once the thread's hedged race is decided."""
+        decided = getattr(self._provider_race, "decided", None)
+        if decided is None:
+            time.sleep(seconds)
+        else:
+            decided.wait(seconds)
+
+    def _log_image_race(self, report: dict[str, Any]) -> None:
+        winner = report["winner"]
+        timings = ", ".join(
+            f"{attempt['provider']}={attempt['duration']:.2f}s ({attempt['status']})" for attempt in report["attempts"]
+        )
+        if winner:
+            winner_duration = next(
+                (attempt["duration"] for attempt in report["attempts"] if attempt["provider"] == winner), None
+            )
+            logger.info(
+                "Image provider %s won the %s race: %s",
+                winner,
+                report["mode"],
+                timings,
+                extra={"provider": winner, "duration": winner_duration},
+            )
+        else:
+            logger.warning("All image providers failed: %s", timings)
+
+    def generate_sandwich_image(self, post_content: dict[str, Any] | None = None) -> Path | None:
+        """Generate a sandwich image using the configured provider mode and save it to disk."""
+        image_data, image_path = self.generate_sandwich_image_data(post_content)
+        if image_path is None and image_data:
+            image_path = self._save_generated_image(image_data)
+        return image_path
+
+    def _save_generated_image(self, image_data: bytes) -> Path:
+        timestamp = datetime.now(timezone.utc).strftime("%Y%m%d_%H%M%S")
+        extension = image_extension(image_data)
+        GENERATED_IMAGE_DIR.mkdir(parents=True, exist_ok=True)
+        filename = GENERATED_IMAGE_DIR / f"sandwich_{timestamp}_{random.randrange(1000):03d}{extension}"
+        with self.metrics.stage("disk_write"):
+            filename.write_bytes(image_data)
+        self.metrics.count("disk_write_bytes", len(image_data))
+        logger.info("Saved generated image: %s", filename)
+        return filename
+
+    def generate_sandwich_image_data(
+        self, post_content: dict[str, Any] | None = None
+    ) -> tuple[bytes | None, Path | None]:
+        """Return a sandwich image as in-memory bytes, a path on disk, or both.
+
+        Pooled and cached images come back as a path only. Freshly generated
+        images are returned in memory so they can be uploaded without a disk
+        round-trip; they are also written to disk unless SAVE_GENERATED_IMAGES
+        is off. With IMAGE_URL_PASSTHROUGH a Replicate image comes back as
+        neither: its URL is stored in ``post_content["image_url"]`` for
+        Facebook to fetch.
+        """
+        image_style, full_prompt = self._image_prompt(post_content)
+        reused = self._reused_image(image_style, full_prompt)
+        if reused is not None:
+            return reused
+
+        passthrough = self.image_url_passthrough and post_content is not None
+        for _ in range(self.image_dedup_retries + 1):
+            image_urls: list[str] | None = [] if passthrough else None
+            images, report = self._generate_images(full_prompt, self.image_batch_size, image_urls)
+            settled = self._settle_generated_images(post_content, image_style, full_prompt, images, report, image_urls)
+            if settled is not None:
+                return settled
+        logger.warning("Every regenerated image was a near-duplicate; posting without an image")
+        return None, None
+
+    def _reused_image(self, image_style: str, full_prompt: str) -> tuple[bytes | None, Path | None] | None:
+        """The result for a pooled or cached image; None when a new image must be generated."""
+        reused_path = self._reusable_image(image_style, full_prompt)
+        if reused_path is None:
+            return None
+        if not self._duplicate_image(reused_path):
+            return None, reused_path
+        return (None, None) if self.image_dedup == "skip" else None
+
+    def _settle_generated_images(
+        self,
+        post_content: dict[str, Any] | None,
+        image_style: str,
+        full_prompt: str,
+        images: list[bytes],
+        report: dict[str, Any],
+        image_urls: list[str] | None,
+    ) -> tuple[bytes | None, Path | None] | None:
+        """The result for one generation; None to regenerate after near-duplicates."""
+        distinct = self._distinct_images(images)
+        if distinct and image_urls and post_content is not None and report["winner"] == "Replicate":
+            return self._pass_image_url(post_content, image_urls[0], full_prompt, distinct[0])
+        if distinct or not images:
+            return self._keep_generated_images(image_style, full_prompt, distinct, report["winner"])
+        return (None, None) if self.image_dedup == "skip" else None
+
+    def _duplicate_image(self, source: bytes | bytearray | Path) -> bool:
+        """Whether ``source`` is within IMAGE_DEDUP_DISTANCE of an image from the last IMAGE_DEDUP_WINDOW_DAYS.
+
+        An image that passes is recorded in the hash index straight away, so
+        posts prepared concurrently are checked against each other too.
+        """
+        if self.image_dedup == "off":
+            return False
+        if load_pillow() is None:
+            logger.info("Pillow is not installed; near-duplicate image checks are off")
+            self.image_dedup = "off"
+            return False
+        with self.metrics.stage("image_dedup"):
+            match = self.image_hashes.claim_image(source, self.image_dedup_distance)
+        if match is None:
+            return False
+        self.metrics.count("image_duplicates")
+        logger.warning(
+            "Image is %s bit(s) from recent image %s; %s",
+            match[0],
+            match[1],
+            "skipping it" if self.image_dedup == "skip" else "regenerating",
+        )
+        return True
+
+    def _distinct_images(self, images: list[bytes]) -> list[bytes]:
+        """``images`` from the first one that is not a near-duplicate; the rest are checked when taken from the pool."""
+        for index, image_data in enumerate(images):
+            if not self._duplicate_image(image_data):
+                return images[index:]
+        return []
+
+    def _pass_image_url(
+        self, post_content: dict[str, Any], image_url: str, full_prompt: str, image_data: bytes
+    ) -> tuple[None, None]:
+        """Hand a checked Replicate URL to the post instead of an image; ``image_data`` may be the placeholder."""
+        logger.info("Passing the Replicate image URL through to Facebook")
+        self.metrics.count("passthrough_images")
+        post_content["image_url"] = image_url
+        if self.image_url_archive:
+            self._archive_image_url(image_url, full_prompt, image_data or None)
+        return None, None
+
+    def _generate_passthrough_with_replicate(self, prompt: str, count: int, image_urls: list[str]) -> list[bytes]:
+        """Replicate as an image provider whose output URL Facebook fetches itself.
+
+        A URL that passes the HEAD check is appended to ``image_urls``. It is
+        downloaded only when IMAGE_DEDUP needs the bytes to compare; otherwise
+        an empty placeholder stands in for the image. A URL that fails the
+        check is downloaded and used like any generated image.
+        """
+        urls = self.generate_image_urls_with_replicate(prompt, 1)
+        if not urls:
+            return []
+        if self._check_image_url(urls[0]):
+            image_data = b"" if self.image_dedup == "off" else self._download_generated_image(urls[0])
+            if image_data is not None:
+                image_urls.append(urls[0])
+        else:
+            image_data = self._download_generated_image(urls[0])
+        return [] if image_data is None else [image_data]
+
+    def _image_prompt(self, post_content: dict[str, Any] | None) -> tuple[Any, str]:
+        image_style = post_content.get("image_style") if post_content else None
+        base_prompt = self.image_style_prompts.get(str(image_style), random.choice(self.image_prompts))
+        return image_style, base_prompt + random.choice(self.style_additions)
+
+    def _reusable_image(self, image_style: Any, full_prompt: str) -> Path | None:
+        """A pooled image for ``image_style`` or a cached image for ``full_prompt``, if either exists."""
+        if image_style in self.image_style_prompts:
+            pooled_path = self.image_pool.take(str(image_style))
+            if pooled_path is not None:
+                logger.info("Using pre-generated %s image: %s", image_style, pooled_path)
+                return pooled_path
+
+        logger.info("Generating image with prompt: %s...", full_prompt[:100])
+
+        if self.image_cache is not None:
+            keys = [
+                ImageCache.make_key(name, self._image_provider_model(name), full_prompt)
+                for name, _ in self._configured_image_providers()
+            ]
+            cached_path = self.image_cache.lookup(keys)
+            if cached_path is not None:
+                logger.info("Using cached image: %s", cached_path)
+                return cached_path
+        return None
+
+    def _keep_generated_images(
+        self, image_style: Any, full_prompt: str, images: list[bytes], winner: str | None
+    ) -> tuple[bytes | None, Path | None]:
+        """Pool the extra images of a batch and save the first, as the cache or SAVE_GENERATED_IMAGES say."""
+        if not images:
+            logger.warning("Failed to generate image with any configured service")
+            return None, None
+
+        image_data = images[0]
+        if len(images) > 1 and image_style in self.image_style_prompts and winner:
+            pooled = self.image_pool.add(
+                str(image_style), images[1:], winner, self._image_provider_model(winner), full_prompt
+            )
+            logger.info("Pooled %s extra %s image(s)", pooled, image_style)
+
+        if not self.save_generated_images:
+            return image_data, None
+        if self.image_cache is not None and winner:
+            with self.metrics.stage("disk_write", cache=True):
+                filename = self.image_cache.store(winner, self._image_provider_model(winner), full_prompt, image_data)
+            self.metrics.count("disk_write_bytes", len(image_data))
+            logger.info("Saved generated image to cache: %s", filename)
+            return image_data, filename
+        return image_data, self._save_generated_image(image_data)
+
+    def refill_image_pool(self, per_style: int) -> dict[str, int]:
+        """Top up the image pool to ``per_style`` images for every image style."""
+        added: dict[str, int] = {}
+        for style, base_prompt in self.image_style_prompts.items():
+            added[style] = 0
+            while self.image_pool.size(style) < per_style:
+                needed = per_style - self.image_pool.size(style)
+                full_prompt = base_prompt + random.choice(self.style_additions)
+                images, report = self._generate_images(full_prompt, needed)
+                winner = report["winner"]
+                if not images or not winner:
+                    logger.warning("Stopped refilling %s pool after a failed generation", style)
+                    break
+                added[style] += self.image_pool.add(
+                    style, images[:needed], winner, self._image_provider_model(winner), full_prompt
+                )
+            logger.info("Image pool for %s has %s image(s)", style, self.image_pool.size(style))
+        return added
+
+    def format_caption(self, post_content: dict[str, Any]) -> str:
+        custom_message = self._clean_message(os.getenv("CUSTOM_MESSAGE"))
+        if custom_message:
+            return custom_message
+        return self._clean_message(post_content.get("text"))
+
+    def post_to_facebook_with_image(
+        self,
+        post_content: dict[str, Any],
+        image_path: Path | None = None,
+        image_data: bytes | None = None,
+        page_id: str | None = None,
+        publish_at: datetime | None = None,
+    ) -> str | bool:
+        """Post content to a Facebook page with an optional image.
+
+        ``image_data`` is streamed straight from memory; otherwise the file at
+        ``image_path`` is streamed from disk. Without either, an ``image_url``
+        in ``post_content`` is sent for Facebook to fetch, falling back to
+        downloading and uploading the image if Facebook rejects the URL.
+        ``page_id`` defaults to the first configured page. With
+        ``publish_at`` the post is uploaded unpublished and Facebook
+        publishes it at that time.
+        """
+        page_id = page_id or self.facebook_page_id
+        # facebook_ready verifies the credentials on first use, which fills in the page tokens.
+        ready = self.facebook_ready
+        access_token = self.page_access_tokens.get(str(page_id))
+        if not ready or not access_token:
+            logger.error("Facebook API not available for page %s", page_id)
+            return False
+
+        fields = self._post_fields(post_content, publish_at)
+        if fields is None:
+            return False
+        image_url = self._passthrough_url(post_content, image_path, image_data)
+        try:
+            if image_url:
+                post_id = self._send_post(page_id, access_token, fields, image_url=image_url)
+                if post_id is not None:
+                    return post_id
+                logger.warning("Facebook did not accept the image URL; uploading the image instead")
+                image_data = self._download_generated_image(image_url)
+                if not image_data:
+                    logger.warning("Could not download the image either; posting without it")
+            return self._send_post(page_id, access_token, fields, image_path, image_data) or False
+        except requests.RequestException as exc:
+            logger.error("Error posting to Facebook: %s", exc)
+            return False
+
+    def _post_fields(self, post_content: dict[str, Any], publish_at: datetime | None) -> dict[str, str] | None:
+        """Form fields of a page post: the caption, and the schedule with ``publish_at``; None without a caption."""
+        full_message = self.format_caption(post_content)
+        if not full_message:
+            logger.error("Refusing to post an empty Facebook message")
+            return None
+        fields = {"message": full_message}
+        if publish_at is not None:
+            fields.update(published="false", scheduled_publish_time=str(int(publish_at.timestamp())))
+        return fields
 
-        self.facebook_access_token = self._get_env("FACEBOOK_ACCESS_TOKEN")
-        self.facebook_page_id = self._get_env("FACEBOOK_PAGE_ID")
-        self.facebook_ready = False
+    @staticmethod
+    def _passthrough_url(post_content: dict[str, Any], image_path: Path | None, image_data: bytes | None) -> str | None:
+        """The ``image_url`` Facebook should fetch, when the post has no image of its own to upload."""
+        if image_data or (image_path and image_path.is_file()):
+            return None
+        image_url = post_content.get("image_url")
+        return str(image_url) if image_url else None
 
-        self.openai_api_key = self._get_env("OPENAI_API_KEY")
-        self.stability_api_key = self._get_env("STABILITY_API_KEY")
-        self.replicate_api_token = self._get_env("REPLICATE_API_TOKEN")
-        self.openai_image_model = self._get_env("OPENAI_IMAGE_MODEL") or "dall-e-3"
+    def _post_request(
+        self,
+        stack: ExitStack,
+        page_id: str | None,
+        access_token: str,
+        fields: dict[str, str],
+        image_path: Path | None = None,
+        image_data: bytes | None = None,
+        image_url: str | None = None,
+    ) -> tuple[str, str, dict[str, Any]]:
+        """URL, stage name and request arguments of a photo URL, photo upload or feed post.
 
-        self.image_prompts = [
-            "A perfectly crafted turkey and provolone sandwich on fresh sourdough bread, professional food photography, appetizing lighting, restaurant quality",
-            "Close-up of a gourmet turkey and provolone sandwich with crisp lettuce and tomato, artisanal bread, food photography style",
-            "A delicious turkey and provolone panini with golden crispy bread, melted cheese visible, professional food styling",
-            "Fresh turkey and provolone sandwich on ciabatta bread with avocado, natural lighting, food magazine quality photo",
-            "A mouth-watering turkey and provolone club sandwich with multiple layers, professional food photography",
-            "Grilled turkey and provolone sandwich cut in half showing the layers, steam rising, warm lighting",
-            "Turkey and provolone sandwich on a rustic wooden board with herbs, artisanal presentation, food blog style",
-            "A hearty turkey and provolone sandwich on whole grain bread, fresh vegetables, clean food photography",
-            "Gourmet turkey and provolone sandwich with herb aioli, professional kitchen background, chef's presentation",
-            "A classic turkey and provolone sandwich on fresh white bread, simple and appetizing, deli-style photography",
-        ]
+        Both bots build their posts here, so only the transport that sends
+        them differs. A photo streamed from disk stays open until ``stack``
+        closes.
+        """
+        page_url = f"{self.graph_api_url}/{quote(str(page_id), safe='')}"
+        headers = {"Authorization": f"Bearer {access_token}"}
+        if image_url:
+            request: dict[str, Any] = {"headers": headers, "data": {**fields, "url": image_url}}
+            return f"{page_url}/photos", "Facebook photo URL post", request
+        if image_data or (image_path and image_path.is_file()):
+            body = self._photo_body(stack, fields, image_path, image_data)
+            request = {"headers": {**headers, "Content-Type": body.content_type}, "data": body}
+            return f"{page_url}/photos", "Facebook photo upload", request
+        return f"{page_url}/feed", "Facebook feed post", {"headers": headers, "data": fields}
 
-        self.style_additions = [
-            ", 4K high resolution, professional food photography",
-            ", warm natural lighting, shallow depth of field",
-            ", commercial food photography, appetizing presentation",
-            ", rustic wooden background, artisanal style",
-            ", clean white background, minimalist food photography",
-            ", cozy cafe atmosphere, warm lighting",
-            ", vintage food photography style, film grain",
-            ", modern food styling, geometric plating",
-        ]
+    @staticmethod
+    def _upload_labels(url: str, image_url: str | None) -> dict[str, bool]:
+        """Metric labels of a post sent to ``url``: whether it carries an image, and whether that is a URL."""
+        return {"image": url.endswith("/photos"), **({"url": True} if image_url else {})}
 
-        self.caption_templates = [
-            "Chat, this turkey and provolone on {bread} is actually elite. {condiment} pullin up with S-tier aura. #NoCap #SandwichTok",
-            "Lowkey this {bread} turkey-provolone stack got main character energy. Add {addon} and suddenly it's a certified W.",
-            "POV: the {condiment} hit, the provolone melted, and the turkey sandwich started acting famous. Big lunch aura.",
-            "This turkey and provolone with {addon} is bussin respectfully. Zero crumbs, maximum rizz.",
-            "Not to glaze, but this {bread} situation is giving legendary. Turkey, provolone, {condiment}. Say less.",
-            "The lunch meta just shifted: turkey, provolone, {addon}, {condiment}. This build is cracked.",
-            "Be so for real, this turkey-provolone combo clears. {bread} plus {addon} equals instant aura farming.",
-            "Skibidi sandwich check: turkey stacked, provolone locked in, {condiment} carrying the squad.",
-            "This is not a regular sandwich, this is a side quest reward. {bread}, turkey, provolone, {addon}. W eats.",
-            "Turkey and provolone woke up and chose rizz. {condiment} on {bread} is the final boss of lunch.",
-        ]
+    def _send_post(
+        self,
+        page_id: str | None,
+        access_token: str,
+        fields: dict[str, str],
+        image_path: Path | None = None,
+        image_data: bytes | None = None,
+        image_url: str | None = None,
+    ) -> str | bool | None:
+        """Send one page post; None when Facebook rejects it.
 
-        self.image_style_prompts = {
-            "grilled_panini": "A perfectly grilled turkey and provolone panini sandwich, golden crispy bread with grill marks, melted cheese oozing out",
-            "gourmet_close_up": "Extreme close-up of a gourmet turkey and provolone sandwich, focusing on the layers and textures",
-            "classic_deli": "A classic deli-style turkey and provolone sandwich on fresh bread, traditional presentation",
-            "gourmet_weekend": "Fresh turkey and provolone sandwich on ciabatta bread with avocado and olive oil, natural light",
-            "classic_full": "A turkey and provolone sandwich with lettuce and tomato, neatly cut and plated",
-        }
+        A success response without a post id returns False rather than None,
+        since Facebook may already have created the post and a fallback
+        upload could post it twice. Transport errors are raised.
+        """
+        with ExitStack() as stack:
+            url, stage, request = self._post_request(
+                stack, page_id, access_token, fields, image_path, image_data, image_url
+            )
+            kind = self._upload_labels(url, image_url)
+            with self.metrics.stage("facebook_upload", page_id=page_id, **kind) as labels:
+                response = self._request("POST", url, stage, idempotent=False, **request)
+                labels["ok"] = response.ok
+            if isinstance(request["data"], MultipartStream):
+                self.metrics.count("upload_bytes", len(request["data"]))
+        if not response.ok:
+            self._log_http_error(stage, response)
+            return None
+        return self._post_result(page_id, self._safe_json(response), fields["message"], image_path, image_data)
 
-        self.sandwich_shops = [
-            {
-                "name": "Tony's Deli",
-                "location": "Downtown",
-                "specialty": "Classic turkey and provolone on fresh Italian bread",
-                "added_by": "admin",
-                "date_added": "2025-01-01",
-                "status": "verified",
-            },
+    @staticmethod
+    def _photo_body(
+        stack: ExitStack, fields: dict[str, str], image_path: Path | None, image_data: bytes | None
+    ) -> MultipartStream:
+        """Multipart body for a photo post, reading ``image_data`` or streaming the file at ``image_path``."""
+        if image_data:
+            source: bytes | BinaryIO = image_data
+            image_format = sniff_image_format(image_data)
+        else:
+            source = stack.enter_context(image_path.open("rb"))
+            image_format = sniff_image_format(source.read(16))
+            source.seek(0)
+        mime_type, extension = IMAGE_FORMATS.get(image_format or "jpeg", IMAGE_FORMATS["jpeg"])
+        return MultipartStream(fields, "source", f"sandwich{extension}", mime_type, source)
+
+    def _post_result(
+        self,
+        page_id: str | None,
+        response_data: dict[str, Any],
+        full_message: str,
+        image_path: Path | None,
+        image_data: bytes | None,
+    ) -> str | bool:
+        post_id = response_data.get("post_id") or response_data.get("id")
+        if not post_id:
+            logger.error("Facebook success response did not include a post id")
+            return False
+        logger.info("Posted to Facebook page %s: %s", page_id, post_id, extra={"post_id": post_id, "page_id": page_id})
+        logger.info("Content: %s...", full_message[:60])
+        if image_path or image_data:
+            logger.info("With image: %s", image_path or f"{len(image_data)} bytes from memory")
+        self.log_activity(f"POST CREATED: {post_id} - {full_message[:50]}...", post_id=post_id, page_id=page_id)
+        return str(post_id)
+
+    def post_to_pages(
+        self,
+        post_content: dict[str, Any],
+        image_path: Path | None = None,
+        image_data: bytes | None = None,
+    ) -> dict[str, str | bool]:
+        """Publish one post to every configured page and return the result per page.
+
+        Photo posts are uploaded concurrently, bounded by PAGE_CONCURRENCY.
+        Text-only posts are sent as Graph batch requests. A failing page never
+        blocks the others.
+        """
+        results: dict[str, str | bool] = {page_id: False for page_id in self.facebook_page_ids}
+        if not self.facebook_ready:
+            logger.error("Facebook API not available")
+            return results
+        pages = [page_id for page_id in self.facebook_page_ids if page_id in self.page_access_tokens]
+        has_image = bool(image_data or post_content.get("image_url")) or bool(image_path and image_path.is_file())
+
+        if len(pages) == 1:
+            results[pages[0]] = self.post_to_facebook_with_image(post_content, image_path, image_data, pages[0])
+        elif pages and not has_image:
+            results.update(self._post_feed_batch(post_content, pages))
+        elif pages:
+            workers = min(self.page_concurrency, len(pages))
+            with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="page") as executor:
+                futures = {
+                    page_id: executor.submit(
+                        self.post_to_facebook_with_image, post_content, image_path, image_data, page_id
+                    )
+                    for page_id in pages
+                }
+                for page_id, future in futures.items():
+                    try:
+                        results[page_id] = future.result()
+                    except Exception:  # one broken page must not hide the others' results
+                        logger.exception("Unexpected error posting to page %s", page_id)
+        return results
+
+    def _post_feed_batch(self, post_content: dict[str, Any], pages: list[str]) -> dict[str, str | bool]:
+        full_message = self.format_caption(post_content)
+        if not full_message:
+            logger.error("Refusing to post an empty Facebook message")
+            return {page_id: False for page_id in pages}
+
+        try:
+            responses = self._graph_batch(
+                self._feed_batch_operations(full_message, pages),
+                str(self.facebook_access_token),
+                "Facebook batch post",
+            )
+        except requests.RequestException as exc:
+            logger.error("Error posting to Facebook: %s", exc)
+            return {page_id: False for page_id in pages}
+        return self._feed_batch_results(full_message, pages, responses)
+
+    def _feed_batch_operations(self, full_message: str, pages: list[str]) -> list[dict[str, Any]]:
+        return [
             {
-                "name": "Corner Bistro",
-                "location": "Main Street",
-                "specialty": "Gourmet turkey with aged provolone and herb aioli",
-                "added_by": "admin",
-                "date_added": "2025-01-01",
-                "status": "verified",
-            },
+                "method": "POST",
+                "relative_url": f"{quote(page_id, safe='')}/feed",
+                "body": urlencode({"message": full_message, "access_token": self.page_access_tokens[page_id]}),
+            }
+            for page_id in pages
         ]
 
-        self.bread_types = [
-            "sourdough",
-            "ciabatta",
-            "whole wheat",
-            "rye",
-            "focaccia",
-            "kaiser roll",
-            "everything bagel",
-            "french bread",
-            "pumpernickel",
-        ]
+    def _feed_batch_results(
+        self, full_message: str, pages: list[str], responses: list[tuple[int, dict[str, Any]]]
+    ) -> dict[str, str | bool]:
+        results: dict[str, str | bool] = {}
+        for page_id, (status_code, response_data) in zip(pages, responses):
+            post_id = response_data.get("post_id") or response_data.get("id")
+            if status_code == 200 and post_id:
+                logger.info(
+                    "Posted to Facebook page %s: %s", page_id, post_id, extra={"post_id": post_id, "page_id": page_id}
+                )
+                self.log_activity(f"POST CREATED: {post_id} - {full_message[:50]}...", post_id=post_id, page_id=page_id)
+                results[page_id] = str(post_id)
+            else:
+                self._log_error_payload(
+                    f"Facebook post to page {page_id}", status_code, response_data, "no result in batch response"
+                )
+                results[page_id] = False
+        return results
 
-        self.add_ons = [
-            "crisp lettuce",
-            "ripe tomatoes",
-            "red onion",
-            "pickles",
-            "avocado",
-            "sprouts",
-            "roasted red peppers",
-            "cucumber",
+    def create_and_post(self) -> None:
+        """Generate and post a random turkey and provolone post with an AI image."""
+        logger.info("Creating post at %s", datetime.now(timezone.utc).isoformat())
+        post_content, image_path, image_data = self.prepare_post()
+        self.publish_post(post_content, image_path, image_data)
+
+    def prepare_post(self) -> tuple[dict[str, Any], Path | None, bytes | None]:
+        """Generate the caption and image for the next post without publishing it."""
+        with self.metrics.stage("caption"):
+            post_content = self.generate_post()
+        with self.metrics.stage("image", image_style=post_content.get("image_style")) as labels:
+            image_data, image_path = self.generate_sandwich_image_data(post_content)
+            labels["ok"] = bool(image_data or image_path)
+        return post_content, image_path, image_data
+
+    def publish_post(
+        self, post_content: dict[str, Any], image_path: Path | None, image_data: bytes | None = None
+    ) -> bool:
+        """Publish a prepared post to every page and record the outcome per page."""
+        results = self.post_to_pages(post_content, image_path, image_data)
+        return self._record_publish_results(post_content, results, image_path, image_data)
+
+    def _record_publish_results(
+        self,
+        post_content: dict[str, Any],
+        results: dict[str, str | bool],
+        image_path: Path | None,
+        image_data: bytes | None,
+    ) -> bool:
+        failed_pages = [page_id for page_id, post_id in results.items() if not post_id]
+
+        for page_id, post_id in results.items():
+            if post_id:
+                self.store_recent_post(str(post_id), page_id, post_content)
+        if len(failed_pages) < len(results) and self.image_cache is not None:
+            self.image_cache.record_post(image_path)
+
+        if not failed_pages:
+            logger.info("Post successful on %s page(s)", len(results))
+            return True
+
+        logger.error("Post failed on page(s) %s; content saved for later", ", ".join(failed_pages))
+        self.metrics.count("pages_failed", len(failed_pages))
+        if image_path is None and image_data:
+            image_path = self._save_generated_image(image_data)
+        for page_id in failed_pages:
+            self.save_failed_post({**post_content, "page_id": page_id}, image_path)
+        return False
+
+    def schedule_slots(self, count: int, schedule: CronSchedule) -> list[tuple[datetime, list[str]]]:
+        """The next ``count`` ``schedule`` times that still lack a scheduled post on some page, with those pages.
+
+        Times start far enough ahead that Facebook's 10-minute minimum still
+        holds once this run's uploads finish, and stop at its 30-day limit.
+        """
+        now = datetime.now(timezone.utc)
+        remaining = self.remaining_budget("post scheduling")
+        moment = now + timedelta(seconds=SCHEDULE_MIN_LEAD + min(remaining, SCHEDULE_MIN_LEAD * 3))
+        latest = now + timedelta(seconds=SCHEDULE_MAX_AHEAD)
+        taken: dict[datetime, set[str]] = {}
+        for row in self.post_history.scheduled(since=moment):
+            taken.setdefault(datetime.fromisoformat(row["publish_at"]), set()).add(row["page_id"])
+
+        pages = [page_id for page_id in self.facebook_page_ids if page_id in self.page_access_tokens]
+        slots: list[tuple[datetime, list[str]]] = []
+        while pages and len(slots) < count:
+            moment = schedule.next_after(moment)
+            if moment > latest:
+                logger.warning(
+                    "Facebook schedules posts at most 30 days ahead; found %s of %s slots", len(slots), count
+                )
+                break
+            missing = [page_id for page_id in pages if page_id not in taken.get(moment, ())]
+            if missing:
+                slots.append((moment, missing))
+        return slots
+
+    def schedule_posts(self, count: int, schedule: CronSchedule | None = None) -> dict[str, int]:
+        """Prepare ``count`` posts in one run and schedule them on Facebook for the next POST_SCHEDULE times.
+
+        Captions and images are generated GENERATION_CONCURRENCY at a time,
+        and each post is uploaded unpublished with ``scheduled_publish_time``
+        as soon as it is ready, with at most PAGE_CONCURRENCY uploads in
+        flight. A failed upload is retried on its own, up to
+        SCHEDULE_UPLOAD_ATTEMPTS times; a time that stays empty is filled by
+        the next bulk run. Scheduled post IDs are kept in the post history.
+        Returns how many page posts were scheduled and how many failed.
+        """
+        counts = {"scheduled": 0, "failed": 0}
+        if not self.facebook_ready:
+            logger.error("Facebook API not available")
+            return counts
+        schedule = schedule or CronSchedule(self._get_env("POST_SCHEDULE") or DEFAULT_POST_SCHEDULE)
+        slots = self.schedule_slots(max(count, 0), schedule)
+        if not slots:
+            logger.info("Every upcoming post time already has a scheduled post")
+            return counts
+        logger.info(
+            "Scheduling %s post(s) from %s to %s", len(slots), slots[0][0].isoformat(), slots[-1][0].isoformat()
+        )
+
+        def upload(
+            post_content: dict[str, Any],
+            image_path: Path | None,
+            image_data: bytes | None,
+            publish_at: datetime,
+            page_id: str,
+        ) -> bool:
+            for attempt in range(SCHEDULE_UPLOAD_ATTEMPTS):
+                if attempt:
+                    delay = self._retry_delay(attempt - 1)
+                    lead = (publish_at - datetime.now(timezone.utc)).total_seconds() - delay
+                    if lead < SCHEDULE_MIN_LEAD or (
+                        self.deadline is not None and time.monotonic() + delay >= self.deadline
+                    ):
+                        break
+                    logger.warning(
+                        "Scheduling the %s post on page %s failed; retry %s/%s in %.1fs",
+                        publish_at.isoformat(),
+                        page_id,
+                        attempt,
+                        SCHEDULE_UPLOAD_ATTEMPTS - 1,
+                        delay,
+                    )
+                    time.sleep(delay)
+                post_id = self.post_to_facebook_with_image(post_content, image_path, image_data, page_id, publish_at)
+                if post_id:
+                    logger.info("Scheduled post %s on page %s for %s", post_id, page_id, publish_at.isoformat())
+                    try:
+                        self.post_history.add_scheduled(
+                            str(post_id), page_id, publish_at, post_content.get("image_style"), post_content.get("text")
+                        )
+                    except sqlite3.Error as exc:
+                        logger.error("Error recording scheduled post %s: %s", post_id, exc)
+                    return True
+            logger.error("Could not schedule the %s post on page %s", publish_at.isoformat(), page_id)
+            return False
+
+        with (
+            ThreadPoolExecutor(max_workers=self.generation_concurrency, thread_name_prefix="generate") as generators,
+            ThreadPoolExecutor(max_workers=self.page_concurrency, thread_name_prefix="upload") as uploaders,
+        ):
+            prepared = {generators.submit(self.prepare_post): slot for slot in slots}
+            uploads = []
+            for future in as_completed(prepared):
+                publish_at, pages = prepared[future]
+                try:
+                    post_content, image_path, image_data = future.result()
+                except requests.RequestException as exc:
+                    logger.error("Could not prepare the %s post: %s", publish_at.isoformat(), exc)
+                    counts["failed"] += len(pages)
+                    continue
+                except Exception:  # one broken post must not stop the others from being scheduled
+                    logger.exception("Unexpected error preparing the %s post", publish_at.isoformat())
+                    counts["failed"] += len(pages)
+                    continue
+                uploads.append(
+                    (
+                        image_path,
+                        [
+                            uploaders.submit(upload, post_content, image_path, image_data, publish_at, page_id)
+                            for page_id in pages
+                        ],
+                    )
+                )
+
+            for image_path, futures in uploads:
+                scheduled = 0
+                for future in futures:
+                    try:
+                        scheduled += bool(future.result())
+                    except Exception:  # one broken upload must not hide the others' results
+                        logger.exception("Unexpected error scheduling a post")
+                counts["scheduled"] += scheduled
+                counts["failed"] += len(futures) - scheduled
+                if scheduled and self.image_cache is not None:
+                    self.image_cache.record_post(image_path)
+
+        self.metrics.count("posts_scheduled", counts["scheduled"])
+        if counts["failed"]:
+            self.metrics.count("schedule_failures", counts["failed"])
+        logger.info("Bulk scheduling finished: %s scheduled, %s failed", counts["scheduled"], counts["failed"])
+        return counts
+
+    def load_sandwich_shops(self) -> bool:
+        """Reload sandwich shops from the local JSON file if it changed since the last load."""
+        return self.shop_registry.refresh()
+
+    @property
+    def caption_scheduler(self) -> CaptionScheduler:
+        """Scheduler over every template/bread/add-on/condiment/style combination.
+
+        The vocabulary is hashed only when it differs from the copy taken the
+        last time the scheduler was built.
+        """
+        dimensions = self._caption_dimensions()
+        if self._caption_scheduler is None or dimensions != self._caption_vocabulary:
+            self._caption_vocabulary = [list(values) for values in dimensions]
+            signature = hashlib.sha256(json.dumps(dimensions).encode("utf-8")).hexdigest()
+            if self._caption_scheduler is None or self._caption_scheduler.signature != signature:
+                radices = [len(values) for values in dimensions]
+                self._caption_scheduler = CaptionScheduler(radices, signature, seed=self._get_env("CAPTION_SEED"))
+        return self._caption_scheduler
+
+    def _caption_dimensions(self) -> list[list[str]]:
+        return [
+            self.caption_templates,
+            self.bread_types,
+            self.add_ons,
+            self.condiments,
+            list(self.image_style_prompts),
         ]
 
-        self.condiments = [
-            "mayo",
-            "mustard",
-            "pesto",
-            "olive oil",
-            "balsamic glaze",
-            "herb aioli",
-            "honey mustard",
-            "chipotle mayo",
+    def _render_post(self, scheduler: CaptionScheduler, combination: tuple[int, ...]) -> dict[str, Any]:
+        template, bread, addon, condiment, image_style = (
+            values[index] for values, index in zip(self._caption_dimensions(), combination)
+        )
+        return {
+            "text": template.format(bread=bread, addon=addon, condiment=condiment),
+            "image_style": image_style,
+            "ingredients": {
+                "bread": bread,
+                "addon": addon,
+                "condiment": condiment,
+            },
+            "combination": scheduler.encode(combination),
+        }
+
+    def generate_random_sandwich_post(self) -> dict[str, Any]:
+        """Generate the next unused brainrot/Gen Alpha sandwich caption.
+
+        Captions walk a seeded permutation of every template, bread, add-on,
+        condiment and image style combination, so nothing repeats until the
+        whole space has been posted.
+        """
+        scheduler = self.caption_scheduler
+        return self._render_post(scheduler, scheduler.next_combination())
+
+    def generate_post(self) -> dict[str, Any]:
+        """The next post: a featured shop with probability FEATURED_SHOP_RATE, otherwise a sandwich caption."""
+        if self.featured_shop_rate and random.random() < self.featured_shop_rate:
+            post_content = self.generate_featured_shop_post()
+            if post_content is not None:
+                return post_content
+        return self.generate_random_sandwich_post()
+
+    def _featured_shop_ids(self) -> Sequence[int]:
+        return self.shop_registry.ids(self.featured_shop_status)
+
+    @property
+    def featured_shop_scheduler(self) -> CaptionScheduler:
+        """No-repeat rotation over the shops that can be featured."""
+        signature = hashlib.sha256(
+            f"{self.shop_registry.signature}:{self.featured_shop_status or ''}".encode("utf-8")
+        ).hexdigest()
+        if self._featured_shop_scheduler is None or self._featured_shop_scheduler.signature != signature:
+            self._featured_shop_scheduler = CaptionScheduler(
+                [len(self._featured_shop_ids())],
+                signature,
+                seed=self._get_env("CAPTION_SEED"),
+                state_path=FEATURED_SHOP_STATE_FILE,
+                label="featured shop",
+            )
+        return self._featured_shop_scheduler
+
+    def generate_featured_shop_post(self) -> dict[str, Any] | None:
+        """Spotlight the next shop in a no-repeat rotation; None when no shop can be featured.
+
+        Shops are picked in constant time from a seeded permutation, as
+        captions are, so every shop is featured once before any repeats.
+        FEATURED_SHOP_STATUS limits the rotation to shops with that status.
+        Changing the shop list starts a new rotation.
+        """
+        self.shop_registry.refresh()
+        candidates = self._featured_shop_ids()
+        if not candidates:
+            logger.warning("No sandwich shops can be featured; posting a regular caption")
+            return None
+        (position,) = self.featured_shop_scheduler.next_combination()
+        shop = self.shop_registry.shop(candidates[position])
+        specialty = shop.get("specialty") or "turkey and provolone"
+        return {
+            "text": random.choice(self.featured_shop_templates).format(
+                name=shop["name"],
+                location=shop.get("location") or "the block",
+                specialty=specialty[:1].lower() + specialty[1:],
+            ),
+            "image_style": random.choice(list(self.image_style_prompts)),
+            "post_type": "featured_shop",
+            "shop": shop["name"],
+        }
+
+    def preview_captions(self, count: int) -> list[dict[str, Any]]:
+        """Render the next ``count`` captions without consuming them."""
+        scheduler = self.caption_scheduler
+        return [self._render_post(scheduler, combination) for combination in scheduler.peek(count)]
+
+    def caption_used(self, post_content: dict[str, Any]) -> bool:
+        """Whether ``post_content``'s combination was already used in the current cycle."""
+        combination = post_content.get("combination")
+        return isinstance(combination, int) and self.caption_scheduler.is_used(combination)
+
+    def log_activity(self, message: str, **fields: Any) -> None:
+        """Log an activity to the activity log; ``fields`` become structured log fields."""
+        if _log_listener is None and not activity_logger.handlers:
+            # Without the CLI's logging pipeline, write the activity log directly.
+            try:
+                handler = _rotating_file_handler(ACTIVITY_LOG_FILE)
+            except OSError as exc:
+                logger.error("Error logging activity: %s", exc)
+                return
+            handler.setFormatter(ActivityFormatter())
+            activity_logger.addHandler(handler)
+            activity_logger.setLevel(logging.INFO)
+        activity_logger.info("%s", self._clean_message(message, limit=500), extra=fields)
+
+    def store_recent_post(
+        self, post_id: str, page_id: str | None = None, post_content: dict[str, Any] | None = None
+    ) -> None:
+        """Record a published post in the history for comment monitoring."""
+        post_content = post_content or {}
+        try:
+            self.post_history.add(
+                post_id,
+                page_id or self.facebook_page_id,
+                image_style=post_content.get("image_style"),
+                text=post_content.get("text"),
+            )
+        except sqlite3.Error as exc:
+            logger.error("Error recording post %s in history: %s", post_id, exc)
+
+    def save_failed_post(
+        self, post_content: dict[str, Any], image_path: Path | None = None, image_data: bytes | None = None
+    ) -> None:
+        """Queue a failed post, and its generated image, for a later retry."""
+        try:
+            if image_path is None and image_data:
+                image_path = self._save_generated_image(image_data)
+            item_id = self.failed_posts.enqueue(
+                {
+                    "text": self._clean_message(post_content.get("text")),
+                    "image_style": post_content.get("image_style"),
+                    "ingredients": post_content.get("ingredients"),
+                    "page_id": post_content.get("page_id") or self.facebook_page_id,
+                    **({"image_url": post_content["image_url"]} if post_content.get("image_url") else {}),
+                },
+                image_path,
+            )
+            logger.info("Post queued for retry as failed post #%s", item_id)
+            self.metrics.count("posts_queued_for_retry")
+        except (OSError, sqlite3.Error) as exc:
+            logger.error("Error saving post: %s", exc)
+
+    def retry_failed_posts(self, max_workers: int = RETRY_CONCURRENCY) -> dict[str, int]:
+        """Replay due failed posts with bounded concurrency until none are due."""
+        imported = self.failed_posts.import_legacy_files(SAVED_POST_DIR)
+        if imported:
+            logger.info("Imported %s legacy failed post file(s) into the retry queue", imported)
+
+        counts = {"posted": 0, "failed": 0}
+        cache_lock = threading.Lock()
+
+        def retry(item: dict[str, Any]) -> bool:
+            image_path = Path(item["image_path"]) if item.get("image_path") else None
+            page_id = item["post_content"].get("page_id")
+            post_id = self.post_to_facebook_with_image(item["post_content"], image_path, page_id=page_id)
+            if not post_id:
+                self.failed_posts.mark_failed(item["id"], "Facebook post failed")
+                return False
+            self.failed_posts.mark_posted(item["id"], str(post_id))
+            self.store_recent_post(str(post_id), page_id, item["post_content"])
+            with cache_lock:
+                if self.image_cache is not None:
+                    self.image_cache.record_post(image_path)
+            return True
+
+        with ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix="retry") as executor:
+            while True:
+                if self.deadline is not None and time.monotonic() >= self.deadline:
+                    logger.warning("Run deadline reached; leaving the remaining failed posts for the next run")
+                    self.deadline_exhausted_stage = self.deadline_exhausted_stage or "failed post retry"
+                    break
+                batch = self.failed_posts.claim_due(limit=max(1, max_workers) * 4)
+                if not batch:
+                    break
+                for posted in executor.map(retry, batch):
+                    counts["posted" if posted else "failed"] += 1
+                    self.metrics.count("retries_posted" if posted else "retries_failed")
+
+        logger.info(
+            "Retry run finished: %s posted, %s failed, %s still pending",
+            counts["posted"],
+            counts["failed"],
+            self.failed_posts.pending_count(),
+        )
+        return counts
+
+    def poll_engagement(self, max_workers: int = POLL_CONCURRENCY) -> dict[str, int]:
+        """Fetch new comments and engagement counts for unchecked posts.
+
+        Each post keeps a checkpoint with its comment paging cursor and the
+        newest comment time seen, so a cycle only asks for comments added
+        since the last one. Requests for every post are grouped into Graph
+        batch calls sent ``max_workers`` at a time; further comment pages
+        are fetched in follow-up rounds. Posts older than POLL_WINDOW_DAYS
+        are marked checked after a clean final poll.
+        """
+        counts = {"posts": 0, "comments": 0, "checked": 0, "errors": 0}
+        if not self.facebook_ready:
+            logger.error("Facebook API not available; cannot poll comments")
+            return counts
+
+        window = self._get_float_env("POLL_WINDOW_DAYS", POLL_WINDOW_DAYS) * 24 * 60 * 60
+        metrics = os.getenv("POLL_INSIGHT_METRICS", POLL_INSIGHT_METRICS).strip()
+        engagement_fields = "shares,reactions.limit(0).summary(total_count),comments.limit(0).summary(total_count)"
+        if metrics:
+            engagement_fields += f",insights.metric({metrics})"
+
+        targets = {
+            post["post_id"]: post
+            for post in self.post_history.poll_targets(int(self._get_float_env("POLL_MAX_POSTS", POLL_MAX_POSTS)))
+        }
+        now = time.time()
+        checkpoints = {
+            post_id: {
+                "post_id": post_id,
+                "comments_after": post["comments_after"],
+                "comments_since": post["comments_since"],
+                "engagement": None,
+                "polled_at": now,
+            }
+            for post_id, post in targets.items()
+        }
+        comments: list[dict[str, Any]] = []
+        failed_posts: set[str] = set()
+
+        def operation(post_id: str, edge: str, params: dict[str, Any]) -> dict[str, str]:
+            page_id = str(targets[post_id]["page_id"])
+            params["access_token"] = self.page_access_tokens.get(page_id) or self.facebook_access_token
+            return {"method": "GET", "relative_url": f"{quote(post_id, safe='')}{edge}?{urlencode(params)}"}
+
+        def comments_operation(post_id: str) -> dict[str, str]:
+            checkpoint = checkpoints[post_id]
+            params: dict[str, Any] = {
+                "fields": "id,from,message,created_time",
+                "filter": "stream",
+                "order": "chronological",
+                "limit": POLL_COMMENT_PAGE_SIZE,
+            }
+            if checkpoint["comments_after"]:
+                params["after"] = checkpoint["comments_after"]
+            elif checkpoint["comments_since"]:
+                params["since"] = int(checkpoint["comments_since"])
+            return operation(post_id, "/comments", params)
+
+        operations: list[dict[str, str]] = []
+        keys: list[tuple[str, str]] = []
+        for post_id in targets:
+            operations += [operation(post_id, "", {"fields": engagement_fields}), comments_operation(post_id)]
+            keys += [("engagement", post_id), ("comments", post_id)]
+
+        for _ in range(POLL_MAX_PAGES):
+            if not operations:
+                break
+            try:
+                responses = self._graph_batch(
+                    operations, str(self.facebook_access_token), "Facebook comment poll", max_workers
+                )
+            except requests.RequestException as exc:
+                logger.error("Error polling Facebook comments: %s", exc)
+                failed_posts.update(post_id for _, post_id in keys)
+                break
+
+            operations, next_keys = [], []
+            for (kind, post_id), (status_code, body) in zip(keys, responses):
+                checkpoint = checkpoints[post_id]
+                if status_code != 200:
+                    self._log_error_payload(f"Facebook {kind} poll for post {post_id}", status_code, body)
+                    failed_posts.add(post_id)
+                    if kind == "comments":
+                        checkpoint["comments_after"] = None
+                    continue
+                if kind == "engagement":
+                    checkpoint["engagement"] = json.dumps(self._parse_engagement(body))
+                    continue
+
+                page = [
+                    comment for comment in body.get("data") or [] if isinstance(comment, dict) and comment.get("id")
+                ]
+                for comment in page:
+                    try:
+                        created_at = PostHistory._timestamp(comment.get("created_time"))
+                    except (TypeError, ValueError):
+                        created_at = now
+                    author = comment.get("from") if isinstance(comment.get("from"), dict) else {}
+                    comments.append(
+                        {
+                            "comment_id": str(comment["id"]),
+                            "post_id": post_id,
+                            "author": author.get("name"),
+                            "message": comment.get("message"),
+                            "created_at": created_at,
+                        }
+                    )
+                    checkpoint["comments_since"] = max(checkpoint["comments_since"] or 0.0, created_at)
+                paging = body.get("paging") if isinstance(body.get("paging"), dict) else {}
+                after = (paging.get("cursors") or {}).get("after")
+                if after and page:
+                    checkpoint["comments_after"] = after
+                if paging.get("next") and after:
+                    operations.append(comments_operation(post_id))
+                    next_keys.append(("comments", post_id))
+            keys = next_keys
+        if operations:
+            logger.info("%s post(s) have more comment pages; they continue next cycle", len(operations))
+
+        checked = [
+            post_id
+            for post_id, post in targets.items()
+            if post_id not in failed_posts and now - post["posted_at"] >= window
         ]
+        try:
+            counts["comments"] = self.post_history.save_poll(list(checkpoints.values()), comments, checked)
+        except sqlite3.Error as exc:
+            logger.error("Error saving comment poll results: %s", exc)
+            failed_posts.update(targets)
+            checked = []
+        counts.update(posts=len(targets), checked=len(checked), errors=len(failed_posts))
+        if counts["comments"]:
+            self.log_activity(f"NEW COMMENTS: {counts['comments']} across {len(targets)} post(s)")
+        logger.info(
+            "Comment poll finished: %s post(s), %s new comment(s), %s checked, %s with errors",
+            counts["posts"],
+            counts["comments"],
+            counts["checked"],
+            counts["errors"],
+        )
+        return counts
+
+    @staticmethod
+    def _parse_engagement(data: dict[str, Any]) -> dict[str, Any]:
+        def summary_count(edge: str) -> int | None:
+            value = data.get(edge)
+            summary = value.get("summary") if isinstance(value, dict) else None
+            return summary.get("total_count") if isinstance(summary, dict) else None
+
+        shares = data.get("shares") if isinstance(data.get("shares"), dict) else {}
+        engagement: dict[str, Any] = {
+            "reactions": summary_count("reactions"),
+            "comments": summary_count("comments"),
+            "shares": shares.get("count", 0),
+            "fetched_at": datetime.now(timezone.utc).isoformat(),
+        }
+        insights = data.get("insights") if isinstance(data.get("insights"), dict) else {}
+        for metric in insights.get("data") or []:
+            values = metric.get("values") if isinstance(metric, dict) else None
+            if metric.get("name") and values and isinstance(values[-1], dict):
+                engagement[metric["name"]] = values[-1].get("value")
+        return engagement
+
+    def run_single_post(self) -> None:
+        """Run a single post, which is suitable for GitHub Actions."""
+        logger.info("Turkey and Provolone Bot - Single Post Mode with AI Images")
+        logger.info("=" * 60)
+        if self.deadline is None:
+            self.start_deadline()
+        with self.profiled("single"):
+            self.create_and_post()
+        self.write_run_report("single")
+        logger.info("Single post execution completed")
+
+    def profiled(self, run: str) -> AbstractContextManager[None]:
+        """Profile the ``with`` block into REPORT_DIR when PROFILE is on; otherwise do nothing."""
+        return self.profiler.profile(run) if self.profiler is not None else nullcontext()
+
+    def write_run_report(self, run: str) -> Path | None:
+        """Write the current run's metrics to REPORT_DIR and the configured exporters, then start a new run.
+
+        METRICS_TEXTFILE names a Prometheus textfile to overwrite and
+        STATSD_ADDRESS a ``host:port`` StatsD server to send the timings to.
+        """
+        report = self.metrics.finish(run)
+        report["image"] = self.last_image_report
+        report["deadline_exhausted_stage"] = self.deadline_exhausted_stage
+        started = datetime.fromisoformat(report["started_at"]).strftime("%Y%m%dT%H%M%S.%fZ")
+        path: Path | None = REPORT_DIR / f"run_{started}_{run}_{os.getpid()}.json"
+        try:
+            self._atomic_write_json(path, report)
+            logger.info("Wrote run report %s", path.name)
+        except OSError as exc:
+            logger.error("Could not write run report: %s", exc)
+            path = None
+
+        textfile = self._get_env("METRICS_TEXTFILE")
+        if textfile:
+            try:
+                write_prometheus_textfile(report, Path(textfile))
+            except OSError as exc:
+                logger.error("Could not write Prometheus textfile %s: %s", textfile, exc)
+        statsd_address = self._get_env("STATSD_ADDRESS")
+        if statsd_address:
+            try:
+                send_statsd(report, statsd_address)
+            except (OSError, ValueError) as exc:
+                logger.error("Could not send metrics to StatsD: %s", exc)
+        return path
+
+    def run_scheduled(
+        self,
+        schedule: CronSchedule,
+        stop_event: threading.Event,
+        lead_seconds: float = IMAGE_LEAD_SECONDS,
+        heartbeat_path: Path = HEARTBEAT_FILE,
+    ) -> None:
+        """Post on ``schedule`` from one long-lived process until ``stop_event`` is set.
+
+        The caption and image for each post are prepared ``lead_seconds``
+        before the scheduled time, so only the Facebook upload happens on the
+        minute. The same session, and its warm connections, is reused for
+        every post.
+        """
+        logger.info("Turkey and Provolone Bot - Scheduled Mode (%s)", schedule.expression)
+        posts = 0
+
+        def heartbeat(state: str, next_post: datetime | None) -> None:
+            try:
+                self._atomic_write_json(
+                    heartbeat_path,
+                    {
+                        "timestamp": datetime.now(timezone.utc).isoformat(),
+                        "pid": os.getpid(),
+                        "state": state,
+                        "next_post": next_post.isoformat() if next_post else None,
+                        "posts": posts,
+                    },
+                )
+            except OSError as exc:
+                logger.warning("Could not write heartbeat file: %s", exc)
+
+        def wait_until(moment: datetime, state: str) -> bool:
+            while not stop_event.is_set():
+                remaining = (moment - datetime.now(timezone.utc)).total_seconds()
+                if remaining <= 0:
+                    return True
+                heartbeat(state, next_post)
+                stop_event.wait(min(remaining, HEARTBEAT_INTERVAL))
+            return False
+
+        while not stop_event.is_set():
+            next_post = schedule.next_after(datetime.now(timezone.utc))
+            logger.info("Next post scheduled for %s", next_post.isoformat())
+            if not wait_until(next_post - timedelta(seconds=lead_seconds), "waiting"):
+                break
+
+            heartbeat("preparing", next_post)
+            self.start_deadline()
+            try:
+                with self.profiled("scheduled_prepare"):
+                    post_content, image_path, image_data = self.prepare_post()
+            except Exception:  # one broken slot must not stop the schedule
+                logger.exception("Could not prepare the %s post; skipping it", next_post.isoformat())
+                self.metrics.count("scheduled_failures")
+                heartbeat("failed", next_post)
+                wait_until(next_post, "failed")
+                continue
+            if not wait_until(next_post, "ready"):
+                logger.info("Shutdown requested before publishing; saving prepared post")
+                self.save_failed_post(post_content, image_path, image_data)
+                break
+
+            heartbeat("posting", next_post)
+            self.start_deadline()
+            try:
+                with self.profiled("scheduled_publish"):
+                    if self.publish_post(post_content, image_path, image_data):
+                        posts += 1
+            except Exception:  # one broken slot must not stop the schedule
+                logger.exception("Could not publish the %s post; saving it for retry", next_post.isoformat())
+                self.metrics.count("scheduled_failures")
+                self.save_failed_post(post_content, image_path, image_data)
+            self.write_run_report("scheduled")
+
+        heartbeat("stopped", None)
+        logger.info("Scheduled mode stopped after %s post(s)", posts)
+
+
+class AsyncTurkeyProvoloneBot(TurkeyProvoloneBot):
+    """Asyncio variant of the bot that sends its HTTP requests with aiohttp.
 
-        self.setup_facebook()
-        self.load_sandwich_shops()
+    Captions, prompts, the image pool and cache, provider routing and post
+    history are shared with ``TurkeyProvoloneBot``. The ``*_async``
+    coroutines replace the blocking network calls, so one event loop can
+    generate images, poll Replicate predictions and upload to many pages at
+    once. Requests are built and responses parsed by the same helpers as the
+    blocking bot, and the file and SQLite work they share runs in worker
+    threads through ``asyncio.to_thread``. Use the bot as an async context
+    manager so its aiohttp session is closed; the inherited blocking methods
+    keep working through ``requests``.
+    """
 
-    @staticmethod
-    def _get_env(name: str) -> str | None:
-        value = os.getenv(name)
-        return value.strip() if value and value.strip() else None
+    def __init__(self, session: Any = None) -> None:
+        self._aiohttp = load_aiohttp()
+        if self._aiohttp is None:
+            raise RuntimeError("AsyncTurkeyProvoloneBot needs aiohttp; install it with: pip install aiohttp")
+        super().__init__()
+        self.async_session = session
+        self._owns_async_session = session is None
+        self._facebook_async_lock = asyncio.Lock()
+        self._generation_semaphore = asyncio.Semaphore(self.generation_concurrency)
+        self._page_semaphore = asyncio.Semaphore(self.page_concurrency)
 
-    @staticmethod
-    def _clean_message(value: Any, limit: int = MAX_CUSTOM_MESSAGE_LENGTH) -> str:
-        text = str(value or "").strip()
-        text = "".join(char for char in text if char.isprintable() or char in "\n\t")
-        if len(text) > limit:
-            logger.warning("Custom message exceeded %s characters and was truncated", limit)
-            text = text[:limit].rstrip()
-        return text
+    async def __aenter__(self) -> AsyncTurkeyProvoloneBot:
+        return self
 
-    @staticmethod
-    def _safe_json(response: requests.Response) -> dict[str, Any]:
-        try:
-            data = response.json()
-        except ValueError:
-            return {}
-        return data if isinstance(data, dict) else {}
+    async def __aexit__(self, *exc_info: Any) -> None:
+        await self.aclose()
 
-    @staticmethod
-    def _atomic_write_json(path: Path, payload: Any) -> None:
-        temp_path = path.with_name(f"{path.name}.tmp")
-        with temp_path.open("w", encoding="utf-8") as file:
-            json.dump(payload, file, indent=2)
-            file.write("\n")
-        temp_path.replace(path)
+    async def aclose(self) -> None:
+        """Close the aiohttp session, if the bot created it, and the inherited requests session."""
+        if self.async_session is not None and self._owns_async_session:
+            await self.async_session.close()
+            self.async_session = None
+        self.session.close()
 
-    def _log_http_error(self, provider: str, response: requests.Response) -> None:
-        data = self._safe_json(response)
-        error = data.get("error") if isinstance(data.get("error"), dict) else {}
-        message = error.get("message") or data.get("message") or response.reason
-        trace_id = data.get("fbtrace_id")
-        suffix = f" trace_id={trace_id}" if trace_id else ""
-        logger.error("%s request failed: HTTP %s %s%s", provider, response.status_code, message, suffix)
+    def _client(self) -> Any:
+        if self.async_session is None:
+            # Same per-host pool size as the requests adapter, with no overall cap; extra requests wait for a
+            # free connection.
+            connector = self._aiohttp.TCPConnector(limit=0, limit_per_host=self.http_pool_size)
+            trace_configs = [self.profiler.aiohttp_trace(self._aiohttp)] if self.profiler is not None else None
+            self.async_session = self._aiohttp.ClientSession(connector=connector, trace_configs=trace_configs)
+        return self.async_session
 
-    def setup_facebook(self) -> None:
-        """Verify that Facebook credentials can access the configured page."""
-        if not self.facebook_access_token or not self.facebook_page_id:
-            logger.error("Facebook credentials not provided")
+    def _as_requests_error(self, exc: BaseException) -> requests.RequestException:
+        """Translate an aiohttp or timeout error into the ``requests`` exception the callers already handle."""
+        message = str(exc) or type(exc).__name__
+        if isinstance(exc, getattr(self._aiohttp, "ConnectionTimeoutError", ())):
+            return requests.ConnectTimeout(message)
+        if isinstance(exc, asyncio.TimeoutError):
+            return requests.ReadTimeout(message)
+        if isinstance(exc, self._aiohttp.ClientConnectionError):
+            return requests.ConnectionError(message)
+        return requests.RequestException(message)
+
+    @staticmethod
+    async def _stream_body(body: MultipartStream) -> AsyncIterator[bytes]:
+        # A photo on disk is read in a worker thread, so a slow disk never stalls the event loop.
+        while True:
+            if body.from_file:
+                block = await asyncio.to_thread(body.read, UPLOAD_BLOCK_SIZE)
+            else:
+                block = body.read(UPLOAD_BLOCK_SIZE)
+            if not block:
+                return
+            yield block
+
+    async def _wait_for_graph_slot_async(self, keys: list[str], stage: str) -> None:
+        # The throttle reads its usage file on first use, so every check runs in a worker thread.
+        delay = await asyncio.to_thread(self._graph_throttle_delay, keys, stage)
+        if delay <= 0:
             return
+        started = time.monotonic()
+        while delay > 0:
+            await asyncio.sleep(delay)
+            delay = await asyncio.to_thread(self._graph_throttle_delay, keys, stage)
+        self._record_graph_wait(stage, time.monotonic() - started)
 
-        try:
-            page_id = quote(self.facebook_page_id, safe="")
-            response = self.session.get(
-                f"https://graph.facebook.com/{FACEBOOK_API_VERSION}/{page_id}",
-                headers={"Authorization": f"Bearer {self.facebook_access_token}"},
-                timeout=DEFAULT_TIMEOUT,
+    async def _request_async(
+        self,
+        method: str,
+        url: str,
+        stage: str,
+        timeout: tuple[float, float] = DEFAULT_TIMEOUT,
+        idempotent: bool = True,
+        **kwargs: Any,
+    ) -> Any:
+        """Async counterpart of ``_request`` with the same deadline and retry rules.
+
+        Returns the unread aiohttp response; use it with ``async with`` so
+        the connection is released. aiohttp failures are raised as their
+        ``requests`` equivalents.
+        """
+        aiohttp = self._aiohttp
+        retry_statuses = HTTP_RETRY_STATUSES if idempotent else frozenset({429})
+        graph_target = self._graph_target(url)
+        body = kwargs.pop("data", None)
+        if isinstance(body, MultipartStream):
+            kwargs["headers"] = {**kwargs.get("headers", {}), "Content-Length": str(len(body))}
+        attempt = 0
+        while True:
+            if graph_target:
+                await self._wait_for_graph_slot_async(graph_target[0], stage)
+            remaining = self.remaining_budget(stage)
+            data = body
+            if isinstance(body, MultipartStream):
+                if attempt:
+                    body.rewind()
+                data = self._stream_body(body)
+            client_timeout = aiohttp.ClientTimeout(
+                total=None if math.isinf(remaining) else remaining,
+                sock_connect=min(timeout[0], remaining),
+                sock_read=min(timeout[1], remaining),
             )
-            if response.ok:
-                page_info = self._safe_json(response)
-                logger.info("Connected to Facebook page: %s", page_info.get("name", "Unknown"))
-                self.facebook_ready = True
+            try:
+                response = await self._client().request(method, url, data=data, timeout=client_timeout, **kwargs)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as exc:
+                error = self._as_requests_error(exc)
+                if self.deadline is not None and time.monotonic() >= self.deadline:
+                    self._deadline_exhausted(stage)
+                if attempt >= self.http_max_retries or not (idempotent or isinstance(error, requests.ConnectTimeout)):
+                    raise error from exc
+                delay, reason = self._retry_delay(attempt), type(error).__name__
             else:
-                self._log_http_error("Facebook setup", response)
-        except requests.RequestException as exc:
-            logger.error("Error setting up Facebook API: %s", exc)
+                if graph_target:
+                    await asyncio.to_thread(self.graph_throttle.observe, response.headers, graph_target[1])
+                if response.status not in retry_statuses or attempt >= self.http_max_retries:
+                    return response
+                delay = self._retry_delay(attempt, response.headers.get("Retry-After"))
+                reason = f"HTTP {response.status}"
+                if self.deadline is not None and time.monotonic() + delay >= self.deadline:
+                    logger.warning("%s returned %s; no run budget left to retry", stage, reason)
+                    self.deadline_exhausted_stage = self.deadline_exhausted_stage or stage
+                    return response
+                try:
+                    await response.read()  # drain the error body so the connection goes back to the pool
+                except (aiohttp.ClientError, asyncio.TimeoutError):
+                    pass
+                response.release()
 
-    def _decode_image(self, encoded_image: str | None, provider: str) -> bytes | None:
-        if not encoded_image:
-            logger.error("%s response did not include image data", provider)
+            attempt += 1
+            self.metrics.count("http_retries")
+            logger.warning(
+                "%s failed with %s; retry %s/%s in %.1fs", stage, reason, attempt, self.http_max_retries, delay
+            )
+            await asyncio.sleep(min(delay, self.remaining_budget(stage)))
+
+    async def _read_body_async(self, response: Any, limit: int) -> bytearray | None:
+        """Async counterpart of ``_read_body``."""
+        content_length = response.headers.get("Content-Length", "")
+        expected = int(content_length) if content_length.isdigit() else 0
+        if expected > limit:
             return None
 
+        body = bytearray(expected)
+        total = 0
         try:
-            image_data = base64.b64decode(encoded_image, validate=True)
-        except (ValueError, TypeError) as exc:
-            logger.error("%s returned invalid base64 image data: %s", provider, exc)
-            return None
+            async for chunk in response.content.iter_chunked(64 * 1024):
+                if total + len(chunk) > limit:
+                    return None
+                body[total : total + len(chunk)] = chunk
+                total += len(chunk)
+        except (self._aiohttp.ClientError, asyncio.TimeoutError) as exc:
+            raise self._as_requests_error(exc) from exc
+        del body[total:]
+        return body
 
-        if not self._valid_image_size(image_data, provider):
+    async def _read_json_async(self, response: Any) -> Any:
+        try:
+            return json.loads(await response.read())
+        except ValueError:
             return None
-        return image_data
-
-    @staticmethod
-    def _valid_image_size(image_data: bytes, provider: str) -> bool:
-        size = len(image_data)
-        if size == 0:
-            logger.error("%s returned an empty image", provider)
-            return False
-        if size > MAX_IMAGE_BYTES:
-            logger.error("%s image exceeded %s bytes", provider, MAX_IMAGE_BYTES)
-            return False
-        return True
+        except (self._aiohttp.ClientError, asyncio.TimeoutError) as exc:
+            raise self._as_requests_error(exc) from exc
 
-    def generate_image_with_openai(self, prompt: str) -> bytes | None:
-        """Generate an image using OpenAI Images API."""
-        if not self.openai_api_key:
-            return None
+    async def _safe_json_async(self, response: Any) -> dict[str, Any]:
+        data = await self._read_json_async(response)
+        return data if isinstance(data, dict) else {}
 
+    async def _log_http_error_async(self, provider: str, response: Any) -> None:
         try:
-            response = self.session.post(
-                "https://api.openai.com/v1/images/generations",
-                headers={
-                    "Authorization": f"Bearer {self.openai_api_key}",
-                    "Content-Type": "application/json",
-                },
-                json={
-                    "model": self.openai_image_model,
-                    "prompt": prompt,
-                    "n": 1,
-                    "size": "1024x1024",
-                    "quality": "standard",
-                    "response_format": "b64_json",
-                },
-                timeout=DEFAULT_TIMEOUT,
-            )
+            data = await self._safe_json_async(response)
+        except requests.RequestException:
+            data = {}
+        self._log_error_payload(provider, response.status, data, response.reason)
 
-            if not response.ok:
-                self._log_http_error("OpenAI image generation", response)
-                return None
+    async def _graph_batch_async(
+        self, operations: list[dict[str, Any]], access_token: str, label: str
+    ) -> list[tuple[int, dict[str, Any]]]:
+        """Async counterpart of ``_graph_batch``; the batch requests for every chunk are sent concurrently."""
+        chunks = [
+            operations[start : start + GRAPH_BATCH_LIMIT] for start in range(0, len(operations), GRAPH_BATCH_LIMIT)
+        ]
+        parts = await asyncio.gather(*(self._graph_batch_chunk_async(chunk, access_token, label) for chunk in chunks))
+        return [result for part in parts for result in part]
 
-            result = self._safe_json(response)
-            data = result.get("data") if isinstance(result.get("data"), list) else []
-            encoded_image = data[0].get("b64_json") if data and isinstance(data[0], dict) else None
-            image_data = self._decode_image(encoded_image, "OpenAI")
-            if image_data:
-                logger.info("Generated image with OpenAI")
-            return image_data
-        except requests.RequestException as exc:
-            logger.error("Error with OpenAI image generation: %s", exc)
-            return None
+    async def _graph_batch_chunk_async(
+        self, chunk: list[dict[str, Any]], access_token: str, label: str
+    ) -> list[tuple[int, dict[str, Any]]]:
+        with self.metrics.stage("graph_batch", operations=len(chunk)) as labels:
+            async with await self._request_async(
+                "POST",
+                self.graph_api_url,
+                label,
+                idempotent=all(operation.get("method") == "GET" for operation in chunk),
+                headers={"Authorization": f"Bearer {access_token}"},
+                data={"batch": json.dumps(chunk), "include_headers": "false"},
+            ) as response:
+                labels["ok"] = response.ok
+                if not response.ok:
+                    await self._log_http_error_async(label, response)
+                    return [(response.status, {})] * len(chunk)
+                payload = await self._read_json_async(response)
+        return self._parse_batch_results(len(chunk), payload)
 
-    def generate_image_with_stability(self, prompt: str) -> bytes | None:
-        """Generate an image using Stability AI."""
-        if not self.stability_api_key:
+    async def setup_facebook_async(self) -> bool:
+        """Async counterpart of ``setup_facebook``; returns whether at least one page is usable."""
+        async with self._facebook_async_lock:
+            if self._facebook_checked:
+                return self._facebook_ready
+            self._facebook_checked = True
+            if not self.facebook_access_token or not self.facebook_page_ids:
+                logger.error("Facebook credentials not provided")
+                return False
+
+            cache_key = CredentialCache.make_key("facebook", self.facebook_access_token, *self.facebook_page_ids)
+            if not await asyncio.to_thread(self._use_cached_pages, cache_key):
+                try:
+                    results = await self._graph_batch_async(
+                        self._page_verification_operations(), self.facebook_access_token, "Facebook setup"
+                    )
+                except requests.RequestException as exc:
+                    logger.error("Error setting up Facebook API: %s", exc)
+                    return False
+                await asyncio.to_thread(self._apply_page_verification, cache_key, results)
+            return self._facebook_ready
+
+    async def _read_base64_images_async(
+        self, response: Any, container: str, field: str, provider: str, count: int
+    ) -> list[str | memoryview] | None:
+        body = await self._read_body_async(response, count * (MAX_IMAGE_BYTES * 4 // 3 + MAX_JSON_OVERHEAD_BYTES))
+        if body is None:
+            logger.error("%s response exceeded the image size limit", provider)
             return None
+        return self._parse_base64_images(body, container, field)
+
+    async def generate_images_with_openai_async(self, prompt: str, count: int = 1) -> list[bytes]:
+        """Async counterpart of ``generate_images_with_openai``."""
+        if not self.openai_api_key:
+            return []
 
         try:
-            response = self.session.post(
-                "https://api.stability.ai/v1/generation/stable-diffusion-xl-1024-v1-0/text-to-image",
-                headers={
-                    "Authorization": f"Bearer {self.stability_api_key}",
-                    "Content-Type": "application/json",
-                },
-                json={
-                    "text_prompts": [{"text": prompt}],
-                    "cfg_scale": 7,
-                    "height": 1024,
-                    "width": 1024,
-                    "samples": 1,
-                    "steps": 30,
-                },
-                timeout=DEFAULT_TIMEOUT,
-            )
+            async with await self._request_async(
+                "POST",
+                f"{self.openai_api_base}/images/generations",
+                "OpenAI image generation",
+                **self._openai_request(prompt, count),
+            ) as response:
+                if not response.ok:
+                    await self._log_http_error_async("OpenAI image generation", response)
+                    return []
+                encoded_images = await self._read_base64_images_async(response, "data", "b64_json", "OpenAI", count)
+            return self._decode_images(encoded_images, "OpenAI")
+        except requests.RequestException as exc:
+            logger.error("Error with OpenAI image generation: %s", exc)
+            return []
 
-            if not response.ok:
-                self._log_http_error("Stability AI image generation", response)
-                return None
+    async def generate_images_with_stability_async(self, prompt: str, count: int = 1) -> list[bytes]:
+        """Async counterpart of ``generate_images_with_stability``."""
+        if not self.stability_api_key:
+            return []
 
-            result = self._safe_json(response)
-            artifacts = result.get("artifacts") if isinstance(result.get("artifacts"), list) else []
-            encoded_image = artifacts[0].get("base64") if artifacts and isinstance(artifacts[0], dict) else None
-            image_data = self._decode_image(encoded_image, "Stability AI")
-            if image_data:
-                logger.info("Generated image with Stability AI")
-            return image_data
+        try:
+            async with await self._request_async(
+                "POST",
+                f"{self.stability_api_base}/generation/{STABILITY_ENGINE}/text-to-image",
+                "Stability AI image generation",
+                **self._stability_request(prompt, count),
+            ) as response:
+                if not response.ok:
+                    await self._log_http_error_async("Stability AI image generation", response)
+                    return []
+                encoded_images = await self._read_base64_images_async(
+                    response, "artifacts", "base64", "Stability AI", count
+                )
+            return self._decode_images(encoded_images, "Stability AI")
         except requests.RequestException as exc:
             logger.error("Error with Stability AI image generation: %s", exc)
-            return None
+            return []
 
-    def generate_image_with_replicate(self, prompt: str) -> bytes | None:
-        """Generate an image using Replicate API."""
-        if not self.replicate_api_token:
-            return None
+    async def generate_images_with_replicate_async(self, prompt: str, count: int = 1) -> list[bytes]:
+        """Async counterpart of ``generate_images_with_replicate``.
 
-        headers = {
-            "Authorization": f"Token {self.replicate_api_token}",
-            "Content-Type": "application/json",
-        }
+        Polling waits with ``asyncio.sleep``, so many pending predictions
+        share one thread, and the output images are downloaded concurrently.
+        """
+        image_urls = await self.generate_image_urls_with_replicate_async(prompt, count)
+        images = await asyncio.gather(*(self._download_generated_image_async(url) for url in image_urls))
+        return [image for image in images if image]
+
+    async def generate_image_urls_with_replicate_async(self, prompt: str, count: int = 1) -> list[str]:
+        """Async counterpart of ``generate_image_urls_with_replicate``."""
+        if not self.replicate_api_token:
+            return []
 
+        headers = self._replicate_headers()
         try:
-            response = self.session.post(
-                "https://api.replicate.com/v1/predictions",
-                headers=headers,
-                json={
-                    "version": "39ed52f2a78e934b3ba6e2a89f5b1c712de7dfea535525255b1aa35c5565e08b",
-                    "input": {
-                        "prompt": prompt,
-                        "width": 1024,
-                        "height": 1024,
-                        "num_outputs": 1,
-                        "guidance_scale": 7.5,
-                        "num_inference_steps": 20,
-                    },
-                },
-                timeout=DEFAULT_TIMEOUT,
-            )
+            prediction = await self._resume_replicate_prediction_async(prompt, headers)
+            if prediction is None:
+                prediction = await self._create_replicate_prediction_async(prompt, headers, count)
+            if prediction is None:
+                return []
 
-            if response.status_code != 201:
-                self._log_http_error("Replicate prediction create", response)
-                return None
+            prediction = await self._wait_for_replicate_prediction_async(prompt, prediction, headers)
+            if prediction is None:
+                return []
+        except requests.RequestException as exc:
+            logger.error("Error with Replicate image generation: %s", exc)
+            return []
+        return self._prediction_image_urls(prediction)
 
-            prediction = self._safe_json(response)
-            prediction_id = prediction.get("id")
-            if not prediction_id:
-                logger.error("Replicate response did not include a prediction id")
+    async def _create_replicate_prediction_async(
+        self, prompt: str, headers: dict[str, str], count: int = 1
+    ) -> dict[str, Any] | None:
+        async with await self._request_async(
+            "POST",
+            self._replicate_prediction_url(),
+            "Replicate prediction create",
+            idempotent=False,
+            **self._replicate_create_request(prompt, headers, count),
+        ) as response:
+            if response.status not in {200, 201}:
+                await self._log_http_error_async("Replicate prediction create", response)
                 return None
+            return self._created_prediction(await self._safe_json_async(response))
 
-            for _ in range(30):
-                time.sleep(10)
-                status_response = self.session.get(
-                    f"https://api.replicate.com/v1/predictions/{quote(str(prediction_id), safe='')}",
-                    headers=headers,
-                    timeout=POLL_TIMEOUT,
-                )
-
-                if not status_response.ok:
-                    self._log_http_error("Replicate prediction status", status_response)
-                    return None
-
-                status_data = self._safe_json(status_response)
-                status = status_data.get("status")
-                if status == "succeeded":
-                    output = status_data.get("output")
-                    image_url = output[0] if isinstance(output, list) and output else None
-                    return self._download_generated_image(image_url)
-                if status in {"failed", "canceled"}:
-                    logger.error("Replicate generation ended with status: %s", status)
-                    return None
-
-            logger.error("Replicate generation timed out")
-            return None
-        except requests.RequestException as exc:
-            logger.error("Error with Replicate image generation: %s", exc)
+    async def _resume_replicate_prediction_async(
+        self, prompt: str, headers: dict[str, str]
+    ) -> dict[str, Any] | None:
+        entry = (await asyncio.to_thread(self._load_replicate_pending)).get(self._replicate_prompt_key(prompt))
+        if not entry:
             return None
 
-    def _download_generated_image(self, image_url: Any) -> bytes | None:
-        if not isinstance(image_url, str):
-            logger.error("Replicate output did not include an image URL")
+        async with await self._request_async(
+            "GET",
+            self._replicate_prediction_url(entry["id"]),
+            "Replicate prediction resume",
+            timeout=POLL_TIMEOUT,
+            headers=headers,
+        ) as status_response:
+            prediction = await self._safe_json_async(status_response) if status_response.ok else {}
+        if not self._resumable_prediction(entry["id"], prediction):
+            await asyncio.to_thread(self._forget_replicate_prediction, prompt)
             return None
+        return prediction
 
-        parsed = urlparse(image_url)
-        if parsed.scheme != "https" or not parsed.netloc:
-            logger.error("Rejected Replicate image URL with invalid scheme or host")
-            return None
+    @staticmethod
+    async def _wait_for_event(event: threading.Event, timeout: float) -> None:
+        """Wait up to ``timeout`` seconds for a webhook event without blocking the event loop."""
+        finish = time.monotonic() + timeout
+        while not event.is_set():
+            remaining = finish - time.monotonic()
+            if remaining <= 0:
+                return
+            await asyncio.sleep(min(remaining, REPLICATE_WEBHOOK_CHECK_INTERVAL))
+        event.clear()
 
+    async def _wait_for_replicate_prediction_async(
+        self, prompt: str, prediction: dict[str, Any], headers: dict[str, str]
+    ) -> dict[str, Any] | None:
+        prediction_id = prediction["id"]
+        webhook_event = None
+        if self.replicate_webhook_url:
+            webhook_event = self._replicate_webhook_listener().event_for(str(prediction_id))
+
+        deadline = self._replicate_wait_deadline()
+        delay = REPLICATE_POLL_INITIAL_DELAY
+        polls = 0
         try:
-            with self.session.get(image_url, timeout=DEFAULT_TIMEOUT, stream=True) as response:
-                if not response.ok:
-                    self._log_http_error("Replicate image download", response)
-                    return None
+            while True:
+                settled = self._settled_prediction(prediction, polls)
+                if settled is not None:
+                    await asyncio.to_thread(self._forget_replicate_prediction, prompt)
+                    return prediction if settled else None
 
-                content_type = response.headers.get("Content-Type", "")
-                if content_type and not content_type.lower().startswith("image/"):
-                    logger.error("Rejected Replicate download with content type: %s", content_type)
+                await asyncio.to_thread(self._remember_replicate_prediction, prompt, prediction_id)
+                pause = self._replicate_poll_pause(prediction_id, delay, deadline)
+                if pause is None:
                     return None
+                if webhook_event is not None:
+                    await self._wait_for_event(webhook_event, pause)
+                else:
+                    await asyncio.sleep(pause)
+                delay = min(delay * REPLICATE_POLL_BACKOFF, REPLICATE_POLL_MAX_DELAY)
 
-                content_length = response.headers.get("Content-Length")
-                if content_length and int(content_length) > MAX_IMAGE_BYTES:
-                    logger.error("Rejected Replicate image larger than %s bytes", MAX_IMAGE_BYTES)
+                with self.metrics.stage("replicate_poll", provider="Replicate") as labels:
+                    async with await self._request_async(
+                        "GET",
+                        self._replicate_prediction_url(prediction_id),
+                        "Replicate prediction poll",
+                        timeout=POLL_TIMEOUT,
+                        headers=headers,
+                    ) as status_response:
+                        labels["ok"] = status_response.ok
+                        if status_response.ok:
+                            prediction = await self._safe_json_async(status_response)
+                        else:
+                            await self._log_http_error_async("Replicate prediction status", status_response)
+                polls += 1
+                self.metrics.count("replicate_polls")
+                if not labels["ok"]:
                     return None
+        finally:
+            if webhook_event is not None:
+                self._replicate_webhook_listener().release(str(prediction_id))
+
+    async def _download_generated_image_async(self, image_url: Any) -> bytes | None:
+        if not self._valid_download_url(image_url):
+            return None
 
-                chunks: list[bytes] = []
-                total = 0
-                for chunk in response.iter_content(chunk_size=64 * 1024):
-                    if not chunk:
-                        continue
-                    total += len(chunk)
-                    if total > MAX_IMAGE_BYTES:
-                        logger.error("Replicate image download exceeded %s bytes", MAX_IMAGE_BYTES)
+        try:
+            with self.metrics.stage("download", provider="Replicate") as labels:
+                labels["ok"] = False
+                async with await self._request_async("GET", image_url, "Replicate image download") as response:
+                    if not response.ok:
+                        await self._log_http_error_async("Replicate image download", response)
+                        return None
+                    if not self._valid_download_headers(response.headers):
                         return None
-                    chunks.append(chunk)
+                    image_data = await self._read_body_async(response, MAX_IMAGE_BYTES)
+                if image_data is None:
+                    logger.error("Replicate image download exceeded %s bytes", MAX_IMAGE_BYTES)
+                    return None
+                labels["ok"] = True
+                self.metrics.count("download_bytes", len(image_data))
 
-            image_data = b"".join(chunks)
             if self._valid_image_size(image_data, "Replicate"):
                 logger.info("Generated image with Replicate")
                 return image_data
@@ -433,229 +5771,442 @@ class TurkeyProvoloneBot:
             logger.error("Error downloading Replicate image: %s", exc)
         return None
 
-    def generate_sandwich_image(self, post_content: dict[str, Any] | None = None) -> Path | None:
-        """Generate a sandwich image using the first configured provider that works."""
-        image_style = post_content.get("image_style") if post_content else None
-        base_prompt = self.image_style_prompts.get(str(image_style), random.choice(self.image_prompts))
-        full_prompt = base_prompt + random.choice(self.style_additions)
+    async def _check_image_url_async(self, image_url: str) -> bool:
+        """Async counterpart of ``_check_image_url``."""
+        try:
+            with self.metrics.stage("url_check", provider="Replicate") as labels:
+                labels["ok"] = False
+                async with await self._request_async(
+                    "HEAD", image_url, "Replicate image check", allow_redirects=True
+                ) as response:
+                    if not response.ok:
+                        await self._log_http_error_async("Replicate image check", response)
+                        return False
+                    labels["ok"] = self._passthrough_headers(response.headers)
+                    return labels["ok"]
+        except (requests.RequestException, ValueError) as exc:
+            logger.warning("Error checking Replicate image URL: %s", exc)
+            return False
 
-        logger.info("Generating image with prompt: %s...", full_prompt[:100])
+    async def _generate_passthrough_with_replicate_async(
+        self, prompt: str, count: int, image_urls: list[str]
+    ) -> list[bytes]:
+        """Async counterpart of ``_generate_passthrough_with_replicate``."""
+        urls = await self.generate_image_urls_with_replicate_async(prompt, 1)
+        if not urls:
+            return []
+        if await self._check_image_url_async(urls[0]):
+            image_data = b"" if self.image_dedup == "off" else await self._download_generated_image_async(urls[0])
+            if image_data is not None:
+                image_urls.append(urls[0])
+        else:
+            image_data = await self._download_generated_image_async(urls[0])
+        return [] if image_data is None else [image_data]
 
-        image_data = None
+    def _configured_async_image_providers(self) -> list[tuple[str, AsyncImageGenerator]]:
+        providers: list[tuple[str, AsyncImageGenerator]] = []
         if self.openai_api_key:
-            image_data = self.generate_image_with_openai(full_prompt)
-        if not image_data and self.stability_api_key:
-            image_data = self.generate_image_with_stability(full_prompt)
-        if not image_data and self.replicate_api_token:
-            image_data = self.generate_image_with_replicate(full_prompt)
+            providers.append(("OpenAI", self.generate_images_with_openai_async))
+        if self.stability_api_key:
+            providers.append(("Stability AI", self.generate_images_with_stability_async))
+        if self.replicate_api_token:
+            providers.append(("Replicate", self.generate_images_with_replicate_async))
+        return providers
 
-        if not image_data:
-            logger.warning("Failed to generate image with any configured service")
-            return None
+    async def generate_images_async(self, prompt: str, count: int = 1) -> list[bytes]:
+        """Async counterpart of ``generate_images``; hedged and race modes cancel the providers that lose."""
+        images, _ = await self._generate_images_async(prompt, count)
+        return images
 
-        timestamp = datetime.now(timezone.utc).strftime("%Y%m%d_%H%M%S")
-        filename = GENERATED_IMAGE_DIR / f"sandwich_{timestamp}_{random.randrange(1000):03d}.jpg"
-        filename.write_bytes(image_data)
-        logger.info("Saved generated image: %s", filename)
-        return filename
+    async def _generate_images_async(
+        self, prompt: str, count: int, image_urls: list[str] | None = None
+    ) -> tuple[list[bytes], dict[str, Any]]:
+        """Async counterpart of ``_generate_images``."""
+        # Each call keeps its own report, since several generations can be in flight at once.
+        report: dict[str, Any] = {"mode": self.image_provider_mode, "winner": None, "attempts": []}
+        providers = self._with_passthrough(
+            self._configured_async_image_providers(), self._generate_passthrough_with_replicate_async, image_urls
+        )
+        # The router keeps its health scores in a JSON file.
+        providers = await asyncio.to_thread(self._route_image_providers, providers, report)
+        if not providers:
+            return [], report
 
-    def format_caption(self, post_content: dict[str, Any]) -> str:
-        custom_message = self._clean_message(os.getenv("CUSTOM_MESSAGE"))
-        if custom_message:
-            return custom_message
-        return self._clean_message(post_content.get("text"))
+        hedge_delay = self._hedge_delay(providers)
+        if hedge_delay is None:
+            images = await self._generate_image_serial_async(prompt, providers, count, report)
+        else:
+            images = await self._generate_image_hedged_async(prompt, providers, hedge_delay, count, report)
 
-    def post_to_facebook_with_image(self, post_content: dict[str, Any], image_path: Path | None = None) -> str | bool:
-        """Post content to Facebook page with an optional image."""
-        if not self.facebook_ready:
-            logger.error("Facebook API not available")
-            return False
+        original_bytes = sum(len(image) for image in images)
+        # Pillow releases the GIL while encoding, so recompression runs in worker threads.
+        images = list(await asyncio.gather(*(asyncio.to_thread(self.optimize_image, image) for image in images)))
+        self._finish_image_report(report, original_bytes, images)
+        return images, report
 
-        full_message = self.format_caption(post_content)
-        if not full_message:
-            logger.error("Refusing to post an empty Facebook message")
-            return False
+    async def _generate_image_serial_async(
+        self, prompt: str, providers: list[tuple[str, AsyncImageGenerator]], count: int, report: dict[str, Any]
+    ) -> list[bytes]:
+        for name, generate in providers:
+            started = time.monotonic()
+            images = await generate(prompt, count)
+            duration = time.monotonic() - started
+            if await asyncio.to_thread(self._settle_serial_attempt, name, duration, images, report):
+                return images
+        return []
 
+    async def _generate_image_hedged_async(
+        self,
+        prompt: str,
+        providers: list[tuple[str, AsyncImageGenerator]],
+        hedge_delay: float,
+        count: int,
+        report: dict[str, Any],
+    ) -> list[bytes]:
+        running: dict[asyncio.Task[list[bytes]], tuple[str, float]] = {}
+        started_at: dict[str, float] = {}
+        waiting = list(providers)
+        images: list[bytes] = []
+        next_launch = time.monotonic()
         try:
-            page_id = quote(str(self.facebook_page_id), safe="")
-            if image_path and image_path.is_file():
-                post_url = f"https://graph.facebook.com/{FACEBOOK_API_VERSION}/{page_id}/photos"
-                with image_path.open("rb") as image_file:
-                    response = self.session.post(
-                        post_url,
-                        headers={"Authorization": f"Bearer {self.facebook_access_token}"},
-                        data={"message": full_message},
-                        files={"source": image_file},
-                        timeout=DEFAULT_TIMEOUT,
-                    )
-            else:
-                post_url = f"https://graph.facebook.com/{FACEBOOK_API_VERSION}/{page_id}/feed"
-                response = self.session.post(
-                    post_url,
-                    headers={"Authorization": f"Bearer {self.facebook_access_token}"},
-                    data={"message": full_message},
-                    timeout=DEFAULT_TIMEOUT,
+            while report["winner"] is None and (waiting or running):
+                now = time.monotonic()
+                if waiting and (not running or now >= next_launch):
+                    name, generate = waiting.pop(0)
+                    logger.info("Starting image provider %s", name)
+                    running[asyncio.ensure_future(generate(prompt, count))] = (name, now)
+                    started_at[name] = now
+                    next_launch = now + hedge_delay
+                    continue
+
+                done, _ = await asyncio.wait(
+                    running,
+                    timeout=max(next_launch - now, 0.0) if waiting else None,
+                    return_when=asyncio.FIRST_COMPLETED,
                 )
+                for task in done:
+                    name, started = running.pop(task)
+                    duration = time.monotonic() - started
+                    try:
+                        result = task.result()
+                    except Exception:  # a crashed provider must not end the race
+                        logger.exception("%s image generation crashed", name)
+                        result = []
+                    if result and report["winner"] is None:
+                        report["winner"], images = name, result
+                        await asyncio.to_thread(self._record_image_attempt, name, duration, "won", report)
+                    elif result:
+                        self._record_image_attempt(name, duration, "abandoned", report)
+                    else:
+                        await asyncio.to_thread(self._record_image_attempt, name, duration, "failed", report)
+                        next_launch = time.monotonic()
+        finally:
+            # Unlike threads, losing providers can be cancelled; an unfinished Replicate prediction stays resumable.
+            for task in running:
+                task.cancel()
 
-            if response.ok:
-                response_data = self._safe_json(response)
-                post_id = response_data.get("post_id") or response_data.get("id")
-                if not post_id:
-                    logger.error("Facebook success response did not include a post id")
-                    return False
-                logger.info("Posted to Facebook: %s", post_id)
-                logger.info("Content: %s...", full_message[:60])
-                if image_path:
-                    logger.info("With image: %s", image_path)
-                self.log_activity(f"POST CREATED: {post_id} - {full_message[:50]}...")
-                return str(post_id)
-
-            self._log_http_error("Facebook post", response)
+        # Abandoned attempts leave the router's health file alone, so they are recorded on the loop.
+        self._finish_image_race(started_at, report)
+        return images
+
+    async def generate_sandwich_image_data_async(
+        self, post_content: dict[str, Any] | None = None
+    ) -> tuple[bytes | None, Path | None]:
+        """Async counterpart of ``generate_sandwich_image_data``.
+
+        The pool, cache, hash index and image files are read and written in
+        worker threads.
+        """
+        image_style, full_prompt = self._image_prompt(post_content)
+        reused = await asyncio.to_thread(self._reused_image, image_style, full_prompt)
+        if reused is not None:
+            return reused
+
+        passthrough = self.image_url_passthrough and post_content is not None
+        for _ in range(self.image_dedup_retries + 1):
+            image_urls: list[str] | None = [] if passthrough else None
+            images, report = await self._generate_images_async(full_prompt, self.image_batch_size, image_urls)
+            settled = await asyncio.to_thread(
+                self._settle_generated_images, post_content, image_style, full_prompt, images, report, image_urls
+            )
+            if settled is not None:
+                return settled
+        logger.warning("Every regenerated image was a near-duplicate; posting without an image")
+        return None, None
+
+    async def post_to_facebook_with_image_async(
+        self,
+        post_content: dict[str, Any],
+        image_path: Path | None = None,
+        image_data: bytes | None = None,
+        page_id: str | None = None,
+        publish_at: datetime | None = None,
+    ) -> str | bool:
+        """Async counterpart of ``post_to_facebook_with_image``."""
+        page_id = page_id or self.facebook_page_id
+        ready = await self.setup_facebook_async()
+        access_token = self.page_access_tokens.get(str(page_id))
+        if not ready or not access_token:
+            logger.error("Facebook API not available for page %s", page_id)
+            return False
+
+        fields = self._post_fields(post_content, publish_at)
+        if fields is None:
             return False
+        image_url = self._passthrough_url(post_content, image_path, image_data)
+        try:
+            if image_url:
+                post_id = await self._send_post_async(page_id, access_token, fields, image_url=image_url)
+                if post_id is not None:
+                    return post_id
+                logger.warning("Facebook did not accept the image URL; uploading the image instead")
+                image_data = await self._download_generated_image_async(image_url)
+                if not image_data:
+                    logger.warning("Could not download the image either; posting without it")
+            return await self._send_post_async(page_id, access_token, fields, image_path, image_data) or False
         except requests.RequestException as exc:
             logger.error("Error posting to Facebook: %s", exc)
             return False
 
-    def create_and_post(self) -> None:
-        """Generate and post a random turkey and provolone post with an AI image."""
-        logger.info("Creating post at %s", datetime.now(timezone.utc).isoformat())
+    async def _send_post_async(
+        self,
+        page_id: str | None,
+        access_token: str,
+        fields: dict[str, str],
+        image_path: Path | None = None,
+        image_data: bytes | None = None,
+        image_url: str | None = None,
+    ) -> str | bool | None:
+        """Async counterpart of ``_send_post``."""
+        with ExitStack() as stack:
+            url, stage, request = self._post_request(
+                stack, page_id, access_token, fields, image_path, image_data, image_url
+            )
+            kind = self._upload_labels(url, image_url)
+            with self.metrics.stage("facebook_upload", page_id=page_id, **kind) as labels:
+                async with await self._request_async("POST", url, stage, idempotent=False, **request) as response:
+                    labels["ok"] = response.ok
+                    if isinstance(request["data"], MultipartStream):
+                        self.metrics.count("upload_bytes", len(request["data"]))
+                    if not response.ok:
+                        await self._log_http_error_async(stage, response)
+                        return None
+                    response_data = await self._safe_json_async(response)
+        # Recording the post appends to the activity log.
+        return await asyncio.to_thread(
+            self._post_result, page_id, response_data, fields["message"], image_path, image_data
+        )
 
-        post_content = self.generate_random_sandwich_post()
-        image_path = self.generate_sandwich_image(post_content)
-        post_id = self.post_to_facebook_with_image(post_content, image_path)
+    async def post_to_pages_async(
+        self,
+        post_content: dict[str, Any],
+        image_path: Path | None = None,
+        image_data: bytes | None = None,
+    ) -> dict[str, str | bool]:
+        """Async counterpart of ``post_to_pages``.
 
-        if post_id:
-            logger.info("Post successful")
-            self.store_recent_post(str(post_id))
-        else:
-            logger.error("Post failed; content saved for later")
-            self.save_failed_post(post_content)
+        Photo uploads to every page are gathered, and all posts on this bot
+        share one PAGE_CONCURRENCY limit. Text-only posts to several pages go
+        out as Graph batch requests.
+        """
+        results: dict[str, str | bool] = {page_id: False for page_id in self.facebook_page_ids}
+        if not await self.setup_facebook_async():
+            logger.error("Facebook API not available")
+            return results
+        pages = [page_id for page_id in self.facebook_page_ids if page_id in self.page_access_tokens]
+        has_image = bool(image_data or post_content.get("image_url")) or bool(image_path and image_path.is_file())
 
-    def load_sandwich_shops(self) -> None:
-        """Load sandwich shops from a local JSON file."""
-        if not SHOP_FILE.exists():
-            return
+        if len(pages) > 1 and not has_image:
+            results.update(await self._post_feed_batch_async(post_content, pages))
+            return results
 
-        try:
-            with SHOP_FILE.open("r", encoding="utf-8") as file:
-                loaded_shops = json.load(file)
-        except (OSError, json.JSONDecodeError) as exc:
-            logger.warning("Error loading shops: %s", exc)
-            return
+        async def post(page_id: str) -> str | bool:
+            async with self._page_semaphore:
+                return await self.post_to_facebook_with_image_async(post_content, image_path, image_data, page_id)
 
-        if not isinstance(loaded_shops, list):
-            logger.warning("Ignoring sandwich shop file because it does not contain a list")
-            return
+        outcomes = await asyncio.gather(*(post(page_id) for page_id in pages), return_exceptions=True)
+        for page_id, outcome in zip(pages, outcomes):
+            if isinstance(outcome, BaseException):  # one broken page must not hide the others' results
+                logger.error("Unexpected error posting to page %s", page_id, exc_info=outcome)
+            else:
+                results[page_id] = outcome
+        return results
 
-        existing_names = {shop["name"].lower() for shop in self.sandwich_shops}
-        new_shops = []
-        for shop in loaded_shops:
-            if not isinstance(shop, dict) or not isinstance(shop.get("name"), str):
-                continue
-            name = shop["name"].strip()
-            if not name or name.lower() in existing_names:
-                continue
-            cleaned_shop = {str(key): str(value) for key, value in shop.items() if value is not None}
-            cleaned_shop["name"] = name
-            new_shops.append(cleaned_shop)
-            existing_names.add(name.lower())
+    async def _post_feed_batch_async(self, post_content: dict[str, Any], pages: list[str]) -> dict[str, str | bool]:
+        full_message = self.format_caption(post_content)
+        if not full_message:
+            logger.error("Refusing to post an empty Facebook message")
+            return {page_id: False for page_id in pages}
 
-        self.sandwich_shops.extend(new_shops)
-        logger.info("Loaded %s shops from file", len(new_shops))
+        try:
+            responses = await self._graph_batch_async(
+                self._feed_batch_operations(full_message, pages),
+                str(self.facebook_access_token),
+                "Facebook batch post",
+            )
+        except requests.RequestException as exc:
+            logger.error("Error posting to Facebook: %s", exc)
+            return {page_id: False for page_id in pages}
+        return await asyncio.to_thread(self._feed_batch_results, full_message, pages, responses)
 
-    def generate_random_sandwich_post(self) -> dict[str, Any]:
-        """Generate a brainrot/Gen Alpha sandwich caption."""
-        bread = random.choice(self.bread_types)
-        addon = random.choice(self.add_ons)
-        condiment = random.choice(self.condiments)
-        template = random.choice(self.caption_templates)
-        caption = template.format(bread=bread, addon=addon, condiment=condiment)
+    async def prepare_post_async(self) -> tuple[dict[str, Any], Path | None, bytes | None]:
+        """Async counterpart of ``prepare_post``."""
+        with self.metrics.stage("caption"):
+            # Caption rotation state and the shop file live on disk.
+            post_content = await asyncio.to_thread(self.generate_post)
+        with self.metrics.stage("image", image_style=post_content.get("image_style")) as labels:
+            image_data, image_path = await self.generate_sandwich_image_data_async(post_content)
+            labels["ok"] = bool(image_data or image_path)
+        return post_content, image_path, image_data
 
-        return {
-            "text": caption,
-            "image_style": random.choice(list(self.image_style_prompts)),
-            "ingredients": {
-                "bread": bread,
-                "addon": addon,
-                "condiment": condiment,
-            },
-        }
+    async def publish_post_async(
+        self, post_content: dict[str, Any], image_path: Path | None, image_data: bytes | None = None
+    ) -> bool:
+        """Async counterpart of ``publish_post``."""
+        results = await self.post_to_pages_async(post_content, image_path, image_data)
+        # Post history and the failed-post queue are SQLite databases.
+        return await asyncio.to_thread(self._record_publish_results, post_content, results, image_path, image_data)
 
-    def log_activity(self, message: str) -> None:
-        """Log activities to a file."""
-        try:
-            timestamp = datetime.now(timezone.utc).isoformat()
-            log_entry = f"[{timestamp}] {self._clean_message(message, limit=500)}\n"
-            with (LOG_DIR / "sandwich_shop_activity.log").open("a", encoding="utf-8") as file:
-                file.write(log_entry)
-            logger.info("%s", message)
-        except OSError as exc:
-            logger.error("Error logging activity: %s", exc)
+    async def create_and_post_async(self) -> bool:
+        """Async counterpart of ``create_and_post``; returns whether every page got the post."""
+        logger.info("Creating post at %s", datetime.now(timezone.utc).isoformat())
+        return await self.publish_post_async(*await self.prepare_post_async())
 
-    def store_recent_post(self, post_id: str) -> None:
-        """Store recent post ID for comment monitoring."""
-        recent_posts_file = LOG_DIR / "recent_posts.json"
-        recent_posts: list[dict[str, Any]] = []
+    async def create_and_post_many(self, count: int) -> list[bool]:
+        """Prepare and publish ``count`` posts concurrently, returning each post's outcome.
 
-        if recent_posts_file.exists():
-            try:
-                with recent_posts_file.open("r", encoding="utf-8") as file:
-                    loaded_posts = json.load(file)
-                if isinstance(loaded_posts, list):
-                    recent_posts = [post for post in loaded_posts if isinstance(post, dict)]
-            except (OSError, json.JSONDecodeError) as exc:
-                logger.warning("Ignoring unreadable recent posts file: %s", exc)
+        At most GENERATION_CONCURRENCY posts generate images at a time, and
+        each post is published as soon as its image is ready.
+        """
 
-        recent_posts.append(
-            {
-                "post_id": post_id,
-                "timestamp": datetime.now(timezone.utc).isoformat(),
-                "checked": False,
-            }
-        )
-        self._atomic_write_json(recent_posts_file, recent_posts[-10:])
+        async def create_and_post() -> bool:
+            async with self._generation_semaphore:
+                prepared = await self.prepare_post_async()
+            return await self.publish_post_async(*prepared)
 
-    def save_failed_post(self, post_content: dict[str, Any]) -> None:
-        """Save failed posts to a file for later review."""
-        try:
-            timestamp = datetime.now(timezone.utc).strftime("%Y%m%d_%H%M%S")
-            filename = SAVED_POST_DIR / f"failed_post_{timestamp}.json"
-            payload = {
-                "text": self._clean_message(post_content.get("text")),
-                "image_style": post_content.get("image_style"),
-                "ingredients": post_content.get("ingredients"),
-                "timestamp": datetime.now(timezone.utc).isoformat(),
-            }
-            self._atomic_write_json(filename, payload)
-            logger.info("Post saved to: %s", filename)
-        except OSError as exc:
-            logger.error("Error saving post: %s", exc)
+        outcomes = await asyncio.gather(*(create_and_post() for _ in range(count)), return_exceptions=True)
+        results = []
+        for outcome in outcomes:
+            if isinstance(outcome, BaseException):
+                logger.error("Unexpected error creating a post", exc_info=outcome)
+            results.append(outcome is True)
+        return results
 
-    def run_single_post(self) -> None:
-        """Run a single post, which is suitable for GitHub Actions."""
-        logger.info("Turkey and Provolone Bot - Single Post Mode with AI Images")
-        logger.info("=" * 60)
-        self.create_and_post()
-        logger.info("Single post execution completed")
+    async def run_concurrent_posts(self, count: int) -> bool:
+        """Create ``count`` posts at once and write the run report; True when every post succeeded."""
+        logger.info("Turkey and Provolone Bot - Async Mode, %s post(s)", count)
+        if self.deadline is None:
+            self.start_deadline()
+        if not await self.setup_facebook_async():
+            logger.error("Facebook API not available")
+            return False
+        with self.profiled("async"):
+            results = await self.create_and_post_many(count)
+        self.write_run_report("async")
+        logger.info("Async run finished: %s of %s post(s) succeeded", sum(results), len(results))
+        return all(results)
+
+
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Turkey and Provolone Facebook Bot with AI Images")
+    parser.add_argument(
+        "--refill-pool",
+        type=int,
+        metavar="N",
+        help="generate images until every image style has N pooled images, then exit",
+    )
+    parser.add_argument(
+        "--retry-failed",
+        action="store_true",
+        help="replay queued failed posts with bounded concurrency, then exit",
+    )
+    parser.add_argument(
+        "--poll-comments",
+        action="store_true",
+        help="fetch new comments and engagement for recent posts, then exit",
+    )
+    parser.add_argument(
+        "--report-summary",
+        action="store_true",
+        help="print stage latency percentiles from the run reports in reports/, then exit",
+    )
+    parser.add_argument(
+        "--async-posts",
+        type=int,
+        metavar="N",
+        help="prepare and publish N posts concurrently on one asyncio event loop (needs aiohttp), then exit",
+    )
+    parser.add_argument(
+        "--schedule-posts",
+        type=int,
+        metavar="N",
+        help="prepare N posts and schedule them on Facebook for the next POST_SCHEDULE times, then exit",
+    )
+    parser.add_argument(
+        "--validate-only",
+        action="store_true",
+        help="check Facebook and OpenAI credentials, reusing cached results, then exit",
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="write CPU, allocation and HTTP profiles of the run to reports/ (same as PROFILE=1)",
+    )
+    return parser.parse_args(argv)
 
 
-def main() -> int:
+def main(argv: list[str] | None = None) -> int:
     """CLI entry point."""
+    args = parse_args(argv)
+    if args.profile:
+        os.environ["PROFILE"] = "1"
+    configure_logging()
+    ensure_directories()
     print("Turkey and Provolone Facebook Bot with AI Images")
     print("=" * 50)
 
+    if args.report_summary:
+        summary = summarize_reports(REPORT_DIR)
+        if not summary:
+            print("No run reports found in reports/")
+        for key, stats in summary.items():
+            print(
+                f"{key}: n={stats['count']} p50={stats['p50']:.3f}s p90={stats['p90']:.3f}s "
+                f"p99={stats['p99']:.3f}s max={stats['max']:.3f}s"
+            )
+        return 0
+
     required_vars = ["FACEBOOK_ACCESS_TOKEN", "FACEBOOK_PAGE_ID"]
     optional_vars = ["OPENAI_API_KEY", "STABILITY_API_KEY", "REPLICATE_API_TOKEN"]
 
     missing_vars = [var for var in required_vars if not os.getenv(var)]
+    if "FACEBOOK_PAGE_ID" in missing_vars and os.getenv("FACEBOOK_PAGE_IDS"):
+        missing_vars.remove("FACEBOOK_PAGE_ID")
     available_ai_services = [var for var in optional_vars if os.getenv(var)]
 
+    if args.refill_pool is not None:
+        if not available_ai_services:
+            print("No AI image generation services configured; cannot refill the image pool.")
+            return 1
+        bot = TurkeyProvoloneBot()
+        bot.start_deadline()
+        with bot.profiled("refill"):
+            added = bot.refill_image_pool(max(args.refill_pool, 0))
+        bot.write_run_report("refill")
+        print(f"Added {sum(added.values())} image(s) to the pool")
+        return 0
+
     if missing_vars:
         print("Missing required environment variables:")
         for var in missing_vars:
             print(f"   - {var}")
         return 1
 
+    if args.validate_only:
+        valid = TurkeyProvoloneBot().validate_credentials()
+        print("Credentials validated." if valid else "Credential validation failed.")
+        return 0 if valid else 1
+
     if not available_ai_services:
         print("No AI image generation services configured.")
         print("The bot will post text-only content without images.")
@@ -664,14 +6215,75 @@ def main() -> int:
         for var in available_ai_services:
             print(f"   - {var}")
 
+    if args.async_posts is not None:
+        if load_aiohttp() is None:
+            print("--async-posts needs aiohttp: pip install aiohttp")
+            return 1
+
+        async def run_async_posts() -> bool:
+            async with AsyncTurkeyProvoloneBot() as async_bot:
+                return await async_bot.run_concurrent_posts(max(args.async_posts, 1))
+
+        return 0 if asyncio.run(run_async_posts()) else 1
+
     bot = TurkeyProvoloneBot()
+    bot.start_deadline()
     if not bot.facebook_ready:
         print("Cannot start bot because Facebook API is not ready")
         return 1
 
     run_mode = os.getenv("RUN_MODE", "single").strip().lower()
+    if args.retry_failed:
+        concurrency = int(TurkeyProvoloneBot._get_float_env("RETRY_CONCURRENCY", RETRY_CONCURRENCY))
+        with bot.profiled("retry"):
+            counts = bot.retry_failed_posts(max_workers=concurrency)
+        bot.write_run_report("retry")
+        print(f"Retried failed posts: {counts['posted']} posted, {counts['failed']} failed")
+        return 0 if counts["failed"] == 0 else 1
+
+    if args.poll_comments:
+        concurrency = int(TurkeyProvoloneBot._get_float_env("POLL_CONCURRENCY", POLL_CONCURRENCY))
+        with bot.profiled("poll"):
+            counts = bot.poll_engagement(max_workers=concurrency)
+        bot.write_run_report("poll")
+        print(f"Polled {counts['posts']} post(s): {counts['comments']} new comment(s), {counts['checked']} checked")
+        return 0 if counts["errors"] == 0 else 1
+
+    if args.schedule_posts is not None:
+        try:
+            schedule = CronSchedule(os.getenv("POST_SCHEDULE") or DEFAULT_POST_SCHEDULE)
+        except ValueError as exc:
+            print(f"Invalid POST_SCHEDULE: {exc}")
+            return 1
+        with bot.profiled("schedule"):
+            counts = bot.schedule_posts(max(args.schedule_posts, 1), schedule)
+        bot.write_run_report("schedule")
+        print(f"Scheduled {counts['scheduled']} post(s), {counts['failed']} failed")
+        return 0 if counts["failed"] == 0 else 1
+
+    if run_mode == "scheduled":
+        try:
+            schedule = CronSchedule(os.getenv("POST_SCHEDULE") or DEFAULT_POST_SCHEDULE)
+        except ValueError as exc:
+            print(f"Invalid POST_SCHEDULE: {exc}")
+            return 1
+
+        stop_event = threading.Event()
+
+        def request_shutdown(signum: int, _frame: Any) -> None:
+            logger.info("Received signal %s; shutting down after the current step", signum)
+            stop_event.set()
+
+        signal.signal(signal.SIGTERM, request_shutdown)
+        signal.signal(signal.SIGINT, request_shutdown)
+        bot.run_scheduled(
+            schedule,
+            stop_event,
+            lead_seconds=TurkeyProvoloneBot._get_float_env("IMAGE_LEAD_SECONDS", IMAGE_LEAD_SECONDS),
+        )
+        return 0
     if run_mode != "single":
-        print("Scheduled mode is not implemented in this version; running one post.")
+        print(f"Unknown RUN_MODE {run_mode!r}; running one post.")
 
     bot.run_single_post()
     return 0
@@ -0,0 +1,67 @@
+"""Fixtures shared by the tests: bench.py's fake API server and bots pointed at it."""
+
+from __future__ import annotations
+
+import os
+import shutil
+import sys
+import tempfile
+import threading
+from pathlib import Path
+from typing import Any, Callable, Iterator
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path[:0] = [str(ROOT), str(ROOT / "benchmarks")]
+# Runtime file paths are fixed when sandwiches is imported, so they must point at a scratch directory first.
+DATA_DIR = Path(tempfile.mkdtemp(prefix="sandwich-tests-"))
+os.environ["SANDWICH_DATA_DIR"] = str(DATA_DIR)
+
+
+@pytest.fixture(autouse=True)
+def isolated_run() -> Iterator[None]:
+    """Undo environment changes and clear the runtime files (health, usage, history) each test leaves behind."""
+    saved = os.environ.copy()
+    yield
+    os.environ.clear()
+    os.environ.update(saved)
+    for path in DATA_DIR.iterdir():
+        if path.is_dir():
+            shutil.rmtree(path, ignore_errors=True)
+        else:
+            path.unlink(missing_ok=True)
+
+
+@pytest.fixture
+def fake_api(tmp_path: Path) -> Iterator[Callable[..., Any]]:
+    """Start bench.py's FakeApiServer with the given options and point the environment at it."""
+    import bench
+
+    servers = []
+
+    def start(**options: Any) -> Any:
+        server = bench.FakeApiServer(**options)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        bench.configure_environment(server, tmp_path, save_images=False)
+        return server
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+@pytest.fixture
+def make_bot() -> Callable[..., Any]:
+    """Build a TurkeyProvoloneBot from the environment plus ``env``, allowed to download from the fake server."""
+    import sandwiches
+
+    def build(**env: str) -> Any:
+        os.environ.update(env)
+        bot = sandwiches.TurkeyProvoloneBot()
+        bot.allowed_download_schemes = frozenset({"http", "https"})
+        return bot
+
+    return build
@@ -0,0 +1,95 @@
+"""AsyncTurkeyProvoloneBot against the fake APIs: parity with the blocking post path, and no file I/O on the loop."""
+
+from __future__ import annotations
+
+import asyncio
+import os
+import threading
+from datetime import datetime, timedelta, timezone
+from typing import Any
+
+import pytest
+
+import sandwiches
+
+pytest.importorskip("aiohttp")
+
+
+async def run_bot(operation, **env: str) -> Any:
+    os.environ.update(env)
+    async with sandwiches.AsyncTurkeyProvoloneBot() as bot:
+        bot.allowed_download_schemes = frozenset({"http", "https"})
+        return bot, await operation(bot)
+
+
+def test_post_passes_the_image_url_and_schedule(fake_api):
+    server = fake_api()
+    image_url = f"{server.base_url}/files/sandwich.png"
+    publish_at = datetime.now(timezone.utc).replace(microsecond=0) + timedelta(hours=1)
+
+    def post(bot):
+        return bot.post_to_facebook_with_image_async(
+            {"text": "Turkey and provolone", "image_url": image_url}, publish_at=publish_at
+        )
+
+    _, post_id = asyncio.run(run_bot(post))
+
+    assert post_id
+    [(path, fields)] = server.graph_posts
+    assert path.endswith("/1000/photos")
+    assert fields["url"] == image_url
+    assert fields["published"] == "false"
+    assert fields["scheduled_publish_time"] == str(int(publish_at.timestamp()))
+
+
+def test_replicate_passthrough_posts_the_output_url(fake_api):
+    server = fake_api()
+
+    bot, posted = asyncio.run(
+        run_bot(
+            lambda bot: bot.create_and_post_async(),
+            REPLICATE_API_TOKEN="test",
+            IMAGE_URL_PASSTHROUGH="1",
+            IMAGE_DEDUP="off",
+        )
+    )
+
+    assert posted
+    [(path, fields)] = server.graph_posts
+    assert path.endswith("/1000/photos")
+    assert fields["url"].startswith(f"{server.base_url}/files/")
+    assert bot.last_image_report["winner"] == "Replicate"
+
+
+def test_pool_cache_routing_and_history_run_in_worker_threads(fake_api, monkeypatch):
+    server = fake_api()
+    calls: list[str] = []
+    loop_threads: list[str] = []
+
+    def watch(cls: type, name: str) -> None:
+        method = getattr(cls, name)
+
+        def watched(*args: Any, **kwargs: Any) -> Any:
+            calls.append(name)
+            if threading.current_thread() is threading.main_thread():
+                loop_threads.append(name)
+            return method(*args, **kwargs)
+
+        monkeypatch.setattr(cls, name, watched)
+
+    for name in ("generate_post", "_reusable_image", "_keep_generated_images", "_record_publish_results"):
+        watch(sandwiches.TurkeyProvoloneBot, name)
+    watch(sandwiches.ProviderRouter, "order")
+
+    _, posted = asyncio.run(run_bot(lambda bot: bot.create_and_post_async(), OPENAI_API_KEY="test"))
+
+    assert posted
+    assert [path.rsplit("/", 1)[1] for path, _ in server.graph_posts] == ["photos"]
+    assert set(calls) == {
+        "generate_post",
+        "_reusable_image",
+        "_keep_generated_images",
+        "_record_publish_results",
+        "order",
+    }
+    assert loop_threads == []
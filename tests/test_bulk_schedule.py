@@ -0,0 +1,128 @@
+"""Bulk scheduling with scheduled_publish_time against the fake Graph API."""
+
+from __future__ import annotations
+
+import threading
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import sandwiches
+from sandwiches import CronSchedule
+
+HOURLY = CronSchedule("0 * * * *")
+FEED = f"/graph/{sandwiches.FACEBOOK_API_VERSION}/1000/feed"
+
+
+@pytest.fixture
+def no_retry_sleep(monkeypatch) -> list[float]:
+    waits: list[float] = []
+    monkeypatch.setattr(sandwiches.time, "sleep", waits.append)
+    return waits
+
+
+def publish_times(server) -> list[datetime]:
+    return sorted(
+        datetime.fromtimestamp(int(fields["scheduled_publish_time"]), timezone.utc) for _, fields in server.graph_posts
+    )
+
+
+def expected_slots(count: int, lead: float) -> list[datetime]:
+    moment = datetime.now(timezone.utc) + timedelta(seconds=lead)
+    slots = []
+    for _ in range(count):
+        moment = HOURLY.next_after(moment)
+        slots.append(moment)
+    return slots
+
+
+def test_posts_fill_the_next_schedule_times(fake_api, make_bot):
+    server = fake_api()
+    bot = make_bot()
+
+    # Without a run deadline the first slot is at least 10 minutes plus 3 x 10 minutes of upload time ahead.
+    expected = expected_slots(3, sandwiches.SCHEDULE_MIN_LEAD * 4)
+    counts = bot.schedule_posts(3, HOURLY)
+
+    assert counts == {"scheduled": 3, "failed": 0}
+    assert publish_times(server) == expected
+    for path, fields in server.graph_posts:
+        assert path.endswith("/1000/feed")
+        assert fields["published"] == "false"
+
+
+def test_slots_honour_the_remaining_run_budget(fake_api, make_bot):
+    fake_api()
+    bot = make_bot()
+    assert bot.facebook_ready
+    bot.start_deadline(120)
+
+    [(first, pages)] = bot.schedule_slots(1, HOURLY)
+
+    assert pages == ["1000"]
+    assert first == expected_slots(1, sandwiches.SCHEDULE_MIN_LEAD + 120)[0]
+
+
+def test_scheduled_ids_are_persisted_and_their_times_skipped(fake_api, make_bot):
+    server = fake_api()
+    bot = make_bot()
+    bot.schedule_posts(2, HOURLY)
+    first_run = publish_times(server)
+
+    rows = bot.post_history.scheduled()
+    assert [row["page_id"] for row in rows] == ["1000", "1000"]
+    assert [datetime.fromisoformat(row["publish_at"]) for row in rows] == first_run
+    assert all(row["post_id"].startswith("1000_") for row in rows)
+
+    assert make_bot().schedule_posts(2, HOURLY) == {"scheduled": 2, "failed": 0}
+    second_run = publish_times(server)[2:]
+    assert second_run == [first_run[-1] + timedelta(hours=hours) for hours in (1, 2)]
+
+
+def test_a_failed_upload_is_retried_on_its_own(fake_api, make_bot, no_retry_sleep):
+    server = fake_api()
+    server.scripted_errors.append((FEED, 500, {}))
+    bot = make_bot(GENERATION_CONCURRENCY="1", PAGE_CONCURRENCY="1")
+
+    counts = bot.schedule_posts(3, HOURLY)
+
+    assert counts == {"scheduled": 3, "failed": 0}
+    assert len(no_retry_sleep) == 1
+    assert len(server.graph_posts) == 3
+    assert len(bot.post_history.scheduled()) == 3
+
+
+def test_an_upload_that_keeps_failing_is_counted(fake_api, make_bot, no_retry_sleep):
+    server = fake_api()
+    server.scripted_errors += [(FEED, 500, {})] * sandwiches.SCHEDULE_UPLOAD_ATTEMPTS
+    bot = make_bot(GENERATION_CONCURRENCY="1", PAGE_CONCURRENCY="1")
+
+    counts = bot.schedule_posts(2, HOURLY)
+
+    assert counts == {"scheduled": 1, "failed": 1}
+    assert len(no_retry_sleep) == sandwiches.SCHEDULE_UPLOAD_ATTEMPTS - 1
+    assert len(bot.post_history.scheduled()) == 1
+
+
+def test_uploads_respect_the_page_concurrency_limit(fake_api, make_bot, monkeypatch):
+    fake_api(latency=0.05)
+    bot = make_bot(PAGE_CONCURRENCY="2", GENERATION_CONCURRENCY="4")
+    lock = threading.Lock()
+    in_flight = [0]
+    peak = [0]
+    original = sandwiches.TurkeyProvoloneBot.post_to_facebook_with_image
+
+    def counted(self, *args, **kwargs):
+        with lock:
+            in_flight[0] += 1
+            peak[0] = max(peak[0], in_flight[0])
+        try:
+            return original(self, *args, **kwargs)
+        finally:
+            with lock:
+                in_flight[0] -= 1
+
+    monkeypatch.setattr(sandwiches.TurkeyProvoloneBot, "post_to_facebook_with_image", counted)
+
+    assert bot.schedule_posts(6, HOURLY) == {"scheduled": 6, "failed": 0}
+    assert peak[0] == 2
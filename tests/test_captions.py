@@ -0,0 +1,86 @@
+"""CaptionScheduler's no-repeat permutation and the bot's caption rotation."""
+
+from __future__ import annotations
+
+import itertools
+import json
+
+from sandwiches import CaptionScheduler
+
+
+def scheduler(tmp_path, radices=(3, 5, 7), signature="vocab", seed="seed"):
+    return CaptionScheduler(list(radices), signature, seed=seed, state_path=tmp_path / "cursor.json")
+
+
+def test_positions_map_one_to_one_onto_combinations(tmp_path):
+    captions = scheduler(tmp_path)
+    every = set(itertools.product(range(3), range(5), range(7)))
+
+    walked = [captions.next_combination() for _ in range(captions.size)]
+
+    assert captions.size == len(every) == 105
+    assert set(walked) == every
+    assert len(walked) == len(set(walked))
+    for position, combination in enumerate(walked):
+        index = captions.encode(combination)
+        assert captions.decode(index) == combination
+        assert captions._position_of(index) == position
+        assert captions.is_used(index)
+
+
+def test_order_depends_on_the_seed(tmp_path):
+    walk_a = scheduler(tmp_path / "a", seed="one").peek(20)
+    walk_b = scheduler(tmp_path / "b", seed="two").peek(20)
+    assert walk_a != walk_b
+    assert walk_a == scheduler(tmp_path / "c", seed="one").peek(20)
+
+
+def test_cursor_persists_across_instances(tmp_path):
+    captions = scheduler(tmp_path)
+    upcoming = captions.peek(10)
+    taken = [captions.next_combination() for _ in range(4)]
+
+    resumed = scheduler(tmp_path, seed=None)
+
+    assert taken == upcoming[:4]
+    assert resumed.peek(6) == upcoming[4:]
+    assert resumed.next_combination() == upcoming[4]
+    assert not resumed.is_used(resumed.encode(upcoming[5]))
+    assert json.loads((tmp_path / "cursor.json").read_text())["cursor"] == 5
+
+
+def test_changed_vocabulary_starts_a_new_cycle(tmp_path):
+    scheduler(tmp_path).next_combination()
+
+    changed = scheduler(tmp_path, radices=(3, 5, 8), signature="bigger vocab")
+
+    assert changed.is_used(0) is False
+    changed.next_combination()
+    assert json.loads((tmp_path / "cursor.json").read_text())["signature"] == "bigger vocab"
+
+
+def test_cycle_rolls_over_to_a_new_permutation(tmp_path):
+    captions = scheduler(tmp_path, radices=(4, 6))
+    first_cycle = [captions.next_combination() for _ in range(captions.size)]
+
+    second_cycle = [captions.next_combination() for _ in range(captions.size)]
+
+    assert set(second_cycle) == set(first_cycle)
+    assert second_cycle != first_cycle
+    state = json.loads((tmp_path / "cursor.json").read_text())
+    assert (state["cycle"], state["cursor"]) == (1, captions.size)
+
+
+def test_bot_reuses_its_scheduler_until_the_vocabulary_changes(make_bot):
+    bot = make_bot(CAPTION_SEED="seed")
+    captions = bot.caption_scheduler
+    [preview] = bot.preview_captions(1)
+
+    post = bot.generate_random_sandwich_post()
+
+    assert bot.caption_scheduler is captions
+    assert post == preview
+    assert bot.caption_used(post)
+    bot.add_ons.append("pickled onions")
+    assert bot.caption_scheduler is not captions
+    assert bot.caption_scheduler.radices[2] == len(bot.add_ons)
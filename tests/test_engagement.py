@@ -0,0 +1,82 @@
+"""Comment and engagement polling against the fake Graph API: paging cursors and the ``since`` fallback."""
+
+from __future__ import annotations
+
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any
+
+import pytest
+
+import sandwiches
+
+POST_ID = "1000_1"
+START = datetime.now(timezone.utc).replace(microsecond=0) - timedelta(hours=1)
+
+
+def comment(number: int) -> dict[str, Any]:
+    created = START + timedelta(minutes=number)
+    return {
+        "id": f"c{number}",
+        "from": {"name": "Sandwich fan"},
+        "message": f"Comment {number}",
+        "created_time": created.strftime("%Y-%m-%dT%H:%M:%S+0000"),
+    }
+
+
+@pytest.fixture
+def server(fake_api, monkeypatch):
+    monkeypatch.setattr(sandwiches, "POLL_COMMENT_PAGE_SIZE", 3)
+    server = fake_api()
+    server.comments[POST_ID] = [comment(number) for number in range(7)]
+    return server
+
+
+@pytest.fixture
+def bot(server, make_bot):
+    bot = make_bot()
+    bot.post_history.add(POST_ID, "1000", posted_at=time.time() - 2 * 3600)
+    return bot
+
+
+def stored_comments(bot) -> list[str]:
+    return [row["comment_id"] for row in bot.post_history.comments(POST_ID)]
+
+
+def test_follows_comment_pages_and_resumes_from_the_cursor(server, bot):
+    counts = bot.poll_engagement()
+
+    assert counts == {"posts": 1, "comments": 7, "checked": 0, "errors": 0}
+    assert [query.get("after") for query in server.comment_queries] == [None, "3", "6"]
+    assert stored_comments(bot) == [f"c{number}" for number in range(7)]
+
+    server.comments[POST_ID].append(comment(7))
+    server.comment_queries.clear()
+    counts = bot.poll_engagement()
+
+    assert counts["comments"] == 1
+    assert [query.get("after") for query in server.comment_queries] == ["7"]
+    assert stored_comments(bot) == [f"c{number}" for number in range(8)]
+
+
+def test_without_a_cursor_asks_only_for_comments_since_the_newest_seen(server, bot):
+    newest_seen = (START + timedelta(minutes=4)).timestamp()
+    checkpoint = {
+        "post_id": POST_ID,
+        "comments_after": None,
+        "comments_since": newest_seen,
+        "engagement": None,
+        "polled_at": time.time(),
+    }
+    bot.post_history.save_poll([checkpoint], [], [])
+
+    counts = bot.poll_engagement()
+
+    assert counts["comments"] == 3
+    assert [(query.get("since"), query.get("after")) for query in server.comment_queries] == [
+        (str(int(newest_seen)), None)
+    ]
+    assert stored_comments(bot) == ["c4", "c5", "c6"]
+    target = bot.post_history.poll_targets()[0]
+    assert target["comments_after"] == "7"
+    assert target["comments_since"] == (START + timedelta(minutes=6)).timestamp()
@@ -0,0 +1,95 @@
+"""FailedPostQueue leasing and backoff, and retry_failed_posts against the fake Graph API."""
+
+from __future__ import annotations
+
+import sqlite3
+import threading
+import time
+
+import sandwiches
+from sandwiches import FailedPostQueue
+
+
+def row(queue: FailedPostQueue, item_id: int) -> sqlite3.Row:
+    with sqlite3.connect(queue.path) as connection:
+        connection.row_factory = sqlite3.Row
+        return connection.execute("SELECT * FROM failed_posts WHERE id = ?", (item_id,)).fetchone()
+
+
+def test_claimed_rows_are_leased_until_the_lease_runs_out(tmp_path):
+    queue = FailedPostQueue(tmp_path / "failed.db")
+    first = queue.enqueue({"text": "first"})
+    second = queue.enqueue({"text": "second"})
+
+    [item] = queue.claim_due(limit=1, lease_seconds=60)
+    assert item["id"] == first
+    assert item["post_content"] == {"text": "first"}
+    assert [item["id"] for item in queue.claim_due(limit=10, lease_seconds=60)] == [second]
+    assert queue.claim_due(limit=10) == []
+    assert queue.pending_count() == 2
+
+    # A worker that died mid-retry leaves its lease to expire; the row then comes back.
+    with sqlite3.connect(queue.path) as connection:
+        connection.execute("UPDATE failed_posts SET next_retry_at = ? WHERE id = ?", (time.time() - 1, first))
+    assert [item["id"] for item in queue.claim_due(limit=10)] == [first]
+
+
+def test_failures_back_off_exponentially_then_give_up(tmp_path):
+    queue = FailedPostQueue(tmp_path / "failed.db", max_attempts=4, base_delay=100, max_delay=250)
+    item_id = queue.enqueue({"text": "flaky"})
+
+    for attempts, delay in ((1, 100), (2, 200), (3, 250)):
+        before = time.time()
+        queue.mark_failed(item_id, "Facebook post failed")
+        state = row(queue, item_id)
+        assert state["attempts"] == attempts
+        assert state["status"] == "pending"
+        assert state["last_error"] == "Facebook post failed"
+        # Jittered between half the delay and the full delay.
+        assert before + delay / 2 <= state["next_retry_at"] <= time.time() + delay
+        assert queue.claim_due(limit=10) == []
+
+    queue.mark_failed(item_id, "Facebook post failed")
+    assert row(queue, item_id)["status"] == "dead"
+    assert queue.pending_count() == 0
+
+
+def test_two_workers_never_claim_the_same_row(tmp_path):
+    path = tmp_path / "failed.db"
+    ids = {FailedPostQueue(path).enqueue({"text": f"post {number}"}) for number in range(200)}
+    claimed: list[list[int]] = [[], []]
+    start = threading.Barrier(2)
+
+    def worker(index: int) -> None:
+        queue = FailedPostQueue(path)
+        start.wait()
+        while batch := queue.claim_due(limit=3):
+            claimed[index].extend(item["id"] for item in batch)
+
+    threads = [threading.Thread(target=worker, args=(index,)) for index in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert not set(claimed[0]) & set(claimed[1])
+    assert sorted(claimed[0] + claimed[1]) == sorted(ids)
+
+
+def test_retry_failed_posts_marks_posted_and_failed(fake_api, make_bot, monkeypatch):
+    server = fake_api()
+    bot = make_bot()
+    good = bot.failed_posts.enqueue({"text": "Turkey and provolone", "page_id": "1000"})
+    bad = bot.failed_posts.enqueue({"text": "Turkey and provolone", "page_id": "2000"})
+    original = sandwiches.TurkeyProvoloneBot.post_to_facebook_with_image
+
+    def post(self, post_content, image_path=None, page_id=None, **kwargs):
+        return original(self, post_content, image_path, page_id=page_id, **kwargs) if page_id == "1000" else None
+
+    monkeypatch.setattr(sandwiches.TurkeyProvoloneBot, "post_to_facebook_with_image", post)
+
+    assert bot.retry_failed_posts(max_workers=2) == {"posted": 1, "failed": 1}
+    assert row(bot.failed_posts, good)["status"] == "posted"
+    assert row(bot.failed_posts, good)["post_id"]
+    assert row(bot.failed_posts, bad)["attempts"] == 1
+    assert [path.rsplit("/", 2)[1] for path, _ in server.graph_posts] == ["1000"]
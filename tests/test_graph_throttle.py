@@ -0,0 +1,32 @@
+"""Graph API pacing driven by the fake server's scripted usage headers (bench.py ``--graph-usage``)."""
+
+from __future__ import annotations
+
+import time
+
+import sandwiches
+
+RATE = 10.0
+
+
+def test_calls_slow_down_as_reported_usage_rises(fake_api, make_bot, monkeypatch):
+    # The setup batch and each post get the next reading; the last one repeats.
+    fake_api(graph_usage=[0, 50, 80, 85, 90, 95])
+    bot = make_bot(GRAPH_THROTTLE_RATE=str(RATE), GRAPH_THROTTLE_BURST="1")
+    pauses: list[float] = []
+    sleep = time.sleep
+    monkeypatch.setattr(sandwiches.time, "sleep", lambda seconds: (pauses.append(seconds), sleep(seconds)))
+    assert bot.facebook_ready
+
+    waits = []
+    for number in range(7):
+        pauses.clear()
+        assert bot.post_to_facebook_with_image({"text": f"Turkey and provolone #{number}"})
+        waits.append(sum(pauses))
+
+    # Below the 75% threshold calls are not paced, and the first paced call spends the one-call burst.
+    assert waits[:3] == [0, 0, 0]
+    # Above it the bucket refills at RATE scaled by the remaining headroom: 15%, 10%, then 5% of 25%.
+    assert 0 < waits[3] < waits[4] < waits[5]
+    assert waits[5] > 0.8 * 25 / (5 * RATE)
+    assert bot.metrics.counters["graph_throttle_waits"] == 4
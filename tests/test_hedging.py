@@ -0,0 +1,48 @@
+"""Race and hedged image provider modes against the fake provider APIs."""
+
+from __future__ import annotations
+
+import threading
+import time
+
+PROMPT = "A turkey and provolone sandwich"
+
+
+def provider_threads(name: str) -> list[threading.Thread]:
+    return [thread for thread in threading.enumerate() if thread.name == f"image-{name}"]
+
+
+def test_race_stops_the_losing_replicate_poller(fake_api, make_bot):
+    # Left alone, the Replicate prediction would keep polling until REPLICATE_MAX_WAIT.
+    server = fake_api(replicate_polls=1000)
+    bot = make_bot(IMAGE_PROVIDER_MODE="race", OPENAI_API_KEY="test", REPLICATE_API_TOKEN="test")
+
+    images = bot.generate_images(PROMPT)
+
+    assert len(images) == 1
+    report = bot.last_image_report
+    assert report["winner"] == "OpenAI"
+    assert {attempt["provider"]: attempt["status"] for attempt in report["attempts"]} == {
+        "OpenAI": "won",
+        "Replicate": "abandoned",
+    }
+    deadline = time.monotonic() + 5
+    for thread in provider_threads("Replicate"):
+        thread.join(max(deadline - time.monotonic(), 0))
+        assert not thread.is_alive()
+    assert [state["polls"] for state in server.predictions.values()] == [0]
+    # The unfinished prediction is remembered, so the next run for this prompt resumes it.
+    assert bot._load_replicate_pending()
+
+
+def test_hedged_mode_waits_for_the_delay_before_the_backup(fake_api, make_bot):
+    server = fake_api()
+    bot = make_bot(
+        IMAGE_PROVIDER_MODE="hedged", IMAGE_HEDGE_DELAY="30", OPENAI_API_KEY="test", REPLICATE_API_TOKEN="test"
+    )
+
+    images = bot.generate_images(PROMPT)
+
+    assert len(images) == 1
+    assert [attempt["provider"] for attempt in bot.last_image_report["attempts"]] == ["OpenAI"]
+    assert server.predictions == {}
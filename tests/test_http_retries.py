@@ -0,0 +1,106 @@
+"""_request's retries, Retry-After handling and shared run deadline against the fake server."""
+
+from __future__ import annotations
+
+import email.utils
+import time
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import sandwiches
+from sandwiches import TurkeyProvoloneBot
+
+MODELS = "/openai/v1/models"
+
+
+@pytest.fixture
+def sleeps(monkeypatch) -> list[float]:
+    """Record the bot's retry waits instead of sleeping through them."""
+    waits: list[float] = []
+    monkeypatch.setattr(sandwiches.time, "sleep", waits.append)
+    return waits
+
+
+def test_retry_after_seconds():
+    assert TurkeyProvoloneBot._retry_delay(0, "7") == 7.0
+    assert TurkeyProvoloneBot._retry_delay(0, "1.5") == 1.5
+    assert TurkeyProvoloneBot._retry_delay(0, "-3") == 0.0
+
+
+def test_retry_after_http_date():
+    retry_at = datetime.now(timezone.utc) + timedelta(seconds=30)
+    delay = TurkeyProvoloneBot._retry_delay(0, email.utils.format_datetime(retry_at, usegmt=True))
+    assert 28 <= delay <= 30
+    past = datetime.now(timezone.utc) - timedelta(minutes=5)
+    assert TurkeyProvoloneBot._retry_delay(0, email.utils.format_datetime(past, usegmt=True)) == 0.0
+
+
+def test_invalid_retry_after_falls_back_to_jittered_backoff():
+    for attempt, ceiling in ((0, 1.0), (2, 4.0), (10, sandwiches.HTTP_RETRY_MAX_DELAY)):
+        delay = TurkeyProvoloneBot._retry_delay(attempt, "soon")
+        assert ceiling / 2 <= delay <= ceiling
+
+
+def test_server_errors_are_retried_after_retry_after(fake_api, make_bot, sleeps):
+    server = fake_api()
+    server.scripted_errors += [(MODELS, 503, {"Retry-After": "2"}), (MODELS, 429, {"Retry-After": "5"})]
+    bot = make_bot()
+
+    response = bot._request("GET", f"{server.base_url}{MODELS}", "test")
+
+    assert response.status_code == 200
+    assert sleeps == [2.0, 5.0]
+    assert bot.metrics.counters["http_retries"] == 2
+    assert server.requests == 3
+
+
+def test_retries_stop_at_the_limit(fake_api, make_bot, sleeps):
+    server = fake_api()
+    server.scripted_errors += [(MODELS, 429, {"Retry-After": "0"})] * 5
+    bot = make_bot(HTTP_MAX_RETRIES="3")
+
+    response = bot._request("GET", f"{server.base_url}{MODELS}", "test")
+
+    assert response.status_code == 429
+    assert len(sleeps) == 3
+    assert server.requests == 4
+
+
+def test_posts_retry_throttling_but_not_server_errors(fake_api, make_bot, sleeps):
+    server = fake_api()
+    url = f"{server.base_url}/openai/v1/images/generations"
+    bot = make_bot()
+
+    server.scripted_errors.append(("/openai/v1/images", 500, {}))
+    assert bot._request("POST", url, "test", idempotent=False, json={}).status_code == 500
+    assert sleeps == []
+
+    server.scripted_errors.append(("/openai/v1/images", 429, {"Retry-After": "1"}))
+    assert bot._request("POST", url, "test", idempotent=False, json={}).status_code == 200
+    assert sleeps == [1.0]
+
+
+def test_retry_after_past_the_deadline_returns_the_error(fake_api, make_bot, sleeps):
+    server = fake_api()
+    server.scripted_errors.append((MODELS, 503, {"Retry-After": "60"}))
+    bot = make_bot()
+    bot.start_deadline(10)
+
+    response = bot._request("GET", f"{server.base_url}{MODELS}", "model check")
+
+    assert response.status_code == 503
+    assert sleeps == []
+    assert bot.deadline_exhausted_stage == "model check"
+
+
+def test_an_exhausted_deadline_stops_requests(fake_api, make_bot):
+    server = fake_api()
+    bot = make_bot()
+    bot.deadline = time.monotonic() - 1
+
+    with pytest.raises(sandwiches.DeadlineExceeded):
+        bot._request("GET", f"{server.base_url}{MODELS}", "caption")
+
+    assert server.requests == 0
+    assert bot.deadline_exhausted_stage == "caption"
@@ -0,0 +1,142 @@
+"""ImageHashIndex lookups, incremental persistence and the image cache exemption."""
+
+from __future__ import annotations
+
+import io
+import json
+import os
+import random
+import time
+
+import pytest
+
+from sandwiches import ImageHashIndex
+
+Image = pytest.importorskip("PIL.Image")
+
+
+def noise_image(seed: int, path=None, format: str = "PNG", **options) -> bytes:
+    rng = random.Random(seed)
+    image = Image.frombytes("L", (36, 32), bytes(rng.randrange(256) for _ in range(36 * 32))).resize((144, 128))
+    buffer = io.BytesIO()
+    image.convert("RGB").save(buffer, format=format, **options)
+    if path is not None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(buffer.getvalue())
+    return buffer.getvalue()
+
+
+def index_lines(index: ImageHashIndex) -> list[list]:
+    return [json.loads(line) for line in index.index_path.read_text(encoding="utf-8").splitlines()]
+
+
+@pytest.fixture
+def index(tmp_path) -> ImageHashIndex:
+    return ImageHashIndex(tmp_path / "images", tmp_path / "images" / "hash_index.jsonl")
+
+
+def test_multi_index_search_matches_a_brute_force_scan(index):
+    rng = random.Random(7)
+    values = [rng.getrandbits(64) for _ in range(2000)]
+    for number, value in enumerate(values):
+        assert index.claim(value, f"post-{number}", max_distance=-1) is None
+    # Near neighbours of indexed hashes, so every radius has matches to find.
+    queries = [value ^ sum(1 << bit for bit in rng.sample(range(64), rng.randrange(13))) for value in values[:200]]
+    queries += [rng.getrandbits(64) for _ in range(50)]
+
+    for query in queries:
+        for radius in (0, 3, 6, 12):
+            found = sorted((distance, key) for distance, (_, _, key) in index._search(query, radius))
+            expected = sorted(
+                ((value ^ query).bit_count(), f"post-{number}")
+                for number, value in enumerate(values)
+                if (value ^ query).bit_count() <= radius
+            )
+            assert found == expected
+
+
+def test_claim_returns_the_closest_recent_match(index):
+    assert index.claim(0b1111, "first", 6) is None
+    assert index.claim(0b0111, "second", 0) is None
+    assert index.claim(0b0011, "third", 6) == (1, "second")
+    assert index.claim(0b0011, "third", 6, exclude=("second",)) == (2, "first")
+
+
+def test_posts_outside_the_window_do_not_match(tmp_path):
+    index = ImageHashIndex(tmp_path, tmp_path / "hash_index.jsonl", window=60)
+    index.claim(42, "old", 6)
+    index._posts[0][1] -= 120
+    index._rebuild(index._pruned_at)
+
+    assert index.claim(42, "new", 6) is None
+
+
+def test_files_are_hashed_once_and_changes_are_appended(index, monkeypatch):
+    first, second = index.directory / "a.png", index.directory / "nested" / "b.png"
+    noise_image(1, first)
+    noise_image(2, second)
+    noise_image(3, index.directory / "pool" / "style" / "pooled.png")
+    assert len(index) == 2
+    assert [line[:2] for line in index_lines(index)] == [["file", "a.png"], ["file", "nested/b.png"]]
+
+    hashed = []
+    original = ImageHashIndex.image_hash
+    monkeypatch.setattr(
+        ImageHashIndex, "image_hash", staticmethod(lambda source: hashed.append(source) or original(source))
+    )
+
+    # A fresh instance, as in the next run, reuses every hash for unchanged files.
+    reloaded = ImageHashIndex(index.directory, index.index_path)
+    assert len(reloaded) == 2
+    assert hashed == []
+    assert reloaded.file_hash(first) == index.file_hash(first)
+    assert hashed == []
+
+    noise_image(4, first)
+    os.utime(first, ns=(0, first.stat().st_mtime_ns + 1_000_000_000))
+    second.unlink()
+    after = ImageHashIndex(index.directory, index.index_path)
+    assert len(after) == 1
+    assert hashed == [first]
+    assert [line[:2] for line in index_lines(index)[2:]] == [["file", "a.png"], ["gone", "nested/b.png"]]
+
+
+def test_posts_persist_and_expired_ones_are_compacted_away(tmp_path):
+    index = ImageHashIndex(tmp_path, tmp_path / "hash_index.jsonl", window=60)
+    for number in range(100):
+        assert index.claim(number << 20, f"post-{number}", 0) is None
+    assert len(index_lines(index)) == 100
+
+    reloaded = ImageHashIndex(tmp_path, tmp_path / "hash_index.jsonl", window=60)
+    assert reloaded.claim(7 << 20, "again", 0) == (0, "post-7")
+
+    # Once the posts expire, the stale lines outnumber the live ones and the file is rewritten.
+    reloaded._rebuild(time.time() + 120)
+    assert index.index_path.read_text(encoding="utf-8") == ""
+    assert ImageHashIndex(tmp_path, tmp_path / "hash_index.jsonl", window=60).claim(7 << 20, "later", 0) is None
+
+
+def test_scan_batch_defers_the_rest_to_later_runs(tmp_path):
+    for number in range(5):
+        noise_image(number, tmp_path / f"{number}.png")
+
+    assert len(ImageHashIndex(tmp_path, tmp_path / "hash_index.jsonl", scan_batch=2)) == 2
+    assert len(ImageHashIndex(tmp_path, tmp_path / "hash_index.jsonl", scan_batch=2)) == 4
+    assert len(ImageHashIndex(tmp_path, tmp_path / "hash_index.jsonl", scan_batch=2)) == 5
+
+
+def test_a_reused_cache_file_does_not_match_its_own_post(index):
+    image_data = noise_image(10)
+    assert index.claim_image(image_data, 6) is None
+
+    cached = index.directory / "cache" / "prompt.png"
+    cached.parent.mkdir(parents=True)
+    cached.write_bytes(image_data)
+    assert index.claim_image(cached, 6) is None
+
+    # A re-encoded copy of the same picture is still a near-duplicate.
+    recompressed = index.directory / "copy.jpg"
+    noise_image(10, recompressed, format="JPEG", quality=85)
+    distance, key = index.claim_image(recompressed, 6)
+    assert distance <= 6
+    assert key in {index.content_key(image_data), "cache/prompt.png"}
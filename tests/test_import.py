@@ -0,0 +1,36 @@
+"""Importing sandwiches must not create directories, files or logging handlers."""
+
+from __future__ import annotations
+
+import json
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+CHECK = """
+import json, logging, threading
+before = len(logging.getLogger().handlers)
+import sandwiches
+print(json.dumps({
+    "root_handlers": len(logging.getLogger().handlers) - before,
+    "module_handlers": len(logging.getLogger("sandwiches").handlers),
+    "threads": [thread.name for thread in threading.enumerate()],
+}))
+"""
+
+
+def test_import_has_no_side_effects(tmp_path):
+    data_dir = tmp_path / "data"
+    data_dir.mkdir()
+    env = {**os.environ, "SANDWICH_DATA_DIR": str(data_dir), "PYTHONPATH": str(ROOT)}
+
+    result = subprocess.run(
+        [sys.executable, "-c", CHECK], cwd=tmp_path, env=env, capture_output=True, text=True, check=True
+    )
+
+    assert json.loads(result.stdout) == {"root_handlers": 0, "module_handlers": 0, "threads": ["MainThread"]}
+    assert list(data_dir.iterdir()) == []
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["data"]
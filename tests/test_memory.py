@@ -0,0 +1,91 @@
+"""Peak memory of the image decode and upload paths, measured with tracemalloc."""
+
+from __future__ import annotations
+
+import base64
+import os
+import subprocess
+import sys
+import tracemalloc
+from pathlib import Path
+from typing import Iterator
+
+import pytest
+
+import sandwiches
+
+IMAGE_BYTES = 8 * 1024 * 1024
+BENCH_DIR = Path(__file__).resolve().parent.parent / "benchmarks"
+SERVER_SCRIPT = """
+import sys
+sys.path.insert(0, sys.argv[1])
+import bench
+server = bench.FakeApiServer(image_bytes=int(sys.argv[2]))
+print(server.base_url, flush=True)
+server.serve_forever()
+"""
+
+
+@pytest.fixture
+def server_url() -> Iterator[str]:
+    """A FakeApiServer in a child process, so the server's own buffers stay out of tracemalloc's counts."""
+    process = subprocess.Popen(
+        [sys.executable, "-c", SERVER_SCRIPT, str(BENCH_DIR), str(IMAGE_BYTES)], stdout=subprocess.PIPE, text=True
+    )
+    try:
+        yield process.stdout.readline().strip()
+    finally:
+        process.terminate()
+        process.wait()
+
+
+@pytest.fixture
+def bot(server_url: str) -> sandwiches.TurkeyProvoloneBot:
+    os.environ.update(
+        FACEBOOK_ACCESS_TOKEN="test",
+        FACEBOOK_PAGE_ID="1000",
+        FACEBOOK_GRAPH_URL=f"{server_url}/graph",
+        OPENAI_API_BASE=f"{server_url}/openai/v1",
+        OPENAI_API_KEY="test",
+        CREDENTIAL_CACHE_TTL="0",
+        IMAGE_OUTPUT_FORMAT="original",
+    )
+    return sandwiches.TurkeyProvoloneBot()
+
+
+def peak_ratio(operation, *args, **kwargs):
+    """Run ``operation`` and return its result and its peak traced allocation as a multiple of IMAGE_BYTES."""
+    tracemalloc.start()
+    try:
+        baseline = tracemalloc.get_traced_memory()[0]
+        result = operation(*args, **kwargs)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return result, (peak - baseline) / IMAGE_BYTES
+
+
+def test_decode_image_fills_one_presized_buffer(bot):
+    encoded = base64.b64encode(os.urandom(IMAGE_BYTES))
+
+    image, ratio = peak_ratio(bot._decode_image, encoded, "OpenAI")
+
+    assert isinstance(image, bytearray) and len(image) == IMAGE_BYTES
+    assert ratio < 1.25
+
+
+def test_openai_download_keeps_the_body_and_one_decoded_copy(bot):
+    images, ratio = peak_ratio(bot.generate_images_with_openai, "a sandwich")
+
+    assert [len(image) for image in images] == [IMAGE_BYTES]
+    # The raw response body (4/3 of the image) plus the decoded image; parsing the JSON would add another 4/3.
+    assert ratio < 2.75
+
+
+def test_photo_upload_streams_from_memory(bot):
+    image = b"\x89PNG\r\n\x1a\n" + os.urandom(IMAGE_BYTES - 8)
+
+    post_id, ratio = peak_ratio(bot.post_to_facebook_with_image, {"text": "Turkey and provolone"}, image_data=image)
+
+    assert post_id
+    assert ratio < 0.25
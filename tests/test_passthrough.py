@@ -0,0 +1,90 @@
+"""IMAGE_URL_PASSTHROUGH: posting Replicate's URL, the HEAD check, and falling back to an upload."""
+
+from __future__ import annotations
+
+import pytest
+
+import sandwiches
+
+PHOTOS = f"/graph/{sandwiches.FACEBOOK_API_VERSION}/1000/photos"
+
+
+@pytest.fixture
+def downloads(monkeypatch) -> list[str]:
+    """Record every generated image the bot downloads."""
+    urls: list[str] = []
+    original = sandwiches.TurkeyProvoloneBot._download_generated_image
+
+    def recorded(self, image_url):
+        urls.append(image_url)
+        return original(self, image_url)
+
+    monkeypatch.setattr(sandwiches.TurkeyProvoloneBot, "_download_generated_image", recorded)
+    return urls
+
+
+def post(make_bot, **env: str):
+    bot = make_bot(REPLICATE_API_TOKEN="test", IMAGE_URL_PASSTHROUGH="1", **env)
+    post_content, image_path, image_data = bot.prepare_post()
+    return bot, post_content, bot.publish_post(post_content, image_path, image_data)
+
+
+def test_replicate_url_is_posted_without_a_download(fake_api, make_bot, downloads):
+    server = fake_api()
+
+    bot, post_content, posted = post(make_bot, IMAGE_DEDUP="off")
+
+    assert posted
+    [(path, fields)] = server.graph_posts
+    assert path.endswith("/1000/photos")
+    assert fields["url"] == post_content["image_url"]
+    assert fields["url"].startswith(f"{server.base_url}/files/")
+    assert downloads == []
+    assert bot.metrics.counters["passthrough_images"] == 1
+
+
+def test_dedup_downloads_the_image_once_but_still_posts_the_url(fake_api, make_bot, downloads):
+    server = fake_api()
+
+    _, post_content, posted = post(make_bot, IMAGE_DEDUP="regenerate")
+
+    assert posted
+    [(_, fields)] = server.graph_posts
+    assert fields["url"] == post_content["image_url"]
+    assert downloads == [post_content["image_url"]]
+
+
+def test_rejected_url_falls_back_to_uploading_the_image(fake_api, make_bot, downloads):
+    server = fake_api()
+    server.scripted_errors.append((PHOTOS, 400, {}))
+
+    _, post_content, posted = post(make_bot, IMAGE_DEDUP="off")
+
+    assert posted
+    # The rejected URL post is not recorded; the upload that replaced it carries the file instead of a url field.
+    [(path, fields)] = server.graph_posts
+    assert path.endswith("/1000/photos")
+    assert "url" not in fields
+    assert downloads == [post_content["image_url"]]
+
+
+def test_failed_head_check_downloads_and_uploads_as_usual(fake_api, make_bot, downloads):
+    server = fake_api()
+    server.scripted_errors.append(("/files/", 404, {}))
+
+    bot, post_content, posted = post(make_bot, IMAGE_DEDUP="off")
+
+    assert posted
+    assert "image_url" not in post_content
+    [(_, fields)] = server.graph_posts
+    assert "url" not in fields
+    assert len(downloads) == 1
+    assert bot.last_image_report["winner"] == "Replicate"
+
+
+def test_head_check_rejects_a_non_image_content_type(fake_api, make_bot):
+    server = fake_api()
+    bot = make_bot()
+
+    assert bot._check_image_url(f"{server.base_url}/files/sandwich.png")
+    assert not bot._check_image_url(f"{server.base_url}/openai/v1/models")
@@ -0,0 +1,82 @@
+"""Replicate prediction waits against the fake Replicate API: sync wait, backoff polling, webhook wake-up."""
+
+from __future__ import annotations
+
+import json
+import threading
+import time
+from urllib.request import Request, urlopen
+
+import sandwiches
+
+PROMPT = "A turkey and provolone sandwich"
+
+
+def test_sync_wait_returns_without_polling(fake_api, make_bot):
+    server = fake_api(replicate_polls=3)
+    bot = make_bot(REPLICATE_API_TOKEN="test", REPLICATE_SYNC_WAIT="60")
+
+    images = bot.generate_images_with_replicate(PROMPT)
+
+    assert [bytes(image) for image in images] == [server.image]
+    assert [state["polls"] for state in server.predictions.values()] == [0]
+    assert server.requests == 2  # create and download
+
+
+def test_polls_back_off_until_the_prediction_succeeds(fake_api, make_bot, monkeypatch):
+    server = fake_api(replicate_polls=3)
+    bot = make_bot(REPLICATE_API_TOKEN="test")
+    pauses: list[float] = []
+    monkeypatch.setattr(sandwiches.time, "sleep", pauses.append)
+
+    images = bot.generate_images_with_replicate(PROMPT)
+
+    assert len(images) == 1
+    assert [state["polls"] for state in server.predictions.values()] == [3]
+    delays = [sandwiches.REPLICATE_POLL_INITIAL_DELAY * sandwiches.REPLICATE_POLL_BACKOFF**step for step in range(3)]
+    assert len(pauses) == 3
+    for pause, delay in zip(pauses, delays):
+        assert delay / 2 <= pause <= delay
+
+
+def test_webhook_wakes_the_poller_early(fake_api, make_bot, monkeypatch):
+    server = fake_api(replicate_polls=1)
+    # Without the webhook the first poll would wait at least 30 seconds.
+    monkeypatch.setattr(sandwiches, "REPLICATE_POLL_INITIAL_DELAY", 60.0)
+    bot = make_bot(
+        REPLICATE_API_TOKEN="test",
+        REPLICATE_WEBHOOK_URL="https://example.com/replicate",
+        REPLICATE_WEBHOOK_PORT="0",
+    )
+    listener = bot._replicate_webhook_listener()
+    done = threading.Event()
+
+    def deliver() -> None:
+        # Keep delivering until the bot is done, since it starts listening only after the prediction is created.
+        while not done.wait(0.05):
+            for prediction_id in list(server.predictions):
+                body = json.dumps({"id": prediction_id, "status": "succeeded"}).encode("utf-8")
+                url = f"http://127.0.0.1:{listener.port}/"
+                urlopen(Request(url, body, {"Content-Type": "application/json"}), timeout=5).close()
+
+    thread = threading.Thread(target=deliver, daemon=True)
+    thread.start()
+    started = time.monotonic()
+    try:
+        images = bot.generate_images_with_replicate(PROMPT)
+    finally:
+        done.set()
+        thread.join()
+        listener.close()
+
+    assert len(images) == 1
+    assert time.monotonic() - started < 10
+    assert [state["polls"] for state in server.predictions.values()] == [1]
+
+
+def test_webhook_listener_binds_to_loopback_by_default():
+    listener = sandwiches.ReplicateWebhookListener(0)
+    try:
+        assert listener._server.server_address[0] == "127.0.0.1"
+    finally:
+        listener.close()
@@ -0,0 +1,122 @@
+"""ProviderRouter ordering and circuit breaking with an injected clock."""
+
+from __future__ import annotations
+
+import pytest
+
+from sandwiches import ProviderRouter
+
+
+class Clock:
+    def __init__(self) -> None:
+        self.now = 1_000_000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def providers(*names: str) -> list[tuple[str, object]]:
+    return [(name, object()) for name in names]
+
+
+def names(ordered: list[tuple[str, object]]) -> list[str]:
+    return [name for name, _ in ordered]
+
+
+@pytest.fixture
+def clock() -> Clock:
+    return Clock()
+
+
+def router(tmp_path, clock: Clock, **options) -> ProviderRouter:
+    return ProviderRouter(tmp_path / "health.json", clock=clock, **options)
+
+
+def test_breaker_opens_half_opens_and_reopens(tmp_path, clock):
+    routes = router(tmp_path, clock, failure_threshold=2, cooldown=60)
+    candidates = providers("OpenAI", "Replicate")
+
+    routes.record("OpenAI", False, 1.0)
+    # One failure only lowers OpenAI's success rate, which moves it behind Replicate.
+    assert names(routes.order(candidates)) == ["Replicate", "OpenAI"]
+    routes.record("OpenAI", False, 1.0)
+    assert names(routes.order(candidates)) == ["Replicate"]
+    assert routes.health("OpenAI")["open_until"] == clock.now + 60
+
+    clock.now += 59
+    assert names(routes.order(candidates)) == ["Replicate"]
+
+    # Half-open: after the cooldown one trial attempt is allowed, and its failure reopens the circuit at once.
+    clock.now += 2
+    assert "OpenAI" in names(routes.order(candidates))
+    routes.record("OpenAI", False, 1.0)
+    assert names(routes.order(candidates)) == ["Replicate"]
+    assert routes.health("OpenAI")["open_until"] == clock.now + 60
+
+    # A successful trial closes the circuit and clears the failure streak.
+    clock.now += 61
+    routes.record("OpenAI", True, 1.0)
+    health = routes.health("OpenAI")
+    assert (health["consecutive_failures"], health["open_until"]) == (0, 0.0)
+    routes.record("OpenAI", False, 1.0)
+    assert "OpenAI" in names(routes.order(candidates))
+
+
+def test_every_circuit_open_falls_back_to_the_configured_order(tmp_path, clock):
+    routes = router(tmp_path, clock, failure_threshold=1)
+    routes.record("OpenAI", False, 1.0)
+    routes.record("Replicate", False, 1.0)
+
+    assert names(routes.order(providers("OpenAI", "Replicate"))) == ["OpenAI", "Replicate"]
+
+
+def test_latency_routing_follows_the_ewma(tmp_path, clock):
+    routes = router(tmp_path, clock, alpha=0.5)
+    candidates = providers("OpenAI", "Replicate")
+
+    routes.record("OpenAI", True, 10.0)
+    routes.record("Replicate", True, 4.0)
+    assert names(routes.order(candidates)) == ["Replicate", "OpenAI"]
+    assert routes.health("Replicate")["latency"] == 4.0
+
+    # Two slow runs pull Replicate's average above OpenAI's: 4 -> 12 -> 16.
+    routes.record("Replicate", True, 20.0)
+    assert routes.health("Replicate")["latency"] == 12.0
+    assert names(routes.order(candidates)) == ["OpenAI", "Replicate"]
+    routes.record("Replicate", True, 20.0)
+    assert routes.health("Replicate")["latency"] == 16.0
+
+
+def test_failures_lower_the_success_rate_in_the_score(tmp_path, clock):
+    routes = router(tmp_path, clock, alpha=0.5, failure_threshold=10)
+    candidates = providers("OpenAI", "Replicate")
+    routes.record("OpenAI", True, 5.0)
+    routes.record("Replicate", True, 4.0)
+
+    # A failure halves Replicate's success rate, so its score goes from 4 to 4 / 0.5 = 8, behind OpenAI's 5.
+    routes.record("Replicate", False, 30.0)
+    assert routes.health("Replicate")["success_rate"] == 0.5
+    assert routes.health("Replicate")["latency"] == 4.0
+    assert names(routes.order(candidates)) == ["OpenAI", "Replicate"]
+
+
+def test_cost_and_fixed_strategies(tmp_path, clock):
+    candidates = providers("OpenAI", "Stability AI", "Replicate")
+    costs = {"OpenAI": 0.04, "Stability AI": 0.01, "Replicate": 0.02}
+
+    assert names(router(tmp_path, clock, strategy="cost", costs=costs).order(candidates)) == [
+        "Stability AI",
+        "Replicate",
+        "OpenAI",
+    ]
+    fixed = router(tmp_path / "fixed", clock, strategy="fixed")
+    fixed.record("OpenAI", True, 100.0)
+    assert names(fixed.order(candidates)) == ["OpenAI", "Stability AI", "Replicate"]
+
+
+def test_health_persists_across_instances(tmp_path, clock):
+    router(tmp_path, clock).record("OpenAI", True, 3.0)
+
+    health = router(tmp_path, clock).health("OpenAI")
+
+    assert (health["samples"], health["successes"], health["latency"]) == (1, 1, 3.0)
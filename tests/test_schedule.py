@@ -0,0 +1,129 @@
+"""CronSchedule matching and the long-running scheduled mode."""
+
+from __future__ import annotations
+
+import json
+import threading
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from sandwiches import CronSchedule
+
+
+def at(text: str) -> datetime:
+    return datetime.fromisoformat(text).replace(tzinfo=timezone.utc)
+
+
+def upcoming(expression: str, start: str, count: int) -> list[str]:
+    schedule = CronSchedule(expression)
+    moment = at(start)
+    found = []
+    for _ in range(count):
+        moment = schedule.next_after(moment)
+        found.append(moment.strftime("%Y-%m-%d %H:%M"))
+    return found
+
+
+def test_steps_and_ranges():
+    assert upcoming("*/20 9-10 * * *", "2024-03-01 08:59", 7) == [
+        "2024-03-01 09:00",
+        "2024-03-01 09:20",
+        "2024-03-01 09:40",
+        "2024-03-01 10:00",
+        "2024-03-01 10:20",
+        "2024-03-01 10:40",
+        "2024-03-02 09:00",
+    ]
+    assert upcoming("5-20/5 12 * * *", "2024-03-01 12:05", 3) == [
+        "2024-03-01 12:10",
+        "2024-03-01 12:15",
+        "2024-03-01 12:20",
+    ]
+
+
+def test_result_is_strictly_after_the_start():
+    assert upcoming("30 12 * * *", "2024-03-01 12:30:15", 1) == ["2024-03-02 12:30"]
+
+
+def test_day_of_month_or_day_of_week_when_both_are_restricted():
+    # 2024-03-01 is a Friday; the 13th or any Monday matches.
+    assert upcoming("0 8 13 * 1", "2024-03-01 00:00", 4) == [
+        "2024-03-04 08:00",
+        "2024-03-11 08:00",
+        "2024-03-13 08:00",
+        "2024-03-18 08:00",
+    ]
+
+
+def test_starred_day_field_does_not_widen_the_other():
+    # Every other day of the month, but only on Mondays.
+    assert upcoming("0 8 */2 * 1", "2024-03-01 00:00", 2) == ["2024-03-11 08:00", "2024-03-25 08:00"]
+
+
+def test_year_wrap_and_leap_day():
+    assert upcoming("0 0 1 1 *", "2024-06-01 00:00", 1) == ["2025-01-01 00:00"]
+    assert upcoming("0 12 29 2 *", "2024-03-01 00:00", 1) == ["2028-02-29 12:00"]
+
+
+def test_weekday_seven_is_sunday():
+    assert upcoming("0 9 * * 7", "2024-03-01 00:00", 2) == ["2024-03-03 09:00", "2024-03-10 09:00"]
+    assert CronSchedule("0 9 * * 7").weekdays == CronSchedule("0 9 * * 0").weekdays == {0}
+
+
+@pytest.mark.parametrize("expression", ["* * * *", "60 * * * *", "* * 0 * *", "*/0 * * * *", "5-1 * * * *"])
+def test_invalid_expressions(expression):
+    with pytest.raises(ValueError):
+        CronSchedule(expression)
+
+
+def test_impossible_date_never_matches():
+    with pytest.raises(ValueError):
+        CronSchedule("0 0 31 2 *").next_after(at("2024-01-01 00:00"))
+
+
+class EveryInstant:
+    expression = "test"
+
+    def next_after(self, moment: datetime) -> datetime:
+        return moment + timedelta(seconds=0.05)
+
+
+def test_a_failing_slot_is_logged_and_the_schedule_continues(make_bot, monkeypatch, tmp_path):
+    bot = make_bot()
+    stop_event = threading.Event()
+    calls = {"prepare": 0, "publish": 0}
+    published = []
+
+    def prepare_post():
+        calls["prepare"] += 1
+        if calls["prepare"] == 1:
+            raise RuntimeError("caption generator broke")
+        return {"text": f"post {calls['prepare']}"}, None, b"image"
+
+    def publish_post(post_content, image_path, image_data=None):
+        calls["publish"] += 1
+        if calls["publish"] == 1:
+            raise RuntimeError("upload broke")
+        published.append(post_content["text"])
+        stop_event.set()
+        return True
+
+    saved = []
+    monkeypatch.setattr(bot, "prepare_post", prepare_post)
+    monkeypatch.setattr(bot, "publish_post", publish_post)
+    monkeypatch.setattr(bot, "save_failed_post", lambda *args: saved.append(args))
+    monkeypatch.setattr(bot, "write_run_report", lambda run: None)
+    heartbeat = tmp_path / "heartbeat.json"
+
+    bot.run_scheduled(EveryInstant(), stop_event, lead_seconds=0, heartbeat_path=heartbeat)
+
+    # Slot 1 failed to prepare, slot 2 failed to publish and was queued, slot 3 posted.
+    assert calls == {"prepare": 3, "publish": 2}
+    assert published == ["post 3"]
+    assert [args[0]["text"] for args in saved] == ["post 2"]
+    assert bot.metrics.counters["scheduled_failures"] == 2
+    state = json.loads(heartbeat.read_text())
+    assert state["state"] == "stopped"
+    assert state["posts"] == 1
+
@@ -0,0 +1,116 @@
+"""ShopRegistry indexes, snapshot reuse and the featured shop rotation."""
+
+from __future__ import annotations
+
+import json
+import os
+
+import pytest
+
+from sandwiches import ShopRegistry
+
+BUILTIN = [
+    {"name": "Deli Supreme", "location": "Downtown", "status": "open"},
+    {"name": "Provolone Palace", "location": "Uptown", "status": "open"},
+]
+FILE_SHOPS = [
+    {"name": "  Turkey Town ", "location": "Downtown", "status": "closed", "specialty": "Smoked turkey"},
+    {"name": "deli supreme", "location": "Elsewhere"},
+    {"name": "Turkey Tavern", "location": "downtown ", "status": "Open"},
+    {"name": "Turkey Town", "location": "Duplicate"},
+    {"name": ""},
+    "not a shop",
+    {"name": "Hero Heaven", "status": "open", "rating": 5},
+]
+
+
+@pytest.fixture
+def registry(tmp_path) -> ShopRegistry:
+    path = tmp_path / "shops.json"
+    path.write_text(json.dumps(FILE_SHOPS), encoding="utf-8")
+    return ShopRegistry(BUILTIN, path=path, snapshot_path=tmp_path / "snapshot.json")
+
+
+def names(shops: list[dict[str, str]]) -> list[str]:
+    return [shop["name"] for shop in shops]
+
+
+def test_file_shops_are_validated_and_deduplicated(registry):
+    assert names(registry.shops()) == [
+        "Deli Supreme",
+        "Provolone Palace",
+        "Turkey Town",
+        "Turkey Tavern",
+        "Hero Heaven",
+    ]
+    # The built-in shop wins over a file entry with the same name.
+    assert registry.get(" DELI supreme ")["location"] == "Downtown"
+    assert registry.get("turkey town") == {
+        "name": "Turkey Town",
+        "location": "Downtown",
+        "status": "closed",
+        "specialty": "Smoked turkey",
+    }
+    assert registry.get("Hero Heaven")["rating"] == "5"
+    assert registry.get("Nowhere") is None
+
+
+def test_location_and_status_indexes_ignore_case(registry):
+    assert names(registry.by_location("downtown")) == ["Deli Supreme", "Turkey Town", "Turkey Tavern"]
+    assert names(registry.by_status("OPEN")) == ["Deli Supreme", "Provolone Palace", "Turkey Tavern", "Hero Heaven"]
+    assert list(registry.ids("closed")) == [2]
+    assert list(registry.ids()) == [0, 1, 2, 3, 4]
+
+
+def test_prefix_and_fuzzy_search(registry):
+    assert names(registry.search_prefix("turkey t")) == ["Turkey Tavern", "Turkey Town"]
+    assert names(registry.search_prefix("turkey", limit=1)) == ["Turkey Tavern"]
+    assert registry.search_prefix("zzz") == []
+    assert names(registry.search("provolone palce"))[0] == "Provolone Palace"
+    assert registry.search("   ") == []
+
+
+def test_unchanged_file_loads_from_the_snapshot(registry, tmp_path, caplog):
+    registry.refresh()
+    assert (tmp_path / "snapshot.json").is_file()
+    assert registry.refresh() is False
+
+    caplog.set_level("INFO", logger="sandwiches")
+    reloaded = ShopRegistry(BUILTIN, path=registry.path, snapshot_path=tmp_path / "snapshot.json")
+    assert len(reloaded) == 5
+    assert "Loaded 4 shops from snapshot" in caplog.text
+    assert reloaded.signature == registry.signature
+
+
+def test_changed_file_is_reloaded_and_reindexed(registry):
+    assert names(registry.by_status("closed")) == ["Turkey Town"]
+    signature = registry.signature
+
+    registry.path.write_text(json.dumps([{"name": "Club Corner", "status": "closed"}]), encoding="utf-8")
+    stat = registry.path.stat()
+    os.utime(registry.path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+
+    assert registry.refresh() is True
+    assert names(registry.by_status("closed")) == ["Club Corner"]
+    assert registry.get("Turkey Town") is None
+    assert registry.signature != signature
+
+
+def test_featured_shops_rotate_without_repeats(make_bot, registry):
+    bot = make_bot(FEATURED_SHOP_STATUS="open", CAPTION_SEED="seed")
+    bot.shop_registry = registry
+    open_shops = set(names(registry.by_status("open")))
+
+    posts = [bot.generate_featured_shop_post() for _ in range(len(open_shops) * 2)]
+
+    assert all(post["post_type"] == "featured_shop" for post in posts)
+    first, second = [post["shop"] for post in posts[:4]], [post["shop"] for post in posts[4:]]
+    assert set(first) == set(second) == open_shops
+    assert len(first) == len(set(first))
+
+
+def test_no_featured_shop_when_none_match(make_bot, registry):
+    bot = make_bot(FEATURED_SHOP_STATUS="retired")
+    bot.shop_registry = registry
+
+    assert bot.generate_featured_shop_post() is None